@@ -0,0 +1,97 @@
+"""Measures how much an imported BuildKit cache speeds up `sagemaker-image-builder build` on a fresh runner.
+
+The benchmark builds a synthetic image (whose expensive step stands in for solving and downloading the conda
+environment) twice with a dedicated buildx builder: a cold build which exports its cache to a local directory, and,
+after pruning all of the builder's state, a warm build which imports that cache. Requires docker with buildx.
+
+    python benchmarks/buildkit_cache_benchmark.py --step-seconds 30
+"""
+
+import argparse
+import os
+import subprocess
+import tempfile
+import time
+
+from sagemaker_image_builder.main import _get_docker_build_command, _run_docker_build
+from sagemaker_image_builder.utils import create_markdown_table
+
+_BUILDER_NAME = "sagemaker-image-builder-benchmark"
+
+_DOCKERFILE = """ARG BASE_IMAGE
+FROM $BASE_IMAGE
+ARG STEP_SECONDS
+ARG LAYER_SIZE_MB
+# Stands in for `micromamba install`: slow, and produces a large layer.
+RUN sleep $STEP_SECONDS && dd if=/dev/urandom of=/opt/env.bin bs=1M count=$LAYER_SIZE_MB
+COPY env.in /opt/env.in
+"""
+
+
+def _build(build_context_dir: str, config: dict, log_dir: str, name: str) -> float:
+    image_id_file_path = os.path.join(log_dir, f"{name}.iid")
+    command = _get_docker_build_command(build_context_dir, config, image_id_file_path)
+    start = time.perf_counter()
+    _run_docker_build(command, os.path.join(log_dir, f"{name}.log"), f"[{name}]", image_id_file_path)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-image", default="busybox:1.36")
+    parser.add_argument("--step-seconds", type=int, default=20, help="Duration of the simulated environment solve.")
+    parser.add_argument("--layer-size-mb", type=int, default=256, help="Size of the simulated environment layer.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        build_context_dir = os.path.join(work_dir, "context")
+        cache_dir = os.path.join(work_dir, "buildkit-cache")
+        os.makedirs(build_context_dir)
+        with open(os.path.join(build_context_dir, "Dockerfile"), "w") as f:
+            f.write(_DOCKERFILE)
+        with open(os.path.join(build_context_dir, "env.in"), "w") as f:
+            f.write("conda-forge::python\n")
+        # _get_docker_build_command builds './<dir>', so build relative to the work dir.
+        original_dir = os.getcwd()
+        os.chdir(work_dir)
+        config = {
+            "build_args": {
+                "BASE_IMAGE": args.base_image,
+                "STEP_SECONDS": args.step_seconds,
+                "LAYER_SIZE_MB": args.layer_size_mb,
+            },
+        }
+
+        # Exporting the cache requires a builder with the docker-container driver.
+        subprocess.run(
+            ["docker", "buildx", "create", "--name", _BUILDER_NAME, "--driver", "docker-container"], check=True
+        )
+        os.environ["BUILDX_BUILDER"] = _BUILDER_NAME
+        try:
+            cold_seconds = _build(
+                "context", dict(config, cache_to=f"type=local,dest={cache_dir},mode=max"), work_dir, "cold"
+            )
+            # Simulate a fresh CI runner: the builder has no local state left, only the exported cache.
+            subprocess.run(["docker", "buildx", "prune", "--all", "--force"], check=True)
+            warm_seconds = _build("context", dict(config, cache_from=f"type=local,src={cache_dir}"), work_dir, "warm")
+        finally:
+            subprocess.run(["docker", "buildx", "rm", _BUILDER_NAME], check=False)
+            os.chdir(original_dir)
+
+    print(
+        create_markdown_table(
+            ["Build", "Duration (s)", "Speedup"],
+            [
+                {"build": "cold (exports cache)", "duration": f"{cold_seconds:.1f}", "speedup": "1.0x"},
+                {
+                    "build": "warm (imports cache)",
+                    "duration": f"{warm_seconds:.1f}",
+                    "speedup": f"{cold_seconds / warm_seconds:.1f}x",
+                },
+            ],
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
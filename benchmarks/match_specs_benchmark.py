@@ -0,0 +1,87 @@
+"""Compares parsing an env.out file with conda on every call, with the native env_parser, and with the cache.
+
+Generates a synthetic env.out with the given number of packages and reads it as many times as e.g. creating a new
+version, generating the change logs and release notes, and the package reports would. Requires conda.
+
+    python benchmarks/match_specs_benchmark.py --packages 1000 --reads 20
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from sagemaker_image_builder.env_parser import parse_env_file
+from sagemaker_image_builder.utils import (
+    _env_file_cache,
+    _parse_match_specs,
+    create_markdown_table,
+    get_match_specs,
+)
+
+
+def _write_env_out(file_path: str, package_count: int):
+    with open(file_path, "w") as f:
+        f.write("# This file may be used to create an environment using:\n")
+        f.write("# $ conda create --name <env> --file <this file>\n")
+        f.write("# platform: linux-64\n")
+        f.write("@EXPLICIT\n")
+        for i in range(package_count):
+            f.write(
+                f"https://conda.anaconda.org/conda-forge/linux-64/package-{i}-1.{i % 50}.{i % 7}-py311h{i:07x}_0.conda"
+                f"#{i:032x}\n"
+            )
+    # Recently modified files aren't cached.
+    mtime = time.time() - 60
+    os.utime(file_path, (mtime, mtime))
+
+
+def _time_reads(func, file_path: str, reads: int) -> float:
+    start = time.perf_counter()
+    for _ in range(reads):
+        func(file_path)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--packages", type=int, default=1000)
+    parser.add_argument("--reads", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        env_out_file_path = os.path.join(work_dir, "cpu.env.out")
+        _write_env_out(env_out_file_path, args.packages)
+        uncached_seconds = _time_reads(_parse_match_specs, env_out_file_path, args.reads)
+        native_seconds = _time_reads(parse_env_file, env_out_file_path, args.reads)
+        _env_file_cache.clear()
+        cached_seconds = _time_reads(get_match_specs, env_out_file_path, args.reads)
+
+    print(
+        create_markdown_table(
+            ["Mode", f"Total for {args.reads} reads (ms)", "Per read (ms)"],
+            [
+                {
+                    "mode": "conda on every read",
+                    "total": f"{uncached_seconds * 1000:.1f}",
+                    "per_read": f"{uncached_seconds * 1000 / args.reads:.2f}",
+                },
+                {
+                    "mode": "env_parser on every read",
+                    "total": f"{native_seconds * 1000:.1f}",
+                    "per_read": f"{native_seconds * 1000 / args.reads:.2f}",
+                },
+                {
+                    "mode": "cached (conda)",
+                    "total": f"{cached_seconds * 1000:.1f}",
+                    "per_read": f"{cached_seconds * 1000 / args.reads:.2f}",
+                },
+            ],
+        )
+    )
+    print(f"env_parser speedup: {uncached_seconds / native_seconds:.1f}x")
+    print(f"Cache speedup: {uncached_seconds / cached_seconds:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
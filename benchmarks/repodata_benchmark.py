@@ -0,0 +1,122 @@
+"""Compares loading a channel's repodata whole with json.load against the streaming parser of the package index.
+
+Generates a synthetic repodata.json (and repodata.json.zst, if zstandard is installed) with the given number of
+packages and versions, and measures the duration and the peak memory of indexing all of it, and of only keeping the
+records of as many packages as an image report looks up. Peak memory is measured with tracemalloc in a separate run,
+since tracing slows down the parsing.
+
+    python benchmarks/repodata_benchmark.py --packages 20000 --versions 20 --lookups 60
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+from sagemaker_image_builder.package_index import PackageIndex
+from sagemaker_image_builder.utils import create_markdown_table, sizeof_fmt
+
+
+def _write_repodata(subdir_dir: str, package_count: int, version_count: int):
+    packages = {}
+    for i in range(package_count):
+        for j in range(version_count):
+            build = f"py311h{i:07x}_{j}"
+            packages[f"package-{i}-1.{j}.0-{build}.conda"] = {
+                "build": build,
+                "build_number": j,
+                "depends": [f"package-{(i + k) % package_count} >=1.0" for k in range(1, 6)] + ["python >=3.11"],
+                "license": "BSD-3-Clause",
+                "md5": f"{i * version_count + j:032x}",
+                "name": f"package-{i}",
+                "sha256": f"{i * version_count + j:064x}",
+                "size": 1024 * (i + j + 1),
+                "subdir": "linux-64",
+                "timestamp": 1700000000000 + j,
+                "version": f"1.{j}.0",
+            }
+    repodata_file_path = os.path.join(subdir_dir, "repodata.json")
+    with open(repodata_file_path, "w") as f:
+        json.dump({"info": {"subdir": "linux-64"}, "packages": {}, "packages.conda": packages}, f, indent=1)
+    return repodata_file_path
+
+
+def _load_whole(channel_dir: str):
+    # The package index before the streaming parser.
+    with open(os.path.join(channel_dir, "linux-64", "repodata.json")) as f:
+        repodata = json.load(f)
+    records = {}
+    for key in ("packages", "packages.conda"):
+        for file_name, record in repodata.get(key, {}).items():
+            records.setdefault(record["name"], []).append(record)
+    return records
+
+
+def _load_streaming(channel_alias: str, package_names):
+    package_index = PackageIndex(channel_alias=channel_alias, package_names=package_names)
+    return package_index._load_repodata("channel", "linux-64")
+
+
+def _measure(func, *args) -> (float, int):
+    start = time.perf_counter()
+    func(*args)
+    seconds = time.perf_counter() - start
+    tracemalloc.start()
+    func(*args)
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, peak_bytes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--packages", type=int, default=20000)
+    parser.add_argument("--versions", type=int, default=20)
+    parser.add_argument("--lookups", type=int, default=60, help="Number of packages an image report looks up.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        channel_dir = os.path.join(work_dir, "channel")
+        subdir_dir = os.path.join(channel_dir, "linux-64")
+        os.makedirs(subdir_dir)
+        repodata_file_path = _write_repodata(subdir_dir, args.packages, args.versions)
+        print(f"repodata.json: {sizeof_fmt(os.path.getsize(repodata_file_path))}")
+        package_names = {f"package-{i}" for i in range(0, args.packages, max(1, args.packages // args.lookups))}
+
+        channel_alias = "file://" + work_dir
+        modes = [
+            ("json.load, all packages", _load_whole, (channel_dir,)),
+            ("streaming, all packages", _load_streaming, (channel_alias, None)),
+            (f"streaming, {len(package_names)} packages", _load_streaming, (channel_alias, package_names)),
+        ]
+        # With zstandard installed, the package index reads repodata.json.zst rather than repodata.json.
+        if importlib.util.find_spec("zstandard") is not None:
+            import zstandard
+
+            compressed_repodata_dir = os.path.join(work_dir, "zst")
+            os.makedirs(os.path.join(compressed_repodata_dir, "channel", "linux-64"))
+            with open(repodata_file_path, "rb") as f_in, open(
+                os.path.join(compressed_repodata_dir, "channel", "linux-64", "repodata.json.zst"), "wb"
+            ) as f_out:
+                zstandard.ZstdCompressor().copy_stream(f_in, f_out)
+            modes.append(
+                (
+                    f"streaming .json.zst, {len(package_names)} packages",
+                    _load_streaming,
+                    ("file://" + compressed_repodata_dir, package_names),
+                )
+            )
+
+        rows = []
+        for name, func, func_args in modes:
+            seconds, peak_bytes = _measure(func, *func_args)
+            rows.append({"mode": name, "duration": f"{seconds:.2f}", "peak_memory": sizeof_fmt(peak_bytes)})
+
+    print(create_markdown_table(["Mode", "Duration (s)", "Peak memory (tracemalloc)"], rows))
+
+
+if __name__ == "__main__":
+    main()
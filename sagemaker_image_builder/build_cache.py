@@ -0,0 +1,80 @@
+import glob
+import hashlib
+import json
+import os
+import threading
+
+_DEFAULT_BUILD_CACHE_FILE = os.path.join(
+    os.path.expanduser("~"), ".cache", "sagemaker-image-builder", "build-cache.json"
+)
+# Bump this whenever the set of inputs that go into a build key changes, so that stale entries are never reused.
+_BUILD_KEY_FORMAT_VERSION = "1"
+
+# Images of different image configs are built concurrently, so updates to the cache manifest need to be serialized.
+_build_cache_lock = threading.Lock()
+
+
+def _get_build_input_files(target_version_dir: str, config: dict) -> list[str]:
+    build_input_files = {"Dockerfile"}
+    # Any build arg which refers to a file in the build context (e.g. ENV_IN_FILENAME, ARG_BASED_ENV_IN_FILENAME) is an
+    # input to the build.
+    for value in config["build_args"].values():
+        if os.path.isfile(os.path.join(target_version_dir, str(value))):
+            build_input_files.add(str(value))
+    for file_path in glob.glob(f"{target_version_dir}/patch_*"):
+        build_input_files.add(os.path.relpath(file_path, target_version_dir))
+    for root, _, file_names in os.walk(os.path.join(target_version_dir, "dirs")):
+        for file_name in file_names:
+            build_input_files.add(os.path.relpath(os.path.join(root, file_name), target_version_dir))
+    return sorted(build_input_files)
+
+
+def get_build_key(target_version_dir: str, config: dict) -> str:
+    """Returns a content hash of all the inputs of a docker build for the given image config.
+
+    The inputs are the Dockerfile, the 'dirs' directory, the patch files, the files referred to by the build args
+    (e.g. the env.in or env.out file which is used to create the conda environment) and the build args themselves.
+    """
+    build_key = hashlib.sha256()
+    build_key.update(f"format={_BUILD_KEY_FORMAT_VERSION}\0".encode())
+    build_key.update(json.dumps(config["build_args"], sort_keys=True).encode() + b"\0")
+    for relative_path in _get_build_input_files(target_version_dir, config):
+        file_path = os.path.join(target_version_dir, relative_path)
+        if not os.path.isfile(file_path):
+            continue
+        file_hash = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                file_hash.update(chunk)
+        # The executable bit is preserved when files are copied into the image, so it's part of the key as well.
+        is_executable = os.access(file_path, os.X_OK)
+        build_key.update(f"{relative_path}\0{is_executable}\0{file_hash.hexdigest()}\0".encode())
+    return build_key.hexdigest()
+
+
+def _read_build_cache(build_cache_file: str) -> dict[str, str]:
+    if not os.path.isfile(build_cache_file):
+        return {}
+    try:
+        with open(build_cache_file, "r") as f:
+            return json.load(f)
+    except ValueError:
+        print(f"[WARN]: Ignoring the build cache because {build_cache_file} is not a valid json file.")
+        return {}
+
+
+def get_cached_image_id(build_cache_file: str, build_key: str):
+    with _build_cache_lock:
+        return _read_build_cache(build_cache_file).get(build_key)
+
+
+def record_image_id(build_cache_file: str, build_key: str, image_id: str):
+    with _build_cache_lock:
+        build_cache = _read_build_cache(build_cache_file)
+        build_cache[build_key] = image_id
+        os.makedirs(os.path.dirname(build_cache_file) or ".", exist_ok=True)
+        # Write to a temporary file first, so that an interrupted run never leaves a corrupt manifest behind.
+        temp_file = f"{build_cache_file}.{os.getpid()}.tmp"
+        with open(temp_file, "w") as f:
+            json.dump(build_cache, f, indent=2, sort_keys=True)
+        os.replace(temp_file, build_cache_file)
@@ -0,0 +1,128 @@
+import json
+import os
+import tarfile
+import tempfile
+
+_DEFAULT_CONDA_PREFIX = "/opt/conda"
+
+
+def read_conda_meta_records_from_tar(tar_file) -> list[dict]:
+    # Every installed package has a <name>-<version>-<build>.json record in the conda-meta directory of the prefix.
+    records = []
+    for member in tar_file:
+        if member.isfile() and member.name.endswith(".json") and os.path.dirname(member.name).endswith("conda-meta"):
+            records.append(json.load(tar_file.extractfile(member)))
+    return records
+
+
+def read_conda_meta_records_from_prefix(conda_prefix: str) -> list[dict]:
+    """Reads the conda-meta records of the given conda prefix."""
+    records = []
+    for entry in os.scandir(os.path.join(conda_prefix, "conda-meta")):
+        if entry.name.endswith(".json") and entry.is_file():
+            with open(entry.path, "r", encoding="utf-8") as f:
+                records.append(json.load(f))
+    return records
+
+
+def read_conda_meta_records_from_image(docker_client, image_id: str, conda_prefix: str = _DEFAULT_CONDA_PREFIX):
+    """Reads the conda-meta records of the given conda prefix straight from the file system of the given image.
+
+    The container is only created to get access to the image file system, it's never started. So this works
+    regardless of the entrypoint of the image, and without paying for the container start-up.
+    """
+    container = docker_client.containers.create(image=image_id)
+    try:
+        bits, _ = container.get_archive(f"{conda_prefix}/conda-meta")
+        # conda-meta can be tens of MBs for large environments, spill over to disk rather than keeping it in memory.
+        with tempfile.SpooledTemporaryFile(max_size=64 * 1024 * 1024) as archive:
+            for chunk in bits:
+                archive.write(chunk)
+            archive.seek(0)
+            with tarfile.open(fileobj=archive, mode="r|") as tar_file:
+                return read_conda_meta_records_from_tar(tar_file)
+    finally:
+        container.remove(force=True)
+
+
+def _get_installed_sizes(records: list[dict]) -> dict[str, int]:
+    # The installed size of a package is the sum of the sizes of the files it installed into the prefix, as listed in
+    # the paths_data of its conda-meta record. A file is only stored once on disk, even if several packages list it
+    # (e.g. a file clobbered by another package), and identical files (same sha256 and size) are counted as one, like
+    # hard links to the same file. Every file is only counted for the first package (by name) which lists it.
+    installed_sizes = {}
+    counted_paths = set()
+    counted_contents = set()
+    for record in sorted(records, key=lambda r: r["name"]):
+        installed_size = 0
+        for path_data in record.get("paths_data", {}).get("paths", []):
+            # Symbolic links and directories take no space of their own.
+            if path_data.get("path_type") in ("softlink", "directory") or path_data["_path"] in counted_paths:
+                continue
+            counted_paths.add(path_data["_path"])
+            size = path_data.get("size_in_bytes", 0)
+            if path_data.get("sha256"):
+                content = (path_data["sha256"], size)
+                if content in counted_contents:
+                    continue
+                counted_contents.add(content)
+            installed_size += size
+        installed_sizes[record["name"]] = installed_size
+    return installed_sizes
+
+
+def get_package_metadata(records: list[dict]) -> dict[str, dict]:
+    """Returns the version, the size of the archive and the installed size of every package in the given conda-meta
+    records, largest archive first.
+    """
+    installed_sizes = _get_installed_sizes(records)
+    package_metadata = {
+        r["name"]: {"version": r["version"], "size": r["size"], "installed_size": installed_sizes[r["name"]]}
+        for r in records
+    }
+    return dict(sorted(package_metadata.items(), key=lambda item: item[1]["size"], reverse=True))
+
+
+def _get_dependency_name(dependency_spec: str) -> str:
+    # e.g. 'python >=3.8', 'libgcc-ng >=12' or '__glibc >=2.17,<3.0.a0'
+    return dependency_spec.split()[0].split("[")[0]
+
+
+def _sort_records_topologically(records: list[dict]) -> list[dict]:
+    # Like `conda list --explicit`, list every package after its dependencies. Packages which don't depend on each
+    # other are listed in alphabetical order.
+    records_by_name = {r["name"]: r for r in records}
+    dependencies = {
+        name: {_get_dependency_name(d) for d in r.get("depends", [])} & records_by_name.keys() - {name}
+        for name, r in records_by_name.items()
+    }
+    sorted_records = []
+    remaining_names = sorted(records_by_name)
+    while remaining_names:
+        sorted_names = {r["name"] for r in sorted_records}
+        ready_names = [n for n in remaining_names if dependencies[n] <= sorted_names]
+        if not ready_names:
+            # Break dependency cycles (e.g. python <-> pip) by picking the alphabetically first package.
+            ready_names = remaining_names[:1]
+        sorted_records.extend(records_by_name[n] for n in ready_names)
+        ready_names = set(ready_names)
+        remaining_names = [n for n in remaining_names if n not in ready_names]
+    return sorted_records
+
+
+def get_explicit_env(records: list[dict]) -> str:
+    """Returns the same explicit environment specification as `conda list --explicit` for the given records."""
+    subdirs = {r.get("subdir") for r in records} - {None, "noarch"}
+    platform = sorted(subdirs)[0] if subdirs else "noarch"
+    lines = [
+        "# This file may be used to create an environment using:",
+        "# $ conda create --name <env> --file <this file>",
+        f"# platform: {platform}",
+        "@EXPLICIT",
+    ]
+    for record in _sort_records_topologically(records):
+        # Packages installed from sources other than a channel (e.g. conda develop) don't have a url.
+        if not record.get("url"):
+            continue
+        lines.append(record["url"] + (f"#{record['md5']}" if record.get("md5") else ""))
+    return "\n".join(lines) + "\n"
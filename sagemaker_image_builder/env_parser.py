@@ -0,0 +1,116 @@
+import re
+
+# Explicit package urls as written by `conda list --explicit`, e.g.
+# https://conda.anaconda.org/conda-forge/linux-64/numpy-1.24.2-py38h10c12cc_0.conda#05592c85b9f6931dc2df1e80c0d56294
+_EXPLICIT_URL_PATTERN = re.compile(
+    r"https://conda\.anaconda\.org/(?P<channel>[A-Za-z0-9_.\-]+)/(?P<subdir>noarch|[a-z0-9]+-[a-z0-9_]+)/"
+    r"(?P<fn>(?P<name>[a-z0-9_.\-]+)-(?P<version>[A-Za-z0-9_.+!]+)-(?P<build>[A-Za-z0-9_.+]+)(?:\.conda|\.tar\.bz2))"
+    r"(?:#(?P<md5>[a-f0-9]{32}))?"
+)
+# Specs as written by _create_new_version_conda_specs, e.g. conda-forge::numpy[version='>=1.24.2,<1.25.0']
+# Versions which conda rewrites (e.g. '=1.2' becomes '1.2.*') or which contain whitespace are left to conda.
+_CHANNEL_SPEC_PATTERN = re.compile(
+    r"(?P<channel>[A-Za-z0-9_.\-]+)::(?P<name>[a-z0-9_.\-]+)"
+    r"(?:\[version=(?P<quote>['\"])(?P<version>(?:==|[^=\s'\"])[^\s'\"\[\]]*)(?P=quote)\])?"
+)
+_VERSION_OPERATOR_CHARACTERS = set("<>=!~*,|")
+
+
+class EnvRecord:
+    """A package in an env.in or env.out file.
+
+    For env.out files the version is the exact version of the installed package, while for env.in files it's the
+    version spec (e.g. '>=1.24.2,<1.25.0'), if any. Fields which aren't part of the line are None, e.g. the file name
+    (e.g. 'numpy-1.24.2-py38h10c12cc_0.conda') is only known for explicit urls.
+
+    Records are immutable, since the parsed env files (see utils.get_env_records) are shared by all callers.
+    """
+
+    __slots__ = ("channel", "subdir", "name", "version", "build", "md5", "fn")
+
+    def __init__(self, name, channel=None, subdir=None, version=None, build=None, md5=None, fn=None):
+        for slot, value in zip(self.__slots__, (channel, subdir, name, version, build, md5, fn)):
+            object.__setattr__(self, slot, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"EnvRecord is immutable, can't set {name}")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"EnvRecord is immutable, can't delete {name}")
+
+    @property
+    def is_exact_version(self) -> bool:
+        return self.version is not None and not _VERSION_OPERATOR_CHARACTERS & set(self.version)
+
+    def to_match_spec_str(self) -> str:
+        # e.g. 'conda-forge/linux-64::numpy==1.24.2=py38h10c12cc_0', which can be passed to e.g. `conda search`.
+        spec = self.name
+        if self.channel:
+            spec = f"{self.channel}/{self.subdir}::{spec}" if self.subdir else f"{self.channel}::{spec}"
+        if self.version:
+            spec += f"=={self.version}" if self.is_exact_version else self.version
+            if self.build:
+                spec += f"={self.build}"
+        return spec
+
+    def __eq__(self, other):
+        return isinstance(other, EnvRecord) and all(getattr(self, s) == getattr(other, s) for s in self.__slots__)
+
+    def __hash__(self):
+        return hash(tuple(getattr(self, s) for s in self.__slots__))
+
+    def __repr__(self):
+        return "EnvRecord(" + ", ".join(f"{s}={getattr(self, s)!r}" for s in self.__slots__) + ")"
+
+
+def _normalize_version(version):
+    # Exact versions are stored without the '==' prefix, e.g. '1.24.2' rather than '==1.24.2'.
+    if version is not None and version.startswith("==") and not _VERSION_OPERATOR_CHARACTERS & set(version[2:]):
+        return version[2:]
+    return version
+
+
+def _get_record_from_match_spec(line: str) -> EnvRecord:
+    # Lines which aren't in one of the formats we write are left to conda.
+    from conda.models.match_spec import MatchSpec
+
+    match_spec = MatchSpec(line)
+    channel = match_spec.get("channel")
+    version = match_spec.get("version")
+    build = match_spec.get("build")
+    md5 = match_spec.get("md5")
+    fn = match_spec.get("fn")
+    return EnvRecord(
+        match_spec.get("name"),
+        channel=channel.channel_name if channel is not None else None,
+        subdir=match_spec.get("subdir"),
+        version=_normalize_version(str(version) if version is not None else None),
+        build=str(build) if build is not None else None,
+        md5=str(md5) if md5 is not None else None,
+        fn=str(fn) if fn is not None else None,
+    )
+
+
+def parse_env_line(line: str):
+    """Returns the record for the given line of an env.in or env.out file, or None for blank and comment lines."""
+    line = line.strip()
+    if not line or line.startswith("#") or line == "@EXPLICIT":
+        return None
+    match = _EXPLICIT_URL_PATTERN.fullmatch(line)
+    if match:
+        return EnvRecord(**match.groupdict())
+    match = _CHANNEL_SPEC_PATTERN.fullmatch(line)
+    if match:
+        return EnvRecord(match["name"], channel=match["channel"], version=_normalize_version(match["version"]))
+    return _get_record_from_match_spec(line)
+
+
+def parse_env_file(file_path) -> dict[str, EnvRecord]:
+    """Returns the records of the packages in the given env.in or env.out file by package name."""
+    records = {}
+    with open(file_path, "r") as f:
+        for line in f:
+            record = parse_env_line(line)
+            if record is not None:
+                records[record.name] = record
+    return records
@@ -0,0 +1,211 @@
+import gzip
+import io
+import itertools
+import json
+import os
+import tarfile
+import zlib
+
+from sagemaker_image_builder.conda_meta import _DEFAULT_CONDA_PREFIX
+
+# Members of a saved image which aren't layers (e.g. the manifest and the image config) are kept if they're at most
+# this large.
+_MAX_METADATA_FILE_SIZE = 16 * 1024 * 1024
+_TAR_MAGIC_OFFSET = 257
+_TAR_BLOCK_SIZE = 512
+_GZIP_MAGIC = b"\x1f\x8b"
+_ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+_READ_SIZE = 1024 * 1024
+# Bytes in the conda prefix which aren't listed by any package, e.g. conda-meta itself or pip installed files.
+UNATTRIBUTED_PACKAGE_NAME = "(unattributed)"
+
+
+class _ChunksReader(io.RawIOBase):
+    # A file object over an iterable of byte chunks, e.g. the `docker save` stream of docker-py.
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._chunk = b""
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._chunk:
+            self._chunk = next(self._chunks, None)
+            if self._chunk is None:
+                self._chunk = b""
+                return 0
+        n = min(len(buffer), len(self._chunk))
+        buffer[:n] = self._chunk[:n]
+        self._chunk = self._chunk[n:]
+        return n
+
+
+class _LayerReader:
+    # Reads a layer tar, while counting its uncompressed bytes and how many bytes it takes gzip-compressed, which is
+    # how a registry stores it and a client pulls it. Layers which are already compressed pass their compressed size.
+    def __init__(self, fileobj, head: bytes, compressed_size: int = None):
+        self._fileobj = fileobj
+        self._head = head
+        self._compressor = zlib.compressobj(wbits=31) if compressed_size is None else None
+        self.size = 0
+        self.compressed_size = compressed_size or 0
+
+    def read(self, size: int = -1) -> bytes:
+        if self._head:
+            data, self._head = (self._head, b"") if size < 0 else (self._head[:size], self._head[size:])
+        else:
+            data = self._fileobj.read(size)
+        self.size += len(data)
+        if self._compressor is not None:
+            self.compressed_size += len(self._compressor.compress(data))
+        return data
+
+    def finish(self):
+        # Layer tars may end with padding after the end-of-archive blocks, which tarfile doesn't read.
+        while self.read(_READ_SIZE):
+            pass
+        if self._compressor is not None:
+            self.compressed_size += len(self._compressor.flush())
+
+
+def _is_tar(head: bytes) -> bool:
+    return head[_TAR_MAGIC_OFFSET : _TAR_MAGIC_OFFSET + 5] == b"ustar"
+
+
+def _read_head(fileobj) -> bytes:
+    # Decompressing readers may return fewer bytes than asked for.
+    head = b""
+    while len(head) < _TAR_BLOCK_SIZE:
+        data = fileobj.read(_TAR_BLOCK_SIZE - len(head))
+        if not data:
+            break
+        head += data
+    return head
+
+
+def _decompress(fileobj, head: bytes):
+    # Returns a file object over the decompressed content of the given gzip or zstd compressed file, of which the
+    # head was already read.
+    chunks = itertools.chain([head], iter(lambda: fileobj.read(_READ_SIZE), b""))
+    compressed = io.BufferedReader(_ChunksReader(chunks), _READ_SIZE)
+    if head.startswith(_GZIP_MAGIC):
+        return gzip.GzipFile(fileobj=compressed, mode="rb")
+    import zstandard
+
+    return zstandard.ZstdDecompressor().stream_reader(compressed)
+
+
+def _scan_layer(fileobj, head: bytes, conda_prefix: str, compressed_size: int = None) -> dict:
+    # Returns the sizes of the layer, the sizes of its files in the conda prefix and the conda-meta records in it.
+    prefix = conda_prefix.strip("/") + "/"
+    layer_reader = _LayerReader(fileobj, head, compressed_size)
+    prefix_files = {}
+    conda_meta_records = {}
+    with tarfile.open(fileobj=layer_reader, mode="r|") as layer_tar:
+        for member in layer_tar:
+            path = member.name.removeprefix("./")
+            # Whiteout files mark files which were deleted from a lower layer.
+            if not member.isfile() or not path.startswith(prefix) or os.path.basename(path).startswith(".wh."):
+                continue
+            relative_path = path[len(prefix) :]
+            prefix_files[relative_path] = member.size
+            if os.path.dirname(relative_path) == "conda-meta" and relative_path.endswith(".json"):
+                record = json.load(layer_tar.extractfile(member))
+                # Only keep what's needed to attribute files to packages, e.g. not the paths_data.
+                conda_meta_records[relative_path] = {k: record[k] for k in ("name", "version", "files") if k in record}
+    layer_reader.finish()
+    return {
+        "size": layer_reader.size,
+        "compressed_size": layer_reader.compressed_size,
+        "prefix_files": prefix_files,
+        "conda_meta_records": conda_meta_records,
+    }
+
+
+def _get_layer_history(config: dict) -> list[str]:
+    # Returns the instruction which created each (non-empty) layer, in the order of the layers.
+    return [h.get("created_by", "") for h in config.get("history", []) if not h.get("empty_layer")]
+
+
+def read_image_layers(saved_image, conda_prefix: str = _DEFAULT_CONDA_PREFIX) -> dict:
+    """Returns the layers of the given saved image (a `docker save` tar stream), with their uncompressed and
+    compressed sizes, and how many bytes of each layer belong to which conda package.
+
+    The saved image is read once, as a stream. Compressed sizes are measured by gzip-compressing every layer, like a
+    push to a registry does, so they're close to what a client pulls but not necessarily equal. Layers which the saved
+    image keeps gzip or zstd compressed (e.g. with the containerd image store) are decompressed to be scanned, and
+    their compressed size is the size of the blob.
+    """
+    layer_scans = {}
+    layer_links = {}
+    metadata_files = {}
+    with tarfile.open(fileobj=saved_image, mode="r|") as image_tar:
+        for member in image_tar:
+            if member.issym() or member.islnk():
+                # The legacy format links identical layers, e.g. '<id>/layer.tar' -> '../<other id>/layer.tar'.
+                base_dir = os.path.dirname(member.name) if member.issym() else ""
+                layer_links[member.name] = os.path.normpath(os.path.join(base_dir, member.linkname))
+                continue
+            if not member.isfile():
+                continue
+            fileobj = image_tar.extractfile(member)
+            head = fileobj.read(_TAR_BLOCK_SIZE)
+            if _is_tar(head):
+                layer_scans[member.name] = _scan_layer(fileobj, head, conda_prefix)
+            elif head.startswith(_GZIP_MAGIC) or head.startswith(_ZSTD_MAGIC):
+                layer_fileobj = _decompress(fileobj, head)
+                layer_head = _read_head(layer_fileobj)
+                if _is_tar(layer_head):
+                    layer_scans[member.name] = _scan_layer(layer_fileobj, layer_head, conda_prefix, member.size)
+            elif member.size <= _MAX_METADATA_FILE_SIZE:
+                metadata_files[member.name] = head + fileobj.read()
+
+    manifest = json.loads(metadata_files["manifest.json"])[0]
+    config = json.loads(metadata_files[manifest["Config"]])
+    layer_paths = [layer_links.get(p, p) for p in manifest["Layers"]]
+    for layer_path in layer_paths:
+        if layer_path not in layer_scans:
+            raise Exception(
+                f"The layer {layer_path} of the saved image is neither a tar archive nor a gzip or zstd compressed one."
+            )
+    diff_ids = config.get("rootfs", {}).get("diff_ids", [])
+    history = _get_layer_history(config)
+    if len(history) != len(layer_paths):
+        history = [""] * len(layer_paths)
+
+    # conda-meta records in upper layers replace the ones in lower layers.
+    conda_meta_records = {}
+    for layer_path in layer_paths:
+        conda_meta_records.update(layer_scans[layer_path]["conda_meta_records"])
+    package_names_by_file = {}
+    for record in conda_meta_records.values():
+        for file_path in record.get("files", []):
+            package_names_by_file[file_path] = record["name"]
+
+    layers = []
+    for i, layer_path in enumerate(layer_paths):
+        layer_scan = layer_scans[layer_path]
+        package_sizes = {}
+        for file_path, size in layer_scan["prefix_files"].items():
+            package_name = package_names_by_file.get(file_path, UNATTRIBUTED_PACKAGE_NAME)
+            package_sizes[package_name] = package_sizes.get(package_name, 0) + size
+        layers.append(
+            {
+                "digest": diff_ids[i] if i < len(diff_ids) else None,
+                "created_by": history[i],
+                "size": layer_scan["size"],
+                "compressed_size": layer_scan["compressed_size"],
+                "package_sizes": package_sizes,
+            }
+        )
+    return {
+        "layers": layers,
+        "package_versions": {r["name"]: r.get("version") for r in conda_meta_records.values()},
+    }
+
+
+def read_image_layers_from_docker(docker_client, image: str, conda_prefix: str = _DEFAULT_CONDA_PREFIX) -> dict:
+    """Like read_image_layers, for the given image in the local docker daemon."""
+    saved_image = _ChunksReader(docker_client.images.get(image).save(named=False))
+    return read_image_layers(io.BufferedReader(saved_image, _READ_SIZE), conda_prefix)
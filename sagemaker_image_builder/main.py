@@ -1,5 +1,4 @@
 import argparse
-import base64
 import copy
 import glob
 import json
@@ -7,34 +6,89 @@ import os
 import re
 import shutil
 import subprocess
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
-import boto3
-import docker
-from conda.models.match_spec import MatchSpec
-from docker.errors import ContainerError
 from semver import Version
 
+from sagemaker_image_builder.build_cache import (
+    _DEFAULT_BUILD_CACHE_FILE,
+    get_build_key,
+    get_cached_image_id,
+    record_image_id,
+)
 from sagemaker_image_builder.changelog_generator import generate_change_log
+from sagemaker_image_builder.conda_meta import (
+    _DEFAULT_CONDA_PREFIX,
+    get_explicit_env,
+    get_package_metadata,
+    read_conda_meta_records_from_image,
+)
 from sagemaker_image_builder.dependency_upgrader import (
     _MAJOR,
     _MINOR,
     _PATCH,
     _get_dependency_upper_bound_for_runtime_upgrade,
 )
+from sagemaker_image_builder.package_index import (
+    _DEFAULT_CHANNEL_ALIAS,
+    _DEFAULT_REPODATA_CACHE_DIR,
+    _DEFAULT_REPODATA_CACHE_TTL_SECONDS,
+)
 from sagemaker_image_builder.package_report import (
+    _ARCHIVE_SIZE_METRIC,
+    _INSTALLED_SIZE_METRIC,
+    generate_download_delta_report,
+    generate_image_layer_report,
     generate_package_size_report,
     generate_package_staleness_report,
 )
+from sagemaker_image_builder.query_executor import (
+    _DEFAULT_MAX_QUERIES_PER_SECOND_PER_HOST,
+    _DEFAULT_MAX_WORKERS,
+)
+from sagemaker_image_builder.registry import (
+    get_ecr_credentials,
+    get_manifest,
+    get_manifest_config_digest,
+    put_manifest,
+)
 from sagemaker_image_builder.release_notes_generator import generate_release_notes
+from sagemaker_image_builder.tracing import (
+    print_trace_summary,
+    span,
+    traced,
+    write_chrome_trace,
+)
 from sagemaker_image_builder.utils import (
+    VersionIndex,
+    create_markdown_table,
     dump_conda_package_metadata,
     get_dir_for_version,
-    get_match_specs,
+    get_env_records,
+    get_package_metadata_file_path,
     get_semver,
-    is_exists_dir_for_version,
+    parse_size,
+    sizeof_fmt,
 )
 
-_docker_client = docker.from_env()
+# docker (and conda, boto3) are only imported by the subcommands which need them, and the docker client is created
+# on first use. So e.g. `--help` neither pays for those imports nor requires a running docker daemon.
+_docker_client = None
+_docker_client_lock = threading.Lock()
+
+_DEFAULT_BUILD_LOG_DIR = "build_logs"
+# env.out can either be exported by running `conda list --explicit` in a container, or be read from the image.
+_ENV_OUT_SOURCE_CONTAINER = "container"
+_ENV_OUT_SOURCE_IMAGE = "image"
+# Number of trailing lines of the docker build output which are kept in memory for error reporting.
+_BUILD_LOG_TAIL_LINES = 200
+# A failed push is retried with an exponential backoff, i.e. after 5, 10, 20... seconds.
+_PUSH_MAX_ATTEMPTS = 3
+_PUSH_RETRY_BASE_DELAY_SECONDS = 5
+_PUSH_PROGRESS_REPORT_INTERVAL_SECONDS = 30
 
 
 def create_and_get_semver_dir(version: Version, image_config: list[dict], exist_ok: bool = False):
@@ -134,29 +188,31 @@ def _create_new_version_conda_specs(
     additional_packages_env_in_filename = image_generator_config["additional_packages_env_in_file"]
     env_out_filename = image_generator_config["env_out_filename"]
 
-    base_match_specs_in = get_match_specs(f"{base_version_dir}/{env_in_filename}")
+    base_env_records_in = get_env_records(f"{base_version_dir}/{env_in_filename}")
 
-    base_match_specs_out = get_match_specs(f"{base_version_dir}/{env_out_filename}")
-    additional_packages_match_specs_in = get_match_specs(f"{new_version_dir}/{additional_packages_env_in_filename}")
+    base_env_records_out = get_env_records(f"{base_version_dir}/{env_out_filename}")
+    # The parsed env files are shared, so copy them before modifying.
+    additional_packages_env_records_in = dict(
+        get_env_records(f"{new_version_dir}/{additional_packages_env_in_filename}")
+    )
 
     # Add all the match specs from the previous version.
     # If a package is present in both additional packages as well as the previous version, then
     # use the values in the previous version
-    additional_packages_match_specs_in.update(base_match_specs_in)
+    additional_packages_env_records_in.update(base_env_records_in)
 
     out = []
-    for package_name in additional_packages_match_specs_in:
-        match_out: MatchSpec = base_match_specs_out.get(package_name)
+    for package_name in additional_packages_env_records_in:
+        record_out = base_env_records_out.get(package_name)
 
-        if match_out is None:
+        if record_out is None:
             # No restriction on what versions to use.
             out.append(f"conda-forge::{package_name}")
         else:
-            channel = match_out.get("channel").channel_name
+            channel = record_out.channel
 
-            min_version_inclusive = match_out.get("version")
-            assert str(min_version_inclusive).startswith("==")
-            min_version_inclusive = str(min_version_inclusive).removeprefix("==")
+            assert record_out.is_exact_version
+            min_version_inclusive = record_out.version
 
             max_version_str = _get_dependency_upper_bound_for_runtime_upgrade(
                 package_name, min_version_inclusive, runtime_version_upgrade_type
@@ -186,27 +242,225 @@ def build_images(args):
     with open(args.image_config_file) as jsonfile:
         image_config = json.load(jsonfile)
     target_version = get_semver(args.target_patch_version)
-    image_ids, image_versions = _build_local_images(target_version, args.target_ecr_repo, image_config, args.force)
+    with span("build images"):
+        image_ids, image_versions = _build_local_images(
+            target_version,
+            args.target_ecr_repo,
+            image_config,
+            args.force,
+            args.max_parallel_builds,
+            args.build_log_dir,
+            args.build_cache_file,
+            args.env_out_source,
+        )
     generate_release_notes(target_version, image_config)
 
     # Upload to ECR before running tests so that only the exact image which we tested goes to public
     # TODO: Move after tests are stabilized
     if args.target_ecr_repo is not None:
-        _push_images_upstream(image_versions, args.region)
+        with span("push images"):
+            _push_images_upstream(
+                image_versions, args.region, args.ecr_credentials_cache_file, args.registry_aware_push
+            )
+    print_trace_summary()
 
 
-def _push_images_upstream(image_versions_to_push: list[dict[str, str]], region: str):
+def _push_images_upstream(
+    image_versions_to_push: list[dict[str, str]],
+    region: str,
+    credentials_cache_file: str = None,
+    registry_aware_push: bool = False,
+):
     print(f"Will now push the images to ECR: {image_versions_to_push}")
 
+    # Every repository gets its own worker, so that a slow registry doesn't block pushes to the other ones. Within a
+    # repository, the tags are grouped by the image they refer to, e.g. the cpu and the gpu image.
+    tags_by_repository = {}
     for i in image_versions_to_push:
-        username, password = _get_ecr_credentials(region, i["repository"])
-        _docker_client.images.push(
-            repository=i["repository"], tag=i["tag"], auth_config={"username": username, "password": password}
-        )
+        tags_by_image = tags_by_repository.setdefault(i["repository"], {})
+        tags_by_image.setdefault(i.get("image_id"), []).append(i["tag"])
+    with ThreadPoolExecutor(max_workers=max(1, len(tags_by_repository))) as executor:
+        futures = {
+            repository: executor.submit(
+                _push_repository_tags,
+                repository,
+                list(tags_by_image.values()),
+                region,
+                credentials_cache_file,
+                registry_aware_push,
+            )
+            for repository, tags_by_image in tags_by_repository.items()
+        }
+    push_results = {}
+    failed_repositories = {}
+    for repository, future in futures.items():
+        try:
+            push_results[repository] = future.result()
+        except Exception as e:
+            failed_repositories[repository] = e
+    _print_push_summary(push_results)
+    if failed_repositories:
+        raise Exception(f"Failed to push the images to these repositories: {failed_repositories}")
 
     print(f"Successfully pushed these images to ECR: {image_versions_to_push}")
 
 
+# Pushes all the given tags of a repository one after another. The tags come in groups, one per image. Returns the
+# aggregated progress of each layer, keyed by the layer id.
+def _push_repository_tags(
+    repository: str,
+    tag_groups: list[list[str]],
+    region: str,
+    credentials_cache_file: str = None,
+    registry_aware_push: bool = False,
+) -> dict[str, dict]:
+    with span("push repository", track=repository):
+        return _push_repository_tags_with_progress(
+            repository, tag_groups, region, credentials_cache_file, registry_aware_push
+        )
+
+
+def _push_repository_tags_with_progress(
+    repository: str, tag_groups: list[list[str]], region: str, credentials_cache_file: str, registry_aware_push: bool
+) -> dict[str, dict]:
+    layer_progress = {}
+    for tags in tag_groups:
+        if not registry_aware_push:
+            for tag in tags:
+                _run_with_retries(
+                    f"push of {repository}:{tag}",
+                    _push_image,
+                    repository,
+                    tag,
+                    region,
+                    layer_progress,
+                    credentials_cache_file,
+                )
+            continue
+
+        # All the tags of a group refer to the same image. So push the image once, and then apply the remaining tags by
+        # uploading its manifest under each of them.
+        if not _run_with_retries(
+            f"lookup of {repository}:{tags[0]}",
+            _is_image_in_registry,
+            repository,
+            tags[0],
+            region,
+            credentials_cache_file,
+        ):
+            _run_with_retries(
+                f"push of {repository}:{tags[0]}",
+                _push_image,
+                repository,
+                tags[0],
+                region,
+                layer_progress,
+                credentials_cache_file,
+            )
+        for tag in tags[1:]:
+            _run_with_retries(
+                f"tagging of {repository}:{tag}",
+                _tag_image_in_registry,
+                repository,
+                tags[0],
+                tag,
+                region,
+                credentials_cache_file,
+            )
+    return layer_progress
+
+
+def _run_with_retries(description: str, func, *args):
+    for attempt in range(1, _PUSH_MAX_ATTEMPTS + 1):
+        try:
+            return func(*args)
+        except Exception as e:
+            if attempt == _PUSH_MAX_ATTEMPTS:
+                raise
+            delay = _PUSH_RETRY_BASE_DELAY_SECONDS * 2 ** (attempt - 1)
+            print(f"The {description} failed (attempt {attempt}/{_PUSH_MAX_ATTEMPTS}): {e}")
+            print(f"Retrying the {description} in {delay} seconds.")
+            time.sleep(delay)
+
+
+# Returns whether the given tag in the registry already refers to the local image with the same tag, i.e. whether
+# the image was already pushed.
+@traced("registry manifest lookup")
+def _is_image_in_registry(repository: str, tag: str, region: str, credentials_cache_file: str = None) -> bool:
+    username, password = get_ecr_credentials(region, repository, credentials_cache_file)
+    remote_manifest = get_manifest(repository, tag, username, password)
+    if remote_manifest is None:
+        return False
+    image = _get_docker_client().images.get(f"{repository}:{tag}")
+    if get_manifest_config_digest(remote_manifest[2]) != image.id:
+        return False
+    print(f"Skipping the push of {repository}:{tag}, the registry already contains the image {image.id}.")
+    return True
+
+
+@traced("registry tagging")
+def _tag_image_in_registry(repository: str, source_tag: str, tag: str, region: str, credentials_cache_file: str = None):
+    username, password = get_ecr_credentials(region, repository, credentials_cache_file)
+    media_type, digest, manifest = get_manifest(repository, source_tag, username, password)
+    existing_manifest = get_manifest(repository, tag, username, password)
+    if existing_manifest is not None and existing_manifest[1] == digest:
+        print(f"Skipping the tagging of {repository}:{tag}, it already refers to {digest}.")
+        return
+    put_manifest(repository, tag, media_type, manifest, username, password)
+    print(f"Tagged {repository}:{tag} with the manifest {digest} of {repository}:{source_tag}.")
+
+
+@traced("docker push")
+def _push_image(
+    repository: str, tag: str, region: str, layer_progress: dict[str, dict], credentials_cache_file: str = None
+):
+    username, password = get_ecr_credentials(region, repository, credentials_cache_file)
+    last_progress_report_time = time.monotonic()
+    for event in _get_docker_client().images.push(
+        repository=repository,
+        tag=tag,
+        auth_config={"username": username, "password": password},
+        stream=True,
+        decode=True,
+    ):
+        if "error" in event:
+            raise Exception(event["error"])
+        layer_id = event.get("id")
+        if layer_id is None or "status" not in event:
+            continue
+        progress = layer_progress.setdefault(layer_id, {"status": None, "current": 0, "total": 0})
+        # The same layer shows up again for every other tag of the image, don't lose track of it having been pushed.
+        if progress["status"] != "Pushed":
+            progress["status"] = event["status"]
+        progress_detail = event.get("progressDetail") or {}
+        if progress_detail.get("total"):
+            progress["total"] = progress_detail["total"]
+            progress["current"] = max(progress["current"], progress_detail.get("current", 0))
+        if event["status"] == "Pushed":
+            progress["current"] = progress["total"]
+        if time.monotonic() - last_progress_report_time > _PUSH_PROGRESS_REPORT_INTERVAL_SECONDS:
+            last_progress_report_time = time.monotonic()
+            pushed_bytes = sum(p["current"] for p in layer_progress.values())
+            total_bytes = sum(p["total"] for p in layer_progress.values())
+            print(f"Pushing {repository}:{tag}: {sizeof_fmt(pushed_bytes)}/{sizeof_fmt(total_bytes)}")
+
+
+def _print_push_summary(push_results: dict[str, dict[str, dict]]):
+    rows = []
+    for repository, layer_progress in push_results.items():
+        pushed_layers = [p for p in layer_progress.values() if p["status"] == "Pushed"]
+        rows.append(
+            {
+                "repository": repository,
+                "pushed_layers": len(pushed_layers),
+                "existing_layers": len([p for p in layer_progress.values() if p["status"] == "Layer already exists"]),
+                "pushed_bytes": sizeof_fmt(sum(p["total"] for p in pushed_layers)),
+            }
+        )
+    print("\n## Push Summary\n")
+    print(create_markdown_table(["Repository", "Pushed Layers", "Existing Layers", "Pushed Size"], rows))
+
+
 def _get_config_for_image(target_version_dir: str, image_generator_config, force_rebuild) -> dict:
     if not os.path.exists(target_version_dir + "/" + image_generator_config["env_out_filename"]) or force_rebuild:
         return image_generator_config
@@ -223,76 +477,289 @@ def _get_config_for_image(target_version_dir: str, image_generator_config, force
 # multiple different strings - for e.g., a CPU image can be tagged as '1.3.2-cpu', '1.3-cpu', '1-cpu' and/or
 # 'latest-cpu'. Therefore, (1) is strictly a subset of (2).
 def _build_local_images(
-    target_version: Version, target_ecr_repo_list: list[str], image_config: list[dict], force: bool
+    target_version: Version,
+    target_ecr_repo_list: list[str],
+    image_config: list[dict],
+    force: bool,
+    max_parallel_builds: int = None,
+    build_log_dir: str = _DEFAULT_BUILD_LOG_DIR,
+    build_cache_file: str = _DEFAULT_BUILD_CACHE_FILE,
+    env_out_source: str = _ENV_OUT_SOURCE_CONTAINER,
 ) -> (list[str], list[dict[str, str]]):
     target_version_dir = get_dir_for_version(target_version)
+    # Scan build_artifacts once for all the change logs and version tags.
+    version_index = VersionIndex()
 
     generated_image_ids = []
     generated_image_versions = []
 
-    for image_generator_config in image_config:
-        config = _get_config_for_image(target_version_dir, image_generator_config, force)
-        # BuildKit must be used for volume mounting during build, but isn't supported by docker-py (https://github.com/docker/docker-py/issues/2230)
-        # So instead we enable via env variable, and then call docker build via cli.
-        os.environ["DOCKER_BUILDKIT"] = "1"
-        raw_build_result = ""
-        # Docker build takes args like `--build-arg Key1=Value1 --build-arg Key2=Value2`
-        build_arg_options = sum([["--build-arg", f"{k}={v}"] for k, v in config["build_args"].items()], [])
-        docker_build_command = ["docker", "build", "--rm", "--pull"] + build_arg_options + [f"./{target_version_dir}"]
-        try:
-            raw_build_result = subprocess.check_output(
-                docker_build_command, stderr=subprocess.STDOUT, universal_newlines=True
+    # BuildKit must be used for volume mounting during build, but isn't supported by docker-py (https://github.com/docker/docker-py/issues/2230)
+    # So instead we enable via env variable, and then call docker build via cli.
+    os.environ["DOCKER_BUILDKIT"] = "1"
+
+    # Image configs (e.g. cpu and gpu) are independent of each other, so build them concurrently. By default, every
+    # image config gets its own worker.
+    max_workers = max(1, max_parallel_builds or len(image_config))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(
+                _build_local_image,
+                target_version,
+                target_version_dir,
+                image_generator_config,
+                force,
+                build_log_dir,
+                build_cache_file,
+                env_out_source,
+                version_index,
             )
-        except subprocess.CalledProcessError as e:
-            print(f"Build failed with exit code {e.returncode}. Output:")
-            # Prints output from Docker build
-            print(e.output)
+            for image_generator_config in image_config
+        ]
+        try:
+            # Collect the results in the order of the image config, so that tagging stays deterministic.
+            built_images = [future.result() for future in futures]
+        except Exception:
+            # Don't start any pending builds once one of them has failed.
+            executor.shutdown(wait=True, cancel_futures=True)
             raise
 
-        # Parse the output
-        image_id = None
-        for line in raw_build_result.splitlines():
-            if line.startswith("#"):
-                # Image id format in Docker build output
-                if "writing image sha256:" in line.lower():
-                    match = re.search(r"sha256:([a-f0-9]+)", line)
-                    if match:
-                        image_id = match.group(1)
-        # Now we can get image using docker-py
-        image = _docker_client.images.get(image_id)
-        print(f"Successfully built an image with id: {image.id}")
+    for image, config in built_images:
         generated_image_ids.append(image.id)
-        try:
-            container_logs = _docker_client.containers.run(
-                image=image.id, detach=False, auto_remove=True, command="conda list --explicit"
-            )
-        except ContainerError as e:
-            print(e.container.logs().decode("utf-8"))
-            # After printing the logs, raise the exception (which is the old behavior)
-            raise
 
-        with open(f'{target_version_dir}/{config["env_out_filename"]}', "wb") as f:
-            f.write(container_logs)
+        with span("tag image", track=config["image_type"]):
+            image_tag_suffix = config["image_tag_suffix"] if "image_tag_suffix" in config else ""
+            image_tags_to_apply = [
+                f"{i}{image_tag_suffix}"
+                for i in _get_version_tags(target_version, config["env_out_filename"], version_index)
+            ]
 
-        # Generate change logs. Use the original image generator config which contains the name
-        # of the actual env.in file instead of the 'config'.
-        generate_change_log(target_version, image_generator_config)
+            if target_ecr_repo_list is not None:
+                for target_ecr_repo in target_ecr_repo_list:
+                    for t in image_tags_to_apply:
+                        image.tag(target_ecr_repo, tag=t)
+                        generated_image_versions.append({"repository": target_ecr_repo, "tag": t, "image_id": image.id})
 
-        image_tag_suffix = config["image_tag_suffix"] if "image_tag_suffix" in config else ""
-        image_tags_to_apply = [
-            f"{i}{image_tag_suffix}" for i in _get_version_tags(target_version, config["env_out_filename"])
-        ]
+            # Tag the image for testing
+            image.tag(f"localhost/{config["image_name"]}", f"{str(target_version)}{image_tag_suffix}")
 
-        if target_ecr_repo_list is not None:
-            for target_ecr_repo in target_ecr_repo_list:
-                for t in image_tags_to_apply:
-                    image.tag(target_ecr_repo, tag=t)
-                    generated_image_versions.append({"repository": target_ecr_repo, "tag": t})
+    return generated_image_ids, generated_image_versions
 
-        # Tag the image for testing
-        image.tag(f"localhost/{config["image_name"]}", f"{str(target_version)}{image_tag_suffix}")
 
-    return generated_image_ids, generated_image_versions
+def _get_cache_options(option: str, cache_specs) -> list[str]:
+    # Cache specs can be given as a single string or as a list, e.g. "type=local,src=/tmp/buildkit-cache" or
+    # ["type=registry,ref=<repo>:cache-cpu", "type=local,src=/tmp/buildkit-cache"].
+    if isinstance(cache_specs, str):
+        cache_specs = [cache_specs]
+    return sum([[option, cache_spec] for cache_spec in cache_specs or []], [])
+
+
+# Returns the docker build command for the given image config. If the config has `cache_from` or `cache_to` fields,
+# the image is built with buildx, importing and exporting the BuildKit cache from/to the given locations, and loaded
+# into the local docker daemon afterwards.
+def _get_docker_build_command(target_version_dir: str, config: dict, image_id_file_path: str) -> list[str]:
+    # Docker build takes args like `--build-arg Key1=Value1 --build-arg Key2=Value2`
+    build_arg_options = sum([["--build-arg", f"{k}={v}"] for k, v in config["build_args"].items()], [])
+    if not config.get("cache_from") and not config.get("cache_to"):
+        return ["docker", "build", "--rm", "--pull"] + build_arg_options + [f"./{target_version_dir}"]
+    cache_options = _get_cache_options("--cache-from", config.get("cache_from")) + _get_cache_options(
+        "--cache-to", config.get("cache_to")
+    )
+    # Builders with the docker-container driver (which are required to export the cache) don't print the id of the
+    # loaded image, so let buildx write it to a file instead.
+    return (
+        ["docker", "buildx", "build", "--load", "--pull", "--iidfile", image_id_file_path]
+        + cache_options
+        + build_arg_options
+        + [f"./{target_version_dir}"]
+    )
+
+
+# Runs the given docker build command and streams its output line by line: each line is printed with the given
+# prefix and written to the given log file. Only the last few lines are kept in memory, so that they can be reported
+# if the build fails. Returns the id of the built image, which is read from the given image id file if the build
+# output doesn't contain it.
+def _run_docker_build(
+    docker_build_command: list[str], build_log_file_path: str, log_prefix: str, image_id_file_path: str = None
+) -> str:
+    os.makedirs(os.path.dirname(build_log_file_path) or ".", exist_ok=True)
+    if image_id_file_path and os.path.exists(image_id_file_path):
+        # Never pick up the image id of a previous build.
+        os.remove(image_id_file_path)
+    image_id = None
+    build_log_tail = deque(maxlen=_BUILD_LOG_TAIL_LINES)
+    with open(build_log_file_path, "w") as build_log_file, subprocess.Popen(
+        docker_build_command,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        universal_newlines=True,
+        errors="replace",
+        bufsize=1,
+    ) as process:
+        for line in process.stdout:
+            build_log_file.write(line)
+            build_log_tail.append(line)
+            print(f"{log_prefix} {line}", end="", flush=True)
+            # Image id format in Docker build output
+            if line.startswith("#") and "writing image sha256:" in line.lower():
+                match = re.search(r"sha256:([a-f0-9]+)", line)
+                if match:
+                    image_id = match.group(1)
+        return_code = process.wait()
+
+    if return_code != 0:
+        build_log_tail_output = "".join(build_log_tail)
+        print(
+            f"{log_prefix} Build failed with exit code {return_code}. Last {len(build_log_tail)} lines of output "
+            f"(see {build_log_file_path} for the full output):"
+        )
+        # Prints output from Docker build
+        print("".join(f"{log_prefix} {line}" for line in build_log_tail), end="")
+        raise subprocess.CalledProcessError(return_code, docker_build_command, output=build_log_tail_output)
+    if image_id is None and image_id_file_path and os.path.exists(image_id_file_path):
+        with open(image_id_file_path, "r") as f:
+            image_id = f.read().strip().removeprefix("sha256:") or None
+    if image_id is None:
+        raise Exception(f"Unable to find the image id in the docker build output. See {build_log_file_path}")
+    return image_id
+
+
+def _get_docker_client():
+    global _docker_client
+    with _docker_client_lock:
+        if _docker_client is None:
+            import docker
+
+            _docker_client = docker.from_env()
+        return _docker_client
+
+
+def _get_log_prefix(image_generator_config) -> str:
+    return f"[{image_generator_config['image_type']}]"
+
+
+# Returns the image which was previously built from exactly the same build inputs, if it still exists locally.
+def _get_cached_image(build_cache_file: str, build_key: str):
+    image_id = get_cached_image_id(build_cache_file, build_key)
+    if image_id is None:
+        return None
+    from docker.errors import ImageNotFound
+
+    try:
+        return _get_docker_client().images.get(image_id)
+    except ImageNotFound:
+        return None
+
+
+# Builds the image for a single image config and generates its env.out and change log. Returns a tuple of the built
+# image and the config that was used to build it.
+def _build_local_image(
+    target_version: Version,
+    target_version_dir: str,
+    image_generator_config: dict,
+    force: bool,
+    build_log_dir: str,
+    build_cache_file: str,
+    env_out_source: str = _ENV_OUT_SOURCE_CONTAINER,
+    version_index: VersionIndex = None,
+):
+    # Every image config gets its own track in the trace.
+    with span("build image", track=image_generator_config["image_type"]):
+        return _build_local_image_and_env_out(
+            target_version,
+            target_version_dir,
+            image_generator_config,
+            force,
+            build_log_dir,
+            build_cache_file,
+            env_out_source,
+            version_index,
+        )
+
+
+def _build_local_image_and_env_out(
+    target_version: Version,
+    target_version_dir: str,
+    image_generator_config: dict,
+    force: bool,
+    build_log_dir: str,
+    build_cache_file: str,
+    env_out_source: str,
+    version_index: VersionIndex,
+):
+    config = _get_config_for_image(target_version_dir, image_generator_config, force)
+    log_prefix = _get_log_prefix(config)
+    env_out_file_path = f'{target_version_dir}/{config["env_out_filename"]}'
+    with span("build cache lookup"):
+        build_key = get_build_key(target_version_dir, config)
+        image = None if force else _get_cached_image(build_cache_file, build_key)
+    is_cached_image = image is not None
+    if is_cached_image:
+        print(f"{log_prefix} Build inputs are unchanged, reusing the existing image with id: {image.id}")
+    else:
+        build_log_file_path = os.path.join(build_log_dir, f"{target_version}-{config['image_type']}.log")
+        image_id_file_path = os.path.join(build_log_dir, f"{target_version}-{config['image_type']}.iid")
+        docker_build_command = _get_docker_build_command(target_version_dir, config, image_id_file_path)
+        print(f"{log_prefix} Building image: {' '.join(docker_build_command)}")
+        print(f"{log_prefix} Writing docker build output to {build_log_file_path}")
+        with span("docker build"):
+            image_id = _run_docker_build(docker_build_command, build_log_file_path, log_prefix, image_id_file_path)
+
+        # Now we can get image using docker-py
+        image = _get_docker_client().images.get(image_id)
+        print(f"{log_prefix} Successfully built an image with id: {image.id}")
+        record_image_id(build_cache_file, build_key, image.id)
+
+    # A reused image was built from the same inputs as the existing env.out, so there is no need to export it again.
+    if not is_cached_image or not os.path.exists(env_out_file_path):
+        with open(env_out_file_path, "wb") as f:
+            f.write(_export_env_out(image, config, env_out_source))
+    # Likewise for the package metadata, which the size report reads instead of looking the packages up remotely.
+    package_metadata_file_path = get_package_metadata_file_path(config, target_version_dir)
+    if not is_cached_image or not os.path.exists(package_metadata_file_path):
+        with open(package_metadata_file_path, "w") as f:
+            json.dump(_export_package_metadata(image, config), f, indent=2)
+            f.write("\n")
+
+    if not is_cached_image:
+        # Unless --force is passed, the next build uses the env.out which was just exported as its input. That results
+        # in the same conda environment, so this image can be reused for those build inputs as well.
+        next_config = _get_config_for_image(target_version_dir, image_generator_config, False)
+        next_build_key = get_build_key(target_version_dir, next_config)
+        if next_build_key != build_key:
+            record_image_id(build_cache_file, next_build_key, image.id)
+
+    # Generate change logs. Use the original image generator config which contains the name
+    # of the actual env.in file instead of the 'config'.
+    generate_change_log(target_version, image_generator_config, version_index)
+    return image, config
+
+
+# Returns the explicit specification of the conda environment in the given image, i.e. the contents of env.out.
+@traced("export env.out")
+def _export_env_out(image, config: dict, env_out_source: str) -> bytes:
+    if env_out_source == _ENV_OUT_SOURCE_IMAGE:
+        # Read the conda-meta records straight from the image file system, without starting a container.
+        conda_prefix = config.get("conda_prefix", _DEFAULT_CONDA_PREFIX)
+        docker_client = _get_docker_client()
+        return get_explicit_env(read_conda_meta_records_from_image(docker_client, image.id, conda_prefix)).encode()
+
+    from docker.errors import ContainerError
+
+    try:
+        return _get_docker_client().containers.run(
+            image=image.id, detach=False, auto_remove=True, command="conda list --explicit"
+        )
+    except ContainerError as e:
+        print(e.container.logs().decode("utf-8"))
+        # After printing the logs, raise the exception (which is the old behavior)
+        raise
+
+
+# Returns the version and size of every package in the given image, as `get-conda-package-metadata` would print them.
+@traced("export package metadata")
+def _export_package_metadata(image, config: dict) -> dict:
+    conda_prefix = config.get("conda_prefix", _DEFAULT_CONDA_PREFIX)
+    return get_package_metadata(read_conda_meta_records_from_image(_get_docker_client(), image.id, conda_prefix))
 
 
 def _get_next_version(current_version: Version, upgrade_func: str) -> Version:
@@ -310,40 +777,32 @@ def _get_next_version(current_version: Version, upgrade_func: str) -> Version:
 # For versions with pre-release identifier, this method will return the appropriate tags
 # Example: For an version 2.0.0-beta, this method will return [2.0.0-beta, 2.0-beta, 2-beta,
 # latest-beta]
-def _get_version_tags(target_version: Version, env_out_file_name: str) -> list[str]:
+# Only versions which have an env.out file (i.e. which were built) and the same pre-release identifier are considered.
+def _get_version_tags(target_version: Version, env_out_file_name: str, version_index: VersionIndex = None) -> list[str]:
+    version_index = version_index or VersionIndex()
     # First, add '2.6.x' as is.
     res = [str(target_version)]
     prerelease_version_suffix = f"-{target_version.prerelease}" if target_version.prerelease else ""
 
-    # If we were to add '2.6', check if '2.6.(x+1)' is present.
-    if not is_exists_dir_for_version(_get_next_version(target_version, "bump_patch"), env_out_file_name):
+    # If we were to add '2.6', check if there is a newer '2.6.y'.
+    if not version_index.has_newer_patch_version(target_version, env_out_file_name):
         res.append(f"{target_version.major}.{target_version.minor}{prerelease_version_suffix}")
     else:
         return res
 
-    # If we were to add '2', check if '2.7' is present.
-    if not is_exists_dir_for_version(_get_next_version(target_version, "bump_minor"), env_out_file_name):
+    # If we were to add '2', check if there is a newer '2.y.z'.
+    if not version_index.has_newer_minor_version(target_version, env_out_file_name):
         res.append(f"{target_version.major}{prerelease_version_suffix}")
     else:
         return res
 
-    # If we were to add 'latest', check if '3.0.0' is present.
-    if not is_exists_dir_for_version(_get_next_version(target_version, "bump_major"), env_out_file_name):
+    # If we were to add 'latest', check if there is a newer major version.
+    if not version_index.has_newer_major_version(target_version, env_out_file_name):
         res.append(f"latest{prerelease_version_suffix}")
 
     return res
 
 
-def _get_ecr_credentials(region, repository: str) -> (str, str):
-    _ecr_client_config_name = "ecr-public" if repository.startswith("public.ecr.aws") else "ecr"
-    _ecr_client = boto3.client(_ecr_client_config_name, region_name=region)
-    _authorization_data = _ecr_client.get_authorization_token()["authorizationData"]
-    if _ecr_client_config_name == "ecr":
-        # If we are using the ecr private client, then fetch the first index from authorizationData
-        _authorization_data = _authorization_data[0]
-    return base64.b64decode(_authorization_data["authorizationToken"]).decode().split(":")
-
-
 def get_arg_parser():
     parser = argparse.ArgumentParser(description="A command line utility to create new image versions.")
 
@@ -403,12 +862,47 @@ def get_arg_parser():
         help="Builds a new docker image which will fetch the latest versions of each package in "
         "the conda environment. Any existing env.out file will be overwritten.",
     )
+    build_image_parser.add_argument(
+        "--env-out-source",
+        choices=[_ENV_OUT_SOURCE_CONTAINER, _ENV_OUT_SOURCE_IMAGE],
+        default=_ENV_OUT_SOURCE_CONTAINER,
+        help="Specify how the env.out file is generated: by running `conda list --explicit` in a container of the "
+        "built image, or by reading the conda-meta records from the image file system without starting a container.",
+    )
     build_image_parser.add_argument(
         "--target-ecr-repo",
         action="append",
         help="Specify the AWS ECR repository in which this image needs to be uploaded.",
     )
     build_image_parser.add_argument("--region", help="Specify the region of the ECR repository.")
+    build_image_parser.add_argument(
+        "--ecr-credentials-cache-file",
+        help="Optionally specify a file in which ECR authorization tokens are cached until they expire, so that "
+        "subsequent runs can reuse them.",
+    )
+    build_image_parser.add_argument(
+        "--registry-aware-push",
+        action="store_true",
+        help="Push each image only once, and only if the registry doesn't already contain it. The remaining tags of "
+        "the image are applied by uploading its manifest through the registry API.",
+    )
+    build_image_parser.add_argument(
+        "--max-parallel-builds",
+        type=int,
+        help="Specify the maximum number of images that can be built concurrently. Defaults to the number of "
+        "image configs in the image config file.",
+    )
+    build_image_parser.add_argument(
+        "--build-log-dir",
+        default=_DEFAULT_BUILD_LOG_DIR,
+        help="Specify the directory to which the docker build output of each image is written.",
+    )
+    build_image_parser.add_argument(
+        "--build-cache-file",
+        default=_DEFAULT_BUILD_CACHE_FILE,
+        help="Specify the build cache manifest which maps a hash of the build inputs of an image to the id of the "
+        "image built from them. Unless --force is passed, images whose build inputs are unchanged are not rebuilt.",
+    )
     build_image_parser.set_defaults(func=build_images)
 
     package_staleness_parser = subparsers.add_parser(
@@ -452,6 +946,116 @@ def get_arg_parser():
         action="store_true",
         help="Validate package size delta and raise error if the validation failed.",
     )
+    package_size_parser.add_argument(
+        "--metric",
+        choices=[_ARCHIVE_SIZE_METRIC, _INSTALLED_SIZE_METRIC],
+        default=_ARCHIVE_SIZE_METRIC,
+        help="Specify which package sizes are reported and validated: the sizes of the package archives, or the "
+        "installed (on-disk) sizes, which require the package metadata files written by `build`.",
+    )
+
+    image_layer_parser = subparsers.add_parser(
+        "generate-image-layer-report",
+        help="Generates a report of the compressed and uncompressed size of every layer of the images of the given "
+        "version, and of the bytes of every conda package in them, compared to the images of the version it was "
+        "created from. The images have to exist locally.",
+    )
+    image_layer_parser.set_defaults(func=generate_image_layer_report)
+    image_layer_parser.add_argument(
+        "--image-config-file",
+        required=True,
+        help="A json file contains the docker image generator configuration.",
+    )
+    image_layer_parser.add_argument(
+        "--target-patch-version",
+        required=True,
+        help="Specify the target patch version for which the image layer report needs to be generated.",
+    )
+
+    download_delta_parser = subparsers.add_parser(
+        "generate-download-delta-report",
+        help="Generates a report of how many compressed bytes a client which holds the images of the version the "
+        "given version was created from has to pull to upgrade, by comparing the layers of the images in a registry.",
+    )
+    download_delta_parser.set_defaults(func=generate_download_delta_report)
+    download_delta_parser.add_argument(
+        "--image-config-file",
+        required=True,
+        help="A json file contains the docker image generator configuration.",
+    )
+    download_delta_parser.add_argument(
+        "--target-patch-version",
+        required=True,
+        help="Specify the target patch version for which the download delta report needs to be generated.",
+    )
+    download_delta_parser.add_argument(
+        "--repository",
+        required=True,
+        help="Specify the repository to which the images of both versions were pushed, e.g. an ECR repository.",
+    )
+    download_delta_parser.add_argument(
+        "--region",
+        help="Specify the AWS region of the ECR repository. Other registries are accessed anonymously.",
+    )
+    download_delta_parser.add_argument(
+        "--ecr-credentials-cache-file",
+        help="Optionally specify a file in which ECR authorization tokens are cached until they expire.",
+    )
+    download_delta_parser.add_argument(
+        "--max-delta",
+        type=parse_size,
+        help="Raise an error if upgrading any image requires pulling more than this, e.g. 500MB or 1.5GB.",
+    )
+
+    for p in [package_staleness_parser, package_size_parser]:
+        p.add_argument(
+            "--channel-alias",
+            default=_DEFAULT_CHANNEL_ALIAS,
+            help="Specify the url under which conda channels are looked up by name, e.g. a mirror of "
+            "https://conda.anaconda.org.",
+        )
+        p.add_argument(
+            "--repodata-cache-dir",
+            default=_DEFAULT_REPODATA_CACHE_DIR,
+            help="Specify the directory in which the repodata of conda channels is cached between runs.",
+        )
+        p.add_argument(
+            "--repodata-cache-ttl",
+            type=float,
+            default=_DEFAULT_REPODATA_CACHE_TTL_SECONDS,
+            help="Specify for how many seconds cached repodata is used without checking the channel for updates. "
+            "After that, it is refreshed with a conditional request.",
+        )
+        p.add_argument(
+            "--offline",
+            action="store_true",
+            help="Only use cached repodata, without any network requests.",
+        )
+        p.add_argument(
+            "--max-concurrent-queries",
+            type=int,
+            default=_DEFAULT_MAX_WORKERS,
+            help="Specify how many package queries (e.g. `conda search` calls) run at the same time.",
+        )
+        p.add_argument(
+            "--max-queries-per-second",
+            type=float,
+            default=_DEFAULT_MAX_QUERIES_PER_SECOND_PER_HOST,
+            help="Specify how many package queries per second may be started against any one host.",
+        )
+
+    for p in [
+        build_image_parser,
+        package_staleness_parser,
+        package_size_parser,
+        image_layer_parser,
+        download_delta_parser,
+    ]:
+        p.add_argument(
+            "--trace-file",
+            help="Optionally specify a file to which the duration of each phase of the command is written, in the "
+            "Chrome trace format (which can be opened in chrome://tracing or https://ui.perfetto.dev).",
+        )
 
     conda_package_metadata_parser = subparsers.add_parser(
         "get-conda-package-metadata",
@@ -469,7 +1073,12 @@ def parse_args(parser):
     if args.subcommand is None:
         parser.print_help()
     else:
-        args.func(args)
+        try:
+            args.func(args)
+        finally:
+            # Also write the trace if the command failed, it helps to see how far it got.
+            if getattr(args, "trace_file", None):
+                write_chrome_trace(args.trace_file)
 
 
 def main():
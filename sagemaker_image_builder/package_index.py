@@ -0,0 +1,369 @@
+import bisect
+import hashlib
+import importlib.util
+import io
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from sagemaker_image_builder.repodata_parser import iter_repodata_records
+from sagemaker_image_builder.repodata_shards import (
+    SHARDS_INDEX_FILE_NAME,
+    is_sharded_repodata_supported,
+    iter_shard_records,
+    parse_shards_index,
+)
+from sagemaker_image_builder.tracing import span
+
+_DEFAULT_CHANNEL_ALIAS = "https://conda.anaconda.org"
+_DEFAULT_REPODATA_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "sagemaker-image-builder", "repodata")
+# Cached repodata which is younger than this is used without asking the channel whether it changed.
+_DEFAULT_REPODATA_CACHE_TTL_SECONDS = 3600
+_MAX_CONCURRENT_SHARD_FETCHES = 16
+# The major and minor version of e.g. '1.26.0', '2024.1' or '1!2.0', which are grouped in PackageVersions.
+_MAJOR_MINOR_VERSION_PATTERN = re.compile(r"(?:\d+!)?(\d+)(?:\.(\d+))?")
+
+
+class RepodataNotFoundError(Exception):
+    # The channel has no repodata for a subdir, e.g. because it isn't served as static files. Packages of such channels
+    # can still be looked up with `conda search`.
+    pass
+
+
+def get_channel_url(channel: str, channel_alias: str = _DEFAULT_CHANNEL_ALIAS) -> str:
+    # Channels are either names (e.g. 'conda-forge') or urls (e.g. 'file:///tmp/channel').
+    if "://" in channel:
+        return channel.rstrip("/")
+    return f"{channel_alias.rstrip('/')}/{channel}"
+
+
+def get_channel_host(channel: str, channel_alias: str = _DEFAULT_CHANNEL_ALIAS) -> str:
+    return urllib.parse.urlparse(get_channel_url(channel, channel_alias)).netloc
+
+
+def _get_repodata_file_names() -> list[str]:
+    # The zstd-compressed repodata is a fraction of the size of the plain JSON, so prefer it if zstandard is installed.
+    if importlib.util.find_spec("zstandard") is not None:
+        return ["repodata.json.zst", "repodata.json"]
+    return ["repodata.json"]
+
+
+def _is_not_found_error(e: Exception) -> bool:
+    if isinstance(e, urllib.error.HTTPError):
+        return e.code == 404
+    # Missing files of file:// channels are reported as a URLError whose reason is the FileNotFoundError.
+    if isinstance(e, urllib.error.URLError):
+        return isinstance(e.reason, FileNotFoundError)
+    return isinstance(e, FileNotFoundError)
+
+
+def _get_version_order(version: str):
+    from conda.models.version import VersionOrder
+
+    return VersionOrder(version)
+
+
+class PackageVersions:
+    """The distinct versions of a package, sorted by conda's VersionOrder and grouped by major and (major, minor)
+    version, so that e.g. the latest version in the 1.1 line (which 1.10 isn't part of) needs no scan.
+    """
+
+    def __init__(self, versions):
+        version_orders = {}
+        for version in versions:
+            if version not in version_orders:
+                version_orders[version] = _get_version_order(version)
+        self.versions = sorted(version_orders, key=version_orders.get)
+        self._version_orders = [version_orders[version] for version in self.versions]
+        # (major,) or (major, minor) -> the indices of the versions in the release line, in ascending order
+        self._release_lines = {}
+        for i, version in enumerate(self.versions):
+            match = _MAJOR_MINOR_VERSION_PATTERN.match(version)
+            if match is None:
+                continue
+            self._release_lines.setdefault((int(match[1]),), []).append(i)
+            if match[2] is not None:
+                self._release_lines.setdefault((int(match[1]), int(match[2])), []).append(i)
+
+    def get_versions(self, min_version: str = None) -> list[str]:
+        if min_version is None:
+            return list(self.versions)
+        return self.versions[bisect.bisect_left(self._version_orders, _get_version_order(min_version)) :]
+
+    def get_latest_version(self, min_version: str = None, major: int = None, minor: int = None):
+        """Returns the latest version, optionally only in the given major or (major, minor) release line. Returns None
+        if there is no such version, or if it's lower than min_version.
+        """
+        if major is None:
+            indices = range(len(self.versions))
+        else:
+            indices = self._release_lines.get((major,) if minor is None else (major, minor), [])
+        if not indices:
+            return None
+        if min_version is not None and self._version_orders[indices[-1]] < _get_version_order(min_version):
+            return None
+        return self.versions[indices[-1]]
+
+
+class PackageIndex:
+    """In-memory index of the packages in conda channels.
+
+    The repodata of every (channel, subdir) is loaded once, on first use, and indexed by package name, so that any
+    number of packages can be looked up without another round trip to the channel.
+
+    If a cache dir is given, fetched repodata is stored there together with its ETag and Last-Modified headers. Cached
+    repodata is used as is until it's older than the TTL, and refreshed with a conditional request after that. In
+    offline mode, repodata is only ever read from the cache.
+
+    The repodata is parsed incrementally. If package names are given, only the records of those packages are kept,
+    which keeps the memory footprint small even for channels with hundreds of MB of repodata. If the channel also
+    offers sharded repodata, only the shards of those packages are fetched (and cached) in the first place.
+
+    Lookups in subdirs which the channel has no repodata for raise RepodataNotFoundError.
+    """
+
+    def __init__(
+        self,
+        channel_alias: str = _DEFAULT_CHANNEL_ALIAS,
+        cache_dir: str = None,
+        cache_ttl_seconds: float = _DEFAULT_REPODATA_CACHE_TTL_SECONDS,
+        offline: bool = False,
+        package_names=None,
+    ):
+        if offline and not cache_dir:
+            raise Exception("A repodata cache dir is required in offline mode.")
+        self.channel_alias = channel_alias
+        self.cache_dir = cache_dir
+        self.cache_ttl_seconds = cache_ttl_seconds
+        self.offline = offline
+        self._package_names = set(package_names) if package_names is not None else None
+        # (channel, subdir) -> package name -> records. The records of a package are only sorted once it's looked up,
+        # since a channel has many more packages than any image.
+        self._records = {}
+        self._sorted_names = set()
+        # (channel, subdir, package name) -> PackageVersions
+        self._package_versions = {}
+        # (channel, subdir) -> file name -> record
+        self._records_by_file_name = {}
+        self._lock = threading.Lock()
+        # The repodata of different subdirs (e.g. linux-64 and noarch) can be loaded concurrently.
+        self._subdir_locks = {}
+        # (channel, subdir) -> the error message, for subdirs which have no repodata, so that they're only asked once.
+        self._missing_subdirs = {}
+
+    def _get_cache_file_paths(self, url: str) -> (str, str):
+        # The repodata itself, and its url, ETag, Last-Modified and the time at which it was last fetched.
+        cache_key = hashlib.sha256(url.encode()).hexdigest()[:32]
+        # e.g. '.json.zst' for repodata.json.zst
+        extension = "." + os.path.basename(url).partition(".")[2]
+        return os.path.join(self.cache_dir, cache_key + extension), os.path.join(
+            self.cache_dir, f"{cache_key}.state.json"
+        )
+
+    def _read_cache_state(self, repodata_file_path: str, state_file_path: str):
+        if not os.path.isfile(state_file_path):
+            return None
+        try:
+            with open(state_file_path, "r") as f:
+                state = json.load(f)
+        except ValueError:
+            return None
+        # Missing files are cached as well, e.g. channels without a repodata.json.zst.
+        if not state.get("not_found") and not os.path.isfile(repodata_file_path):
+            return None
+        return state
+
+    def _write_cache_file(self, file_path: str, write_func):
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        temp_file = f"{file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_file, "wb") as f:
+            write_func(f)
+        os.replace(temp_file, file_path)
+
+    def _fetch_cached_file(self, url: str) -> str:
+        # Returns the path of the cached file (e.g. repodata.json) at the given url, after refreshing it if it's older
+        # than the TTL.
+        repodata_file_path, state_file_path = self._get_cache_file_paths(url)
+        state = self._read_cache_state(repodata_file_path, state_file_path)
+        if self.offline or (state is not None and time.time() - state["fetched_at"] < self.cache_ttl_seconds):
+            if state is None or state.get("not_found"):
+                raise FileNotFoundError(f"The repodata at {url} isn't cached in {self.cache_dir}.")
+            return repodata_file_path
+
+        headers = {}
+        if state is not None and state.get("etag"):
+            headers["If-None-Match"] = state["etag"]
+        if state is not None and state.get("last_modified"):
+            headers["If-Modified-Since"] = state["last_modified"]
+        try:
+            with span("fetch repodata", url=url):
+                with urllib.request.urlopen(urllib.request.Request(url, headers=headers)) as response:
+                    self._write_cache_file(repodata_file_path, lambda f: shutil.copyfileobj(response, f))
+                    state = {
+                        "url": url,
+                        "etag": response.headers.get("ETag"),
+                        "last_modified": response.headers.get("Last-Modified"),
+                    }
+        except urllib.error.URLError as e:
+            if _is_not_found_error(e):
+                state = {"url": url, "not_found": True}
+            # 304 Not Modified: the cached repodata is still current.
+            elif not isinstance(e, urllib.error.HTTPError) or e.code != 304 or state is None:
+                raise
+        state["fetched_at"] = time.time()
+        self._write_cache_file(state_file_path, lambda f: f.write(json.dumps(state).encode()))
+        if state.get("not_found"):
+            raise FileNotFoundError(f"There is no repodata at {url}.")
+        return repodata_file_path
+
+    @contextmanager
+    def _open_repodata(self, channel: str, subdir: str):
+        # Yields the repodata of the given channel and subdir as a text stream.
+        channel_url = get_channel_url(channel, self.channel_alias)
+        for file_name in _get_repodata_file_names():
+            url = f"{channel_url}/{subdir}/{file_name}"
+            try:
+                # urllib handles both http(s):// and file:// channels.
+                f = open(self._fetch_cached_file(url), "rb") if self.cache_dir else urllib.request.urlopen(url)
+            except (urllib.error.URLError, FileNotFoundError) as e:
+                if not _is_not_found_error(e):
+                    raise
+                continue
+            with f:
+                if file_name.endswith(".zst"):
+                    import zstandard
+
+                    f = zstandard.ZstdDecompressor().stream_reader(f)
+                yield io.TextIOWrapper(f, encoding="utf-8")
+            return
+        if self.offline:
+            raise Exception(
+                f"The repodata of {channel}/{subdir} isn't cached in {self.cache_dir}, it can't be used offline."
+            )
+        raise RepodataNotFoundError(f"There is no repodata for {channel_url}/{subdir}.")
+
+    def _fetch_shard(self, shards_base_url: str, sha256: str) -> bytes:
+        url = f"{shards_base_url}{sha256}.msgpack.zst"
+        shard_file_path = os.path.join(self.cache_dir, "shards", f"{sha256}.msgpack.zst") if self.cache_dir else None
+        # Shards are named by the hash of their content, so cached shards never need to be refreshed.
+        if shard_file_path and os.path.isfile(shard_file_path):
+            with open(shard_file_path, "rb") as f:
+                return f.read()
+        if self.offline:
+            raise FileNotFoundError(f"The repodata shard at {url} isn't cached in {self.cache_dir}.")
+        with span("fetch repodata shard", url=url):
+            with urllib.request.urlopen(url) as response:
+                data = response.read()
+        if hashlib.sha256(data).hexdigest() != sha256:
+            raise Exception(f"The repodata shard at {url} doesn't match its sha256.")
+        if shard_file_path:
+            self._write_cache_file(shard_file_path, lambda f: f.write(data))
+        return data
+
+    def _fetch_shard_records(self, channel: str, subdir: str):
+        # Returns the records of the packages from the sharded repodata of the channel, or None if the channel
+        # doesn't offer it.
+        shards_index_url = f"{get_channel_url(channel, self.channel_alias)}/{subdir}/{SHARDS_INDEX_FILE_NAME}"
+        try:
+            if self.cache_dir:
+                with open(self._fetch_cached_file(shards_index_url), "rb") as f:
+                    data = f.read()
+            else:
+                with urllib.request.urlopen(shards_index_url) as response:
+                    data = response.read()
+        except (urllib.error.URLError, FileNotFoundError) as e:
+            if not _is_not_found_error(e):
+                raise
+            return None
+        shards_base_url, shard_hashes = parse_shards_index(data)
+        shards_base_url = urllib.parse.urljoin(shards_index_url, shards_base_url)
+        names = [name for name in sorted(self._package_names) if name in shard_hashes]
+        with ThreadPoolExecutor(max_workers=_MAX_CONCURRENT_SHARD_FETCHES) as executor:
+            shards = executor.map(lambda name: self._fetch_shard(shards_base_url, shard_hashes[name]), names)
+            return [r for shard in shards for r in iter_shard_records(shard)]
+
+    def _iter_records(self, channel: str, subdir: str):
+        # Channels which offer sharded repodata only need one small shard per package, rather than all of the
+        # repodata of the subdir.
+        if self._package_names is not None and is_sharded_repodata_supported():
+            shard_records = self._fetch_shard_records(channel, subdir)
+            if shard_records is not None:
+                yield from shard_records
+                return
+        with self._open_repodata(channel, subdir) as stream:
+            yield from iter_repodata_records(stream, self._package_names)
+
+    def _load_repodata(self, channel: str, subdir: str) -> dict[str, list[dict]]:
+        records = {}
+        with span("load repodata", channel=channel, subdir=subdir):
+            for file_name, record in self._iter_records(channel, subdir):
+                record.setdefault("fn", file_name)
+                records.setdefault(record["name"], []).append(record)
+        return records
+
+    def _get_subdir_records(self, channel: str, subdir: str, name: str) -> (dict[str, list[dict]], dict[str, dict]):
+        # Returns the records of the given subdir by package name and by file name, loading them if needed.
+        key = (channel, subdir)
+        with self._lock:
+            if self._package_names is not None and name not in self._package_names:
+                # Only the records of the given packages were kept, so all repodata has to be loaded again.
+                self._package_names.add(name)
+                self._records.clear()
+                self._sorted_names.clear()
+                self._package_versions.clear()
+                self._records_by_file_name.clear()
+            subdir_lock = self._subdir_locks.setdefault(key, threading.Lock())
+        with subdir_lock:
+            with self._lock:
+                if key in self._records:
+                    return self._records[key], self._records_by_file_name[key]
+                if key in self._missing_subdirs:
+                    raise RepodataNotFoundError(self._missing_subdirs[key])
+            try:
+                records = self._load_repodata(channel, subdir)
+            except RepodataNotFoundError as e:
+                with self._lock:
+                    self._missing_subdirs[key] = str(e)
+                raise
+            records_by_file_name = {r["fn"]: r for name_records in records.values() for r in name_records}
+            with self._lock:
+                self._records[key] = records
+                self._records_by_file_name[key] = records_by_file_name
+            return records, records_by_file_name
+
+    def get_records(self, channel: str, subdir: str, name: str) -> list[dict]:
+        """Returns the repodata records of the given package, sorted by version and build number."""
+        records = self._get_subdir_records(channel, subdir, name)[0].get(name, [])
+        with self._lock:
+            if (channel, subdir, name) not in self._sorted_names:
+                records.sort(key=lambda r: (_get_version_order(r["version"]), r.get("build_number", 0)))
+                self._sorted_names.add((channel, subdir, name))
+        return records
+
+    def get_record_by_file_name(self, channel: str, subdir: str, name: str, file_name: str):
+        """Returns the repodata record of the given package file (e.g. 'numpy-1.24.2-py38h10c12cc_0.conda'), or None if
+        the channel doesn't have it.
+        """
+        return self._get_subdir_records(channel, subdir, name)[1].get(file_name)
+
+    def get_package_versions(self, channel: str, subdir: str, name: str) -> PackageVersions:
+        records = self.get_records(channel, subdir, name)
+        key = (channel, subdir, name)
+        with self._lock:
+            if key not in self._package_versions:
+                self._package_versions[key] = PackageVersions([record["version"] for record in records])
+            return self._package_versions[key]
+
+    def get_versions(self, channel: str, subdir: str, name: str, min_version: str = None) -> list[str]:
+        """Returns the distinct versions of the given package in ascending order, optionally only the versions which
+        are greater than or equal to min_version.
+        """
+        return self.get_package_versions(channel, subdir, name).get_versions(min_version)
@@ -1,58 +1,111 @@
 import json
 import os
+from concurrent.futures import ThreadPoolExecutor
 from itertools import islice
 
-import conda.cli.python_api
-from conda.models.match_spec import MatchSpec
-
+from sagemaker_image_builder.conda_meta import _DEFAULT_CONDA_PREFIX
 from sagemaker_image_builder.dependency_upgrader import _dependency_metadata
+from sagemaker_image_builder.env_parser import EnvRecord
+from sagemaker_image_builder.image_layers import read_image_layers_from_docker
+from sagemaker_image_builder.package_index import (
+    PackageIndex,
+    PackageVersions,
+    RepodataNotFoundError,
+    get_channel_host,
+)
+from sagemaker_image_builder.query_executor import QueryExecutor
+from sagemaker_image_builder.registry import get_ecr_credentials, get_image_manifest
+from sagemaker_image_builder.tracing import span
 from sagemaker_image_builder.utils import (
+    VersionIndex,
     create_markdown_table,
-    get_dir_for_version,
-    get_match_specs,
+    get_env_records,
+    get_package_metadata_file_path,
     get_semver,
-    pull_conda_package_metadata,
+    load_conda_package_metadata,
+    run_conda_search,
     sizeof_fmt,
 )
 
 
-def _get_package_versions_in_upstream(target_packages_match_spec_out, target_version) -> dict[str, str]:
+def _submit_package_versions_query(
+    record_out: EnvRecord, package_version, package_index: PackageIndex, query_executor: QueryExecutor
+):
+    # Returns the future of the PackageVersions of the package.
+    package = record_out.name
+    if package_index is not None:
+        # All versions are indexed, so the query is shared by all target versions.
+        return query_executor.submit(
+            ("package index versions", record_out.channel, record_out.subdir, package),
+            package_index.get_package_versions,
+            record_out.channel,
+            record_out.subdir,
+            package,
+        )
+    return _submit_conda_search_versions_query(record_out, package_version, query_executor)
+
+
+def _submit_conda_search_versions_query(record_out: EnvRecord, package_version, query_executor: QueryExecutor):
+    package = record_out.name
+    # Execute a conda search api call in the linux-64 subdirectory
+    # packages such as pytorch-gpu are present only in linux-64 sub directory
+    subdir_filter = "[subdir=" + record_out.subdir + "]"
+    match_spec_str = record_out.channel + "::" + package + ">=" + str(package_version) + subdir_filter
+    # Response is of the structure
+    # { 'package_name': [{'url':<someurl>, 'dependencies': <List of dependencies>, 'version':
+    # <version number>}, ..., {'url':<someurl>, 'dependencies': <List of dependencies>, 'version':
+    # <version number>}]
+    return query_executor.submit(
+        ("conda search versions", match_spec_str),
+        lambda: PackageVersions([x["version"] for x in run_conda_search(match_spec_str)[package]]),
+        host=get_channel_host(record_out.channel),
+    )
+
+
+def _get_package_versions_in_upstream(
+    target_packages_match_spec_out,
+    target_version,
+    package_index: PackageIndex = None,
+    query_executor: QueryExecutor = None,
+) -> dict[str, str]:
+    # Versions are looked up in the package index if there is one, and with one `conda search` per package otherwise,
+    # or if the channel has no repodata. Either way, the queries run concurrently on the query executor.
+    if query_executor is None:
+        with QueryExecutor() as query_executor:
+            return _get_package_versions_in_upstream(
+                target_packages_match_spec_out, target_version, package_index, query_executor
+            )
     package_to_version_mapping = {}
     is_major_version_release = target_version.minor == 0 and target_version.patch == 0
     is_minor_version_release = target_version.patch == 0 and not is_major_version_release
-    for package in target_packages_match_spec_out:
-        # Execute a conda search api call in the linux-64 subdirectory
-        # packages such as pytorch-gpu are present only in linux-64 sub directory
-        match_spec_out = target_packages_match_spec_out[package]
-        package_version = str(match_spec_out.get("version")).removeprefix("==")
-        package_version = get_semver(package_version)
-        channel = match_spec_out.get("channel").channel_name
-        subdir_filter = "[subdir=" + match_spec_out.get("subdir") + "]"
-        search_result = conda.cli.python_api.run_command(
-            "search", channel + "::" + package + ">=" + str(package_version) + subdir_filter, "--json"
+    futures = {
+        package: _submit_package_versions_query(
+            record_out, get_semver(record_out.version), package_index, query_executor
         )
-        # Load the first result as json. The API sends a json string inside an array
-        package_metadata = json.loads(search_result[0])[package]
-        # Response is of the structure
-        # { 'package_name': [{'url':<someurl>, 'dependencies': <List of dependencies>, 'version':
-        # <version number>}, ..., {'url':<someurl>, 'dependencies': <List of dependencies>, 'version':
-        # <version number>}]
-        # We only care about the version number in the last index
-        package_version_in_conda = ""
+        for package, record_out in target_packages_match_spec_out.items()
+    }
+    for package, record_out in target_packages_match_spec_out.items():
+        if package_index is not None and isinstance(futures[package].exception(), RepodataNotFoundError):
+            futures[package] = _submit_conda_search_versions_query(
+                record_out, get_semver(record_out.version), query_executor
+            )
+    for package, record_out in target_packages_match_spec_out.items():
+        package_version = get_semver(record_out.version)
+        package_versions = futures[package].result()
+        # Major version releases may pick up any newer version, minor version releases newer versions with the same
+        # major version, and patch version releases newer versions with the same major and minor version.
         if is_major_version_release:
-            latest_package_version_in_conda = package_metadata[-1]["version"]
+            latest_package_version_in_conda = package_versions.get_latest_version(str(package_version))
         elif is_minor_version_release:
-            package_major_version_prefix = str(package_version.major) + "."
-            latest_package_version_in_conda = [
-                x["version"] for x in package_metadata if x["version"].startswith(package_major_version_prefix)
-            ][-1]
+            latest_package_version_in_conda = package_versions.get_latest_version(
+                str(package_version), package_version.major
+            )
         else:
-            package_minor_version_prefix = ".".join([str(package_version.major), str(package_version.minor)])
-            latest_package_version_in_conda = [
-                x["version"] for x in package_metadata if x["version"].startswith(package_minor_version_prefix)
-            ][-1]
-
-        package_to_version_mapping[package] = latest_package_version_in_conda
+            latest_package_version_in_conda = package_versions.get_latest_version(
+                str(package_version), package_version.major, package_version.minor
+            )
+        # e.g. if the installed version was removed from the channel
+        package_to_version_mapping[package] = latest_package_version_in_conda or record_out.version
     return package_to_version_mapping
 
 
@@ -63,7 +116,7 @@ def _generate_staleness_report_per_image(
     print("Package | Current Version in the image | Latest Relevant Version in " "Upstream")
     print("---|---|---")
     for package in package_versions_in_upstream:
-        version_in_image = str(target_packages_match_spec_out[package].get("version")).removeprefix("==")
+        version_in_image = target_packages_match_spec_out[package].version
         if version_in_image == package_versions_in_upstream[package]:
             print(package + "|" + version_in_image + "|" + package_versions_in_upstream[package])
         else:
@@ -73,12 +126,16 @@ def _generate_staleness_report_per_image(
 
 
 def _get_installed_package_versions_and_conda_versions(
-    image_config, target_version_dir, target_version
-) -> (dict[str, MatchSpec], dict[str, str]):
+    image_config,
+    target_version_dir,
+    target_version,
+    package_index: PackageIndex = None,
+    query_executor: QueryExecutor = None,
+) -> (dict[str, EnvRecord], dict[str, str]):
     env_in_file_name = image_config["build_args"]["ENV_IN_FILENAME"]
     env_out_file_name = image_config["env_out_filename"]
-    required_packages_from_target = get_match_specs(target_version_dir + "/" + env_in_file_name).keys()
-    match_spec_out = get_match_specs(target_version_dir + "/" + env_out_file_name)
+    required_packages_from_target = get_env_records(target_version_dir + "/" + env_in_file_name).keys()
+    match_spec_out = get_env_records(target_version_dir + "/" + env_out_file_name)
     # We only care about packages which are present in env.in
     # Remove Python from the dictionary, we don't want to track python version as part of our
     # staleness report.
@@ -86,11 +143,50 @@ def _get_installed_package_versions_and_conda_versions(
         k: v for k, v in match_spec_out.items() if k in required_packages_from_target and k not in _dependency_metadata
     }
     latest_package_versions_in_upstream = _get_package_versions_in_upstream(
-        target_packages_match_spec_out, target_version
+        target_packages_match_spec_out, target_version, package_index, query_executor
     )
     return target_packages_match_spec_out, latest_package_versions_in_upstream
 
 
+# The size report compares either the sizes of the package archives, or the installed (on-disk) sizes of the packages,
+# which are only known from the package metadata that `build` captures from the image.
+_ARCHIVE_SIZE_METRIC = "archive"
+_INSTALLED_SIZE_METRIC = "installed"
+_SIZE_METRIC_KEYS = {_ARCHIVE_SIZE_METRIC: "size", _INSTALLED_SIZE_METRIC: "installed_size"}
+
+
+def _has_package_metadata_files(image_config, version_dirs) -> bool:
+    return all(os.path.exists(get_package_metadata_file_path(image_config, d)) for d in version_dirs)
+
+
+def _load_package_metadata(
+    image_config, version_dir, metric, package_index, query_executor, is_base=False, use_package_metadata_file=True
+):
+    if metric == _ARCHIVE_SIZE_METRIC:
+        return load_conda_package_metadata(
+            image_config, version_dir, package_index, query_executor, use_package_metadata_file
+        )
+    # Installed sizes are only known from the package metadata which `build` captures from the image, rather than from
+    # the channels.
+    package_metadata_file_path = get_package_metadata_file_path(image_config, version_dir)
+    pkg_metadata = None
+    if os.path.exists(package_metadata_file_path):
+        with open(package_metadata_file_path) as f:
+            pkg_metadata = json.load(f)
+    if pkg_metadata is None or any("installed_size" not in d for d in pkg_metadata.values()):
+        message = (
+            f"The installed size of the packages in {version_dir} is unknown. It's only captured by `build`, in "
+            f"{package_metadata_file_path}."
+        )
+        # e.g. the base version was built before the package metadata was captured, which is reported like a missing
+        # base version.
+        if is_base:
+            print(f"WARNING: {message}")
+            return None
+        raise Exception(message)
+    return pkg_metadata
+
+
 def _validate_new_package_size(new_package_total_size, target_total_size, image_type, target_version):
     # Validate if the new packages account for <= 5% of the total python package size of target image.
     new_package_total_size_percent_threshold = 5
@@ -152,18 +248,24 @@ def _validate_new_package_size(new_package_total_size, target_total_size, image_
 
 
 def _generate_python_package_size_report_per_image(
-    base_pkg_metadata, target_pkg_metadata, image_config, base_version, target_version
+    base_pkg_metadata, target_pkg_metadata, image_config, base_version, target_version, metric=_ARCHIVE_SIZE_METRIC
 ):
     validate_result = None
     image_type = image_config["image_type"].upper()
+    size_key = _SIZE_METRIC_KEYS[metric]
     print("\n# Python Package Size Report " + "(" + image_type + ")\n")
     print("\n### Target Image Version: " + str(target_version) + " | Base Image Version: " + str(base_version) + "\n")
+    if metric == _INSTALLED_SIZE_METRIC:
+        print("Sizes are the installed (on-disk) sizes of the packages.")
+        target_pkg_metadata = dict(
+            sorted(target_pkg_metadata.items(), key=lambda item: item[1][size_key], reverse=True)
+        )
     if not base_pkg_metadata or not base_version:
         print("WARNING: No Python package metadata file found for base image, only partial results will be shown.")
-    base_total_size = sum(d["size"] for d in base_pkg_metadata.values()) if base_pkg_metadata else None
+    base_total_size = sum(d[size_key] for d in base_pkg_metadata.values()) if base_pkg_metadata else None
 
     # Print out the total size change of all Python packages in the image.
-    target_total_size = sum(d["size"] for d in target_pkg_metadata.values())
+    target_total_size = sum(d[size_key] for d in target_pkg_metadata.values())
     total_size_delta_val = (target_total_size - base_total_size) if base_total_size else None
     total_size_delta_rel = (total_size_delta_val / base_total_size) if base_total_size else None
     print("\n## Python Packages Total Size Summary\n")
@@ -187,7 +289,7 @@ def _generate_python_package_size_report_per_image(
         create_markdown_table(
             ["Package", "Version in the Target Image", "Size"],
             [
-                {"pkg": k, "version": v["version"], "size": sizeof_fmt(v["size"])}
+                {"pkg": k, "version": v["version"], "size": sizeof_fmt(v[size_key])}
                 for k, v in islice(target_pkg_metadata.items(), None, 20)
             ],
         )
@@ -200,8 +302,8 @@ def _generate_python_package_size_report_per_image(
         package_size_delta_list = []
         for k, v in target_pkg_metadata.items():
             if k not in base_pkg_metadata or base_pkg_metadata[k]["version"] != v["version"]:
-                base_pkg_size = base_pkg_metadata[k]["size"] if k in base_pkg_metadata else 0
-                size_delta_abs = v["size"] - base_pkg_size
+                base_pkg_size = base_pkg_metadata[k][size_key] if k in base_pkg_metadata else 0
+                size_delta_abs = v[size_key] - base_pkg_size
                 package_size_delta_list.append(
                     {
                         "package": k,
@@ -212,7 +314,7 @@ def _generate_python_package_size_report_per_image(
                     }
                 )
                 if k not in base_pkg_metadata:
-                    new_package_total_size += v["size"]
+                    new_package_total_size += v[size_key]
         # Sort the package size delta based on absolute size diff in decending order.
         package_size_delta_list = sorted(package_size_delta_list, key=lambda item: item["size_delta_abs"], reverse=True)
         for v in package_size_delta_list:
@@ -237,45 +339,354 @@ def _generate_python_package_size_report_per_image(
     return validate_result
 
 
-def generate_package_staleness_report(args):
+def _get_size_change_row(name, target_size, base_size) -> dict:
+    size_delta_val = (target_size - base_size) if base_size is not None else None
+    return {
+        "name": name,
+        "target_size": sizeof_fmt(target_size),
+        "base_size": sizeof_fmt(base_size) if base_size is not None else "-",
+        "size_delta_val": sizeof_fmt(size_delta_val) if size_delta_val else "-",
+        "size_delta_rel": str(round(size_delta_val / base_size * 100, 2)) if size_delta_val and base_size else "-",
+    }
+
+
+def _get_package_layer_sizes(image_layers) -> dict:
+    # Sums the bytes of every package over all layers, largest package first.
+    package_sizes = {}
+    for layer in image_layers["layers"]:
+        for package_name, size in layer["package_sizes"].items():
+            package_sizes[package_name] = package_sizes.get(package_name, 0) + size
+    return dict(sorted(package_sizes.items(), key=lambda item: item[1], reverse=True))
+
+
+def _generate_image_layer_report_per_image(
+    base_image_layers, target_image_layers, image_config, base_version, target_version
+):
+    image_type = image_config["image_type"].upper()
+    print("\n# Image Layer Size Report " + "(" + image_type + ")\n")
+    print("\n### Target Image Version: " + str(target_version) + " | Base Image Version: " + str(base_version) + "\n")
+    if not base_image_layers:
+        print("WARNING: The base image isn't available locally, only partial results will be shown.")
+
+    # Print out the total compressed (i.e. pulled) and uncompressed size change of the image.
+    print("\n## Image Total Size Summary\n")
+    rows = []
+    for name, size_key in [("Compressed", "compressed_size"), ("Uncompressed", "size")]:
+        target_size = sum(layer[size_key] for layer in target_image_layers["layers"])
+        base_size = sum(layer[size_key] for layer in base_image_layers["layers"]) if base_image_layers else None
+        rows.append(_get_size_change_row(name, target_size, base_size))
+    print(
+        create_markdown_table(["Size", "Target Version", "Base Version", "Size Change (abs)", "Size Change (%)"], rows)
+    )
+
+    # Print out every layer of the target image, from the bottom up.
+    print("\n## Layers\n")
+    print(
+        create_markdown_table(
+            ["Layer", "Created By", "Compressed Size", "Uncompressed Size"],
+            [
+                {
+                    "layer": i,
+                    # Instructions can contain pipes, which would break the table.
+                    "created_by": layer["created_by"][:80].replace("|", "\\|"),
+                    "compressed_size": sizeof_fmt(layer["compressed_size"]),
+                    "size": sizeof_fmt(layer["size"]),
+                }
+                for i, layer in enumerate(target_image_layers["layers"])
+            ],
+        )
+    )
+
+    # Print out the 20 packages which take the most bytes in the layers of the image.
+    target_package_sizes = _get_package_layer_sizes(target_image_layers)
+    target_package_versions = target_image_layers["package_versions"]
+    print("\n## Top-20 Largest Packages in the Image Layers\n")
+    print(
+        create_markdown_table(
+            ["Package", "Version in the Target Image", "Uncompressed Size"],
+            [
+                {"pkg": k, "version": target_package_versions.get(k, "-"), "size": sizeof_fmt(v)}
+                for k, v in islice(target_package_sizes.items(), None, 20)
+            ],
+        )
+    )
+
+    # Print out the size change of every package whose bytes in the image layers changed, sorted decending by size.
+    if base_image_layers:
+        base_package_sizes = _get_package_layer_sizes(base_image_layers)
+        base_package_versions = base_image_layers["package_versions"]
+        package_size_delta_list = []
+        for k in target_package_sizes.keys() | base_package_sizes.keys():
+            size_delta_abs = target_package_sizes.get(k, 0) - base_package_sizes.get(k, 0)
+            if size_delta_abs:
+                package_size_delta_list.append(
+                    {
+                        "package": k,
+                        "target_version": target_package_versions.get(k, "-") if k in target_package_sizes else "-",
+                        "base_version": base_package_versions.get(k, "-") if k in base_package_sizes else "-",
+                        "size_delta_abs": size_delta_abs,
+                        "size_delta_rel": size_delta_abs / base_package_sizes[k] if k in base_package_sizes else None,
+                    }
+                )
+        package_size_delta_list = sorted(package_size_delta_list, key=lambda item: item["size_delta_abs"], reverse=True)
+        for v in package_size_delta_list:
+            v["size_delta_rel"] = str(round(v["size_delta_rel"] * 100, 2)) if v["size_delta_rel"] else "-"
+            v["size_delta_abs"] = sizeof_fmt(v["size_delta_abs"])
+        print("\n## Package Size Delta in the Image Layers\n")
+        print(
+            create_markdown_table(
+                [
+                    "Package",
+                    "Version in the Target Image",
+                    "Version in the Base Image",
+                    "Size Change (abs)",
+                    "Size Change (%)",
+                ],
+                package_size_delta_list,
+            )
+        )
+
+
+def _get_local_image(image_config, version) -> str:
+    # The tag which `build` gives every image for testing, e.g. localhost/sagemaker-distribution:1.6.2-cpu
+    image_tag_suffix = image_config["image_tag_suffix"] if "image_tag_suffix" in image_config else ""
+    return f'localhost/{image_config["image_name"]}:{version}{image_tag_suffix}'
+
+
+def _read_local_image_layers(docker_client, image_config, version):
+    from docker.errors import ImageNotFound
+
+    conda_prefix = image_config.get("conda_prefix", _DEFAULT_CONDA_PREFIX)
+    try:
+        with span("read image layers"):
+            return read_image_layers_from_docker(docker_client, _get_local_image(image_config, version), conda_prefix)
+    except ImageNotFound:
+        return None
+
+
+def generate_image_layer_report(args):
+    # docker is only imported by the subcommands which need it.
+    import docker
+
     with open(args.image_config_file) as jsonfile:
-        image_configs = json.load(jsonfile)
+        _image_generator_configs = json.load(jsonfile)
     target_version = get_semver(args.target_patch_version)
-    target_version_dir = get_dir_for_version(target_version)
-    for image_config in image_configs:
-        (
-            target_packages_match_spec_out,
-            latest_package_versions_in_upstream,
-        ) = _get_installed_package_versions_and_conda_versions(image_config, target_version_dir, target_version)
-        _generate_staleness_report_per_image(
-            latest_package_versions_in_upstream, target_packages_match_spec_out, image_config, target_version
+    version_index = VersionIndex()
+    base_version = version_index.get_source_version(target_version)
+    docker_client = docker.from_env()
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        for image_config in _image_generator_configs:
+            with span("image layer report", track=image_config["image_type"]):
+                # The base and target images are read at the same time.
+                base_image_layers_future = (
+                    executor.submit(_read_local_image_layers, docker_client, image_config, base_version)
+                    if base_version
+                    else None
+                )
+                target_image_layers = _read_local_image_layers(docker_client, image_config, target_version)
+                base_image_layers = base_image_layers_future.result() if base_version else None
+                if target_image_layers is None:
+                    raise Exception(f"{_get_local_image(image_config, target_version)} doesn't exist, build it first.")
+                _generate_image_layer_report_per_image(
+                    base_image_layers, target_image_layers, image_config, base_version, target_version
+                )
+
+
+def _get_download_delta(base_manifest, target_manifest) -> (int, list[dict]):
+    # A client which holds the base image already has all of its layers, so it only pulls the other layers of the
+    # target image (every one of them only once), and the image config.
+    base_layer_digests = {layer["digest"] for layer in base_manifest["layers"]} if base_manifest else set()
+    layers_to_pull = {}
+    for layer in target_manifest["layers"]:
+        if layer["digest"] not in base_layer_digests:
+            layers_to_pull[layer["digest"]] = layer
+    layers_to_pull = sorted(layers_to_pull.values(), key=lambda layer: layer["size"], reverse=True)
+    return sum(layer["size"] for layer in layers_to_pull) + target_manifest["config"]["size"], layers_to_pull
+
+
+def _generate_download_delta_report_per_image(
+    base_manifest, target_manifest, image_config, base_version, target_version, max_delta=None
+):
+    validate_result = None
+    image_type = image_config["image_type"].upper()
+    print("\n# Download Delta Report " + "(" + image_type + ")\n")
+    print("\n### Target Image Version: " + str(target_version) + " | Base Image Version: " + str(base_version) + "\n")
+    if not base_manifest:
+        print("WARNING: No base image found in the registry, the whole target image has to be pulled.")
+
+    download_size, layers_to_pull = _get_download_delta(base_manifest, target_manifest)
+    image_size = sum(layer["size"] for layer in target_manifest["layers"]) + target_manifest["config"]["size"]
+    download_size_string = sizeof_fmt(download_size)
+    if max_delta is not None and download_size > max_delta:
+        validate_result = (
+            f"Upgrading the {image_type} image from version {base_version} to {target_version} requires pulling "
+            f"{sizeof_fmt(download_size)}, which is more than {sizeof_fmt(max_delta)}!"
         )
+        download_size_string = "${\\color{red}" + download_size_string + "}$"
 
+    # Print out the total compressed bytes which a client that holds the base image pulls to upgrade.
+    print("\n## Download Size Summary\n")
+    print(
+        create_markdown_table(
+            ["Layers to Pull", "Download Size", "Target Image Size (compressed)", "Download Size (%)"],
+            [
+                {
+                    "layers_to_pull": f'{len(layers_to_pull)}/{len(target_manifest["layers"])}',
+                    "download_size": download_size_string,
+                    "image_size": sizeof_fmt(image_size),
+                    "download_size_rel": str(round(download_size / image_size * 100, 2)),
+                }
+            ],
+        )
+    )
 
-def generate_package_size_report(args):
+    # Print out the layers which have to be pulled, sorted decending by size.
+    print("\n## Layers to Pull\n")
+    print(
+        create_markdown_table(
+            ["Layer Digest", "Compressed Size"],
+            [{"digest": layer["digest"], "size": sizeof_fmt(layer["size"])} for layer in layers_to_pull],
+        )
+    )
+    return validate_result
+
+
+def generate_download_delta_report(args):
     with open(args.image_config_file) as jsonfile:
         _image_generator_configs = json.load(jsonfile)
     target_version = get_semver(args.target_patch_version)
-    target_version_dir = get_dir_for_version(target_version)
-
-    base_version = None
-    source_version_txt_file_path = f"{target_version_dir}/source-version.txt"
-    if os.path.exists(source_version_txt_file_path):
-        with open(source_version_txt_file_path, "r") as f:
-            source_patch_version = f.readline()
-        base_version = get_semver(source_patch_version)
-    base_version_dir = get_dir_for_version(base_version) if base_version else None
+    version_index = VersionIndex()
+    base_version = version_index.get_source_version(target_version)
+    # Registries other than ECR (e.g. a local registry) are accessed anonymously.
+    username, password = (
+        get_ecr_credentials(args.region, args.repository, args.ecr_credentials_cache_file)
+        if args.region
+        else (None, None)
+    )
     validate_results = []
     for image_config in _image_generator_configs:
-        base_pkg_metadata = pull_conda_package_metadata(image_config, base_version_dir) if base_version else None
-        target_pkg_metadata = pull_conda_package_metadata(image_config, target_version_dir)
-
-        validate_result = _generate_python_package_size_report_per_image(
-            base_pkg_metadata, target_pkg_metadata, image_config, base_version, target_version
-        )
+        with span("download delta report", track=image_config["image_type"]):
+            image_tag_suffix = image_config["image_tag_suffix"] if "image_tag_suffix" in image_config else ""
+            target_tag = f"{target_version}{image_tag_suffix}"
+            with span("registry manifest lookup"):
+                target_manifest = get_image_manifest(args.repository, target_tag, username, password)
+                base_manifest = (
+                    get_image_manifest(args.repository, f"{base_version}{image_tag_suffix}", username, password)
+                    if base_version
+                    else None
+                )
+            if target_manifest is None:
+                raise Exception(f"{args.repository}:{target_tag} doesn't exist, push it first.")
+            validate_result = _generate_download_delta_report_per_image(
+                base_manifest, target_manifest, image_config, base_version, target_version, args.max_delta
+            )
         if validate_result:
             validate_results.append(validate_result)
 
+    if validate_results:
+        raise Exception(f"Download Delta Validation Failed! Issues found: {validate_results}")
+    if args.max_delta is not None:
+        print("Download Delta Validation Passed!")
+
+
+def _get_package_index(args, image_configs, version_dirs) -> PackageIndex:
+    # Shared by all images, so that the repodata of every channel is only loaded once. Only the records of the
+    # packages in the images are kept.
+    package_names = set()
+    for version_dir in version_dirs:
+        for image_config in image_configs:
+            package_names.update(get_env_records(version_dir + "/" + image_config["env_out_filename"]).keys())
+    return PackageIndex(
+        channel_alias=args.channel_alias,
+        cache_dir=args.repodata_cache_dir,
+        cache_ttl_seconds=args.repodata_cache_ttl,
+        offline=args.offline,
+        package_names=package_names,
+    )
+
+
+def _get_query_executor(args) -> QueryExecutor:
+    # Shared by all images, so that e.g. the cpu and gpu images only query every package once.
+    return QueryExecutor(args.max_concurrent_queries, args.max_queries_per_second)
+
+
+def generate_package_staleness_report(args):
+    with open(args.image_config_file) as jsonfile:
+        image_configs = json.load(jsonfile)
+    target_version = get_semver(args.target_patch_version)
+    target_version_dir = VersionIndex().get_dir(target_version)
+    package_index = _get_package_index(args, image_configs, [target_version_dir])
+    with _get_query_executor(args) as query_executor:
+        for image_config in image_configs:
+            with span("staleness report", track=image_config["image_type"]):
+                (
+                    target_packages_match_spec_out,
+                    latest_package_versions_in_upstream,
+                ) = _get_installed_package_versions_and_conda_versions(
+                    image_config, target_version_dir, target_version, package_index, query_executor
+                )
+                _generate_staleness_report_per_image(
+                    latest_package_versions_in_upstream, target_packages_match_spec_out, image_config, target_version
+                )
+
+
+def generate_package_size_report(args):
+    with open(args.image_config_file) as jsonfile:
+        _image_generator_configs = json.load(jsonfile)
+    target_version = get_semver(args.target_patch_version)
+    version_index = VersionIndex()
+    target_version_dir = version_index.get_dir(target_version)
+
+    base_version = version_index.get_source_version(target_version)
+    base_version_dir = version_index.get_dir(base_version) if base_version else None
+    package_index = _get_package_index(
+        args, _image_generator_configs, [base_version_dir, target_version_dir] if base_version else [target_version_dir]
+    )
+    validate_results = []
+    with _get_query_executor(args) as query_executor, ThreadPoolExecutor(max_workers=2) as executor:
+        for image_config in _image_generator_configs:
+            with span("size report", track=image_config["image_type"]):
+                with span("pull package metadata"):
+                    # The package metadata files list every installed package, while the channels only know the
+                    # conda-forge ones. So that both versions are compared on the same packages, the files are only
+                    # used if both versions have them.
+                    use_package_metadata_files = _has_package_metadata_files(
+                        image_config, [base_version_dir, target_version_dir] if base_version else [target_version_dir]
+                    )
+                    # The base and target envs are loaded at the same time, and share the package index, so that
+                    # their repodata is only loaded once.
+                    base_pkg_metadata_future = (
+                        executor.submit(
+                            _load_package_metadata,
+                            image_config,
+                            base_version_dir,
+                            args.metric,
+                            package_index,
+                            query_executor,
+                            is_base=True,
+                            use_package_metadata_file=use_package_metadata_files,
+                        )
+                        if base_version
+                        else None
+                    )
+                    target_pkg_metadata_future = executor.submit(
+                        _load_package_metadata,
+                        image_config,
+                        target_version_dir,
+                        args.metric,
+                        package_index,
+                        query_executor,
+                        use_package_metadata_file=use_package_metadata_files,
+                    )
+                    base_pkg_metadata = base_pkg_metadata_future.result() if base_version else None
+                    target_pkg_metadata = target_pkg_metadata_future.result()
+
+                validate_result = _generate_python_package_size_report_per_image(
+                    base_pkg_metadata, target_pkg_metadata, image_config, base_version, target_version, args.metric
+                )
+            if validate_result:
+                validate_results.append(validate_result)
+
     if args.validate:
         if validate_results:
             raise Exception(f"Size Validation Failed! Issues found: {validate_results}")
@@ -0,0 +1,58 @@
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+_DEFAULT_MAX_WORKERS = 8
+# Be polite to public channels, e.g. conda.anaconda.org.
+_DEFAULT_MAX_QUERIES_PER_SECOND_PER_HOST = 10
+
+
+class QueryExecutor:
+    """Runs package queries (e.g. `conda search` calls or package index lookups) concurrently on a thread pool.
+
+    Queries are de-duplicated by key, so that e.g. the cpu and gpu images asking for the same package only cost one
+    query. Queries against a host are started at most max_queries_per_second_per_host times per second.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = _DEFAULT_MAX_WORKERS,
+        max_queries_per_second_per_host: float = _DEFAULT_MAX_QUERIES_PER_SECOND_PER_HOST,
+    ):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._min_interval_seconds = 1 / max_queries_per_second_per_host if max_queries_per_second_per_host else 0
+        self._futures = {}
+        # host -> the earliest time at which the next query against the host may start
+        self._next_query_times = {}
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+    def _wait_for_host(self, host: str):
+        with self._lock:
+            now = time.monotonic()
+            query_time = max(now, self._next_query_times.get(host, now))
+            self._next_query_times[host] = query_time + self._min_interval_seconds
+        if query_time > now:
+            time.sleep(query_time - now)
+
+    def _run(self, host: str, func, args):
+        if host is not None and self._min_interval_seconds:
+            self._wait_for_host(host)
+        return func(*args)
+
+    def submit(self, key, func, *args, host: str = None) -> Future:
+        """Runs func(*args), unless a query with the same key was submitted before, in which case the future of that
+        query is returned. Queries which send requests to a host should name it, so that they're rate limited.
+        """
+        with self._lock:
+            if key not in self._futures:
+                self._futures[key] = self._executor.submit(self._run, host, func, args)
+            return self._futures[key]
@@ -0,0 +1,215 @@
+import base64
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from sagemaker_image_builder.tracing import span
+
+# Refresh ECR authorization tokens this many seconds before they expire, so that a token never expires mid-push.
+_ECR_TOKEN_EXPIRY_MARGIN_SECONDS = 300
+# ECR tokens are valid for 12 hours. Be conservative if the response doesn't say when the token expires.
+_ECR_TOKEN_DEFAULT_TTL_SECONDS = 3600
+
+# Both caches are keyed by (ECR client name, region).
+_ecr_clients = {}
+_ecr_credentials_cache = {}
+_ecr_credentials_lock = threading.Lock()
+
+
+def _get_ecr_client_name(repository: str) -> str:
+    return "ecr-public" if repository.startswith("public.ecr.aws") else "ecr"
+
+
+def _get_ecr_client(ecr_client_name: str, region: str):
+    key = (ecr_client_name, region)
+    if key not in _ecr_clients:
+        # boto3 takes a while to import, so only import it once an ECR client is needed.
+        import boto3
+
+        _ecr_clients[key] = boto3.client(ecr_client_name, region_name=region)
+    return _ecr_clients[key]
+
+
+def _is_valid_ecr_credentials(credentials) -> bool:
+    return credentials is not None and credentials["expires_at"] - _ECR_TOKEN_EXPIRY_MARGIN_SECONDS > time.time()
+
+
+def _read_ecr_credentials_cache_file(credentials_cache_file: str) -> dict:
+    if not credentials_cache_file or not os.path.isfile(credentials_cache_file):
+        return {}
+    try:
+        with open(credentials_cache_file, "r") as f:
+            return json.load(f)
+    except ValueError:
+        return {}
+
+
+def _write_ecr_credentials_cache_file(credentials_cache_file: str, cache_key: str, credentials: dict):
+    cached_credentials = _read_ecr_credentials_cache_file(credentials_cache_file)
+    # Drop expired tokens, so that the file doesn't grow forever.
+    cached_credentials = {k: v for k, v in cached_credentials.items() if _is_valid_ecr_credentials(v)}
+    cached_credentials[cache_key] = credentials
+    os.makedirs(os.path.dirname(credentials_cache_file) or ".", exist_ok=True)
+    temp_file = f"{credentials_cache_file}.{os.getpid()}.tmp"
+    # The file contains registry passwords, so it must only be readable by the current user.
+    with os.fdopen(os.open(temp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w") as f:
+        json.dump(cached_credentials, f)
+    os.replace(temp_file, credentials_cache_file)
+
+
+def _fetch_ecr_credentials(ecr_client_name: str, region: str) -> dict:
+    _authorization_data = _get_ecr_client(ecr_client_name, region).get_authorization_token()["authorizationData"]
+    if ecr_client_name == "ecr":
+        # If we are using the ecr private client, then fetch the first index from authorizationData
+        _authorization_data = _authorization_data[0]
+    username, password = base64.b64decode(_authorization_data["authorizationToken"]).decode().split(":")
+    expires_at = _authorization_data.get("expiresAt")
+    expires_at = expires_at.timestamp() if expires_at else time.time() + _ECR_TOKEN_DEFAULT_TTL_SECONDS
+    return {"username": username, "password": password, "expires_at": expires_at}
+
+
+def get_ecr_credentials(region, repository: str, credentials_cache_file: str = None) -> (str, str):
+    """Returns the username and password to authenticate with the registry of the given ECR repository.
+
+    Authorization tokens are cached per ECR client type and region until shortly before they expire. If a credentials
+    cache file is given, tokens are persisted there as well, so that they can be reused by subsequent runs.
+    """
+    ecr_client_name = _get_ecr_client_name(repository)
+    key = (ecr_client_name, region)
+    with _ecr_credentials_lock:
+        credentials = _ecr_credentials_cache.get(key)
+        if not _is_valid_ecr_credentials(credentials) and credentials_cache_file:
+            credentials = _read_ecr_credentials_cache_file(credentials_cache_file).get(f"{ecr_client_name}|{region}")
+        if not _is_valid_ecr_credentials(credentials):
+            with span("ECR authorization"):
+                credentials = _fetch_ecr_credentials(ecr_client_name, region)
+            if credentials_cache_file:
+                _write_ecr_credentials_cache_file(credentials_cache_file, f"{ecr_client_name}|{region}", credentials)
+        _ecr_credentials_cache[key] = credentials
+    return credentials["username"], credentials["password"]
+
+
+_MANIFEST_MEDIA_TYPES = [
+    "application/vnd.docker.distribution.manifest.v2+json",
+    "application/vnd.docker.distribution.manifest.list.v2+json",
+    "application/vnd.oci.image.manifest.v1+json",
+    "application/vnd.oci.image.index.v1+json",
+]
+_REGISTRY_REQUEST_TIMEOUT_SECONDS = 60
+
+
+def _get_registry_url_and_name(repository: str) -> (str, str):
+    # 'aws_account_id.dkr.ecr.us-west-2.amazonaws.com/my-repository' => registry host and the repository name in it.
+    registry_host, _, name = repository.partition("/")
+    # Local registries (e.g. a registry:2 container used for testing) are served over plain http.
+    scheme = "http" if registry_host.split(":")[0] in ("localhost", "127.0.0.1") else "https"
+    return f"{scheme}://{registry_host}", name
+
+
+def _get_bearer_token(www_authenticate: str, username: str, password: str) -> str:
+    # Implements the token authentication flow of the registry API: the registry responds with a challenge like
+    # 'Bearer realm="https://auth.example.com/token",service="registry",scope="repository:name:pull,push"', and a
+    # token for the requested scope is fetched from the realm.
+    challenge = dict(re.findall(r'(\w+)="([^"]*)"', www_authenticate))
+    query = urllib.parse.urlencode({k: v for k, v in challenge.items() if k in ("service", "scope")})
+    request = urllib.request.Request(f'{challenge["realm"]}?{query}')
+    if username is not None:
+        request.add_header("Authorization", _get_basic_auth_header(username, password))
+    with urllib.request.urlopen(request, timeout=_REGISTRY_REQUEST_TIMEOUT_SECONDS) as response:
+        token_response = json.load(response)
+    return token_response.get("token") or token_response["access_token"]
+
+
+def _get_basic_auth_header(username: str, password: str) -> str:
+    return "Basic " + base64.b64encode(f"{username}:{password}".encode()).decode()
+
+
+# Sends a request to the registry HTTP API. Returns a tuple of the response status, headers and body. A 404 response
+# is returned as is, while any other error is raised.
+def _registry_request(
+    repository: str, method: str, path: str, username: str, password: str, headers: dict = None, data: bytes = None
+):
+    registry_url, name = _get_registry_url_and_name(repository)
+    url = f"{registry_url}/v2/{name}/{path}"
+    authorization = _get_basic_auth_header(username, password) if username is not None else None
+    for _ in range(2):
+        request = urllib.request.Request(url, data=data, method=method, headers=dict(headers or {}))
+        if authorization is not None:
+            request.add_header("Authorization", authorization)
+        try:
+            with urllib.request.urlopen(request, timeout=_REGISTRY_REQUEST_TIMEOUT_SECONDS) as response:
+                return response.status, response.headers, response.read()
+        except urllib.error.HTTPError as e:
+            www_authenticate = e.headers.get("WWW-Authenticate", "")
+            if (
+                e.code == 401
+                and www_authenticate.startswith("Bearer")
+                and not (authorization or "").startswith("Bearer")
+            ):
+                authorization = "Bearer " + _get_bearer_token(www_authenticate, username, password)
+                continue
+            if e.code == 404:
+                return e.code, e.headers, e.read()
+            raise
+    raise Exception(f"Unable to authenticate with the registry of {repository}")
+
+
+def get_manifest(repository: str, reference: str, username: str = None, password: str = None):
+    """Returns the media type, digest and raw content of the manifest with the given tag or digest in the given
+    repository, or None if the manifest doesn't exist.
+    """
+    status, headers, body = _registry_request(
+        repository, "GET", f"manifests/{reference}", username, password, {"Accept": ", ".join(_MANIFEST_MEDIA_TYPES)}
+    )
+    if status == 404:
+        return None
+    digest = headers.get("Docker-Content-Digest") or "sha256:" + hashlib.sha256(body).hexdigest()
+    return headers.get("Content-Type"), digest, body
+
+
+def put_manifest(repository: str, tag: str, media_type: str, manifest: bytes, username=None, password=None) -> str:
+    """Uploads the given manifest under the given tag. Since the manifest only refers to blobs which already exist in
+    the repository, this tags an image without pushing any of its layers again. Returns the digest of the manifest.
+    """
+    _, headers, _ = _registry_request(
+        repository, "PUT", f"manifests/{tag}", username, password, {"Content-Type": media_type}, manifest
+    )
+    return headers.get("Docker-Content-Digest") or "sha256:" + hashlib.sha256(manifest).hexdigest()
+
+
+def get_manifest_config_digest(manifest: bytes):
+    # Only image manifests refer to the image config. Its digest is the id of the image in the local docker daemon.
+    return json.loads(manifest).get("config", {}).get("digest")
+
+
+_IMAGE_INDEX_MEDIA_TYPES = (
+    "application/vnd.docker.distribution.manifest.list.v2+json",
+    "application/vnd.oci.image.index.v1+json",
+)
+
+
+def get_image_manifest(
+    repository: str, reference: str, username: str = None, password: str = None, platform: str = "linux/amd64"
+):
+    """Returns the parsed image manifest with the given tag or digest in the given repository, or None if it doesn't
+    exist. If the reference is a multi-platform image index, the manifest of the image for the given platform is
+    returned.
+    """
+    manifest = get_manifest(repository, reference, username, password)
+    if manifest is None:
+        return None
+    media_type, _, body = manifest
+    image_manifest = json.loads(body)
+    if (image_manifest.get("mediaType") or media_type) not in _IMAGE_INDEX_MEDIA_TYPES:
+        return image_manifest
+    for platform_manifest in image_manifest.get("manifests", []):
+        manifest_platform = platform_manifest.get("platform", {})
+        if f'{manifest_platform.get("os")}/{manifest_platform.get("architecture")}' == platform:
+            return get_image_manifest(repository, platform_manifest["digest"], username, password, platform)
+    raise Exception(f"{repository}:{reference} doesn't have an image for {platform}.")
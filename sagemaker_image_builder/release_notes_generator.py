@@ -2,7 +2,8 @@ import os
 
 from semver import Version
 
-from sagemaker_image_builder.utils import get_dir_for_version, get_match_specs
+from sagemaker_image_builder.tracing import traced
+from sagemaker_image_builder.utils import get_dir_for_version, get_env_records
 
 
 def _get_installed_packages(target_version_dir, image_config) -> dict[str, str]:
@@ -11,14 +12,10 @@ def _get_installed_packages(target_version_dir, image_config) -> dict[str, str]:
     env_in_file_path = target_version_dir + "/" + env_in_file_name
     if not os.path.exists(env_in_file_path):
         return {}
-    required_packages_from_target = get_match_specs(target_version_dir + "/" + env_in_file_name).keys()
-    target_match_spec_out = get_match_specs(target_version_dir + "/" + env_out_file_name)
+    required_packages_from_target = get_env_records(target_version_dir + "/" + env_in_file_name).keys()
+    target_env_records_out = get_env_records(target_version_dir + "/" + env_out_file_name)
     # We only care about the packages which are present in the target version env.in file
-    return {
-        k: str(v.get("version")).removeprefix("==")
-        for k, v in target_match_spec_out.items()
-        if k in required_packages_from_target
-    }
+    return {k: v.version for k, v in target_env_records_out.items() if k in required_packages_from_target}
 
 
 def _get_package_to_image_type_mapping(image_type_package_metadata):
@@ -44,6 +41,7 @@ def _get_image_type_package_metadata(target_version_dir, image_config):
     return image_type_package_metadata
 
 
+@traced("generate release notes")
 def generate_release_notes(target_version: Version, image_config: list[dict]):
     target_version_dir = get_dir_for_version(target_version)
     if not os.path.exists(target_version_dir):
@@ -0,0 +1,91 @@
+import json
+
+_WHITESPACE = " \t\n\r"
+_PACKAGES_KEYS = ("packages", "packages.conda")
+_DEFAULT_CHUNK_SIZE = 1 << 20
+
+
+class _StreamingJsonReader:
+    # Decodes one JSON value at a time from a text stream, holding at most about one chunk of it in memory.
+    def __init__(self, stream, chunk_size: int):
+        self._stream = stream
+        self._chunk_size = chunk_size
+        self._buffer = ""
+        self._pos = 0
+        self._eof = False
+        self._decoder = json.JSONDecoder()
+
+    def _fill(self) -> bool:
+        chunk = self._stream.read(self._chunk_size)
+        if not chunk:
+            self._eof = True
+            return False
+        self._buffer = self._buffer[self._pos :] + chunk
+        self._pos = 0
+        return True
+
+    def peek(self) -> str:
+        # Returns the next non-whitespace character without consuming it.
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in _WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                raise ValueError("Unexpected end of repodata.")
+
+    def consume(self, expected: str = None) -> str:
+        c = self.peek()
+        if expected is not None and c not in expected:
+            raise ValueError(f"Expected one of {expected!r} in repodata, got {c!r}.")
+        self._pos += 1
+        return c
+
+    def decode_value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError:
+                # The value may continue in the next chunk.
+                if self._fill():
+                    continue
+                raise
+            # A number at the very end of the buffer may be cut off, e.g. '12' of '123'.
+            if end == len(self._buffer) and not self._eof and self._fill():
+                continue
+            self._pos = end
+            return value
+
+
+def iter_repodata_records(stream, package_names=None, chunk_size: int = _DEFAULT_CHUNK_SIZE):
+    """Yields the (file name, record) pairs of the packages in the given repodata.json text stream.
+
+    The repodata is parsed incrementally, so that only the records of the given package names (or all records, if no
+    names are given) are ever held in memory, rather than the whole document.
+    """
+    reader = _StreamingJsonReader(stream, chunk_size)
+    reader.consume("{")
+    if reader.peek() == "}":
+        return
+    while True:
+        key = reader.decode_value()
+        reader.consume(":")
+        if key in _PACKAGES_KEYS:
+            reader.consume("{")
+            if reader.peek() == "}":
+                reader.consume()
+            else:
+                while True:
+                    file_name = reader.decode_value()
+                    reader.consume(":")
+                    record = reader.decode_value()
+                    if package_names is None or record["name"] in package_names:
+                        yield file_name, record
+                    if reader.consume(",}") == "}":
+                        break
+        else:
+            # e.g. 'info' or 'removed'
+            reader.decode_value()
+        if reader.consume(",}") == "}":
+            return
@@ -0,0 +1,37 @@
+import importlib.util
+
+# Sharded repodata (CEP 16) splits the repodata of a channel subdir into one shard per package, e.g.
+#   linux-64/repodata_shards.msgpack.zst: {"info": {"shards_base_url": "./shards/", ...}, "shards": {name: sha256}}
+#   linux-64/shards/<sha256>.msgpack.zst: {"packages": {fn: record}, "packages.conda": {fn: record}}
+# Both are zstd-compressed msgpack, and every shard is named by the sha256 of its compressed content.
+SHARDS_INDEX_FILE_NAME = "repodata_shards.msgpack.zst"
+_DEFAULT_SHARDS_BASE_URL = "./shards/"
+
+
+def is_sharded_repodata_supported() -> bool:
+    return importlib.util.find_spec("msgpack") is not None and importlib.util.find_spec("zstandard") is not None
+
+
+def _unpack(data: bytes):
+    import msgpack
+    import zstandard
+
+    # Shards don't necessarily have the decompressed size in their frame header, which ZstdDecompressor.decompress
+    # requires.
+    return msgpack.unpackb(zstandard.ZstdDecompressor().decompressobj().decompress(data))
+
+
+def parse_shards_index(data: bytes) -> (str, dict[str, str]):
+    """Returns the (possibly relative) base url of the shards, and the sha256 of the shard of every package."""
+    shards_index = _unpack(data)
+    shards_base_url = shards_index.get("info", {}).get("shards_base_url") or _DEFAULT_SHARDS_BASE_URL
+    return shards_base_url, {name: sha256.hex() for name, sha256 in shards_index["shards"].items()}
+
+
+def iter_shard_records(data: bytes):
+    """Yields the (file name, record) pairs of the packages in the given shard, in the format of repodata.json."""
+    shard = _unpack(data)
+    for key in ("packages", "packages.conda"):
+        for file_name, record in shard.get(key, {}).items():
+            # Hashes are stored as bytes rather than hex strings.
+            yield file_name, {k: v.hex() if isinstance(v, bytes) else v for k, v in record.items()}
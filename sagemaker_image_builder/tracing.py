@@ -0,0 +1,123 @@
+import functools
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+# Spans are recorded process-wide, so that phases which run on worker threads (e.g. concurrent image builds) end up
+# in the same trace.
+_spans = []
+_spans_lock = threading.Lock()
+_thread_local = threading.local()
+_trace_start_ns = time.perf_counter_ns()
+_DEFAULT_TRACK = "main"
+
+
+@contextmanager
+def span(name: str, track: str = None, **args):
+    """Records the duration of the enclosed block as a span with the given name.
+
+    Spans are grouped into tracks, e.g. one track per image config. Nested spans inherit the track of the enclosing
+    span on the same thread, unless a track is given explicitly.
+    """
+    parent_track = getattr(_thread_local, "track", None)
+    track = track or parent_track or _DEFAULT_TRACK
+    _thread_local.track = track
+    start_ns = time.perf_counter_ns()
+    try:
+        yield
+    finally:
+        end_ns = time.perf_counter_ns()
+        _thread_local.track = parent_track
+        with _spans_lock:
+            _spans.append({"name": name, "track": track, "start_ns": start_ns, "end_ns": end_ns, "args": args})
+
+
+def traced(name: str):
+    """Decorator which records every call of the decorated function as a span with the given name."""
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def reset_trace():
+    global _trace_start_ns
+    with _spans_lock:
+        _spans.clear()
+        _trace_start_ns = time.perf_counter_ns()
+
+
+def get_spans() -> list[dict]:
+    with _spans_lock:
+        return list(_spans)
+
+
+def write_chrome_trace(file_path: str):
+    """Writes all recorded spans in the Chrome trace event format, which can be opened in chrome://tracing or
+    https://ui.perfetto.dev. Every track is shown as a separate thread.
+    """
+    spans = get_spans()
+    track_ids = {}
+    for s in sorted(spans, key=lambda s: s["start_ns"]):
+        track_ids.setdefault(s["track"], len(track_ids) + 1)
+    trace_events = [
+        {"name": "thread_name", "ph": "M", "pid": 1, "tid": track_id, "args": {"name": track}}
+        for track, track_id in track_ids.items()
+    ]
+    for s in spans:
+        trace_events.append(
+            {
+                "name": s["name"],
+                "cat": "sagemaker-image-builder",
+                "ph": "X",
+                # Timestamps and durations are in microseconds.
+                "ts": (s["start_ns"] - _trace_start_ns) / 1000,
+                "dur": (s["end_ns"] - s["start_ns"]) / 1000,
+                "pid": 1,
+                "tid": track_ids[s["track"]],
+                "args": {k: str(v) for k, v in s["args"].items()},
+            }
+        )
+    with open(file_path, "w") as f:
+        json.dump({"traceEvents": trace_events, "displayTimeUnit": "ms"}, f)
+    print(f"Wrote the trace of {len(spans)} spans to {file_path}")
+
+
+def print_trace_summary(top_k: int = 10):
+    # utils is imported here rather than at the top, since utils itself records spans.
+    from sagemaker_image_builder.utils import create_markdown_table
+
+    # Aggregate spans by name and track, e.g. 'docker build' of the gpu image.
+    phases = {}
+    for s in get_spans():
+        phase = phases.setdefault((s["name"], s["track"]), {"count": 0, "total_ns": 0, "max_ns": 0})
+        duration_ns = s["end_ns"] - s["start_ns"]
+        phase["count"] += 1
+        phase["total_ns"] += duration_ns
+        phase["max_ns"] = max(phase["max_ns"], duration_ns)
+    if not phases:
+        return
+    slowest_phases = sorted(phases.items(), key=lambda item: item[1]["total_ns"], reverse=True)[:top_k]
+    print(f"\n## Top-{top_k} Slowest Phases\n")
+    print(
+        create_markdown_table(
+            ["Phase", "Track", "Count", "Total (s)", "Max (s)"],
+            [
+                {
+                    "phase": name,
+                    "track": track,
+                    "count": v["count"],
+                    "total": f"{v['total_ns'] / 1e9:.2f}",
+                    "max": f"{v['max_ns'] / 1e9:.2f}",
+                }
+                for (name, track), v in slowest_phases
+            ],
+        )
+    )
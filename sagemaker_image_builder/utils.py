@@ -1,24 +1,50 @@
+import bisect
 import json
 import os
-import pathlib
+import stat
+import subprocess
+import sys
+import threading
+import time
+from collections import OrderedDict
+from types import MappingProxyType
+from typing import TYPE_CHECKING, Mapping
 
-import conda.cli.python_api
-from conda.env.specs.requirements import RequirementsSpec
-from conda.models.match_spec import MatchSpec
 from semver import Version
 
+from sagemaker_image_builder.conda_meta import (
+    get_package_metadata,
+    read_conda_meta_records_from_prefix,
+)
+from sagemaker_image_builder.env_parser import EnvRecord, parse_env_file
+from sagemaker_image_builder.package_index import (
+    RepodataNotFoundError,
+    get_channel_host,
+)
+from sagemaker_image_builder.query_executor import QueryExecutor
+from sagemaker_image_builder.tracing import span
 
-def get_dir_for_version(version: Version) -> str:
+# conda takes a while to import, so it's only imported by the functions which use it.
+if TYPE_CHECKING:
+    from conda.env.specs.requirements import RequirementsSpec
+    from conda.models.match_spec import MatchSpec
+
+
+def _get_relative_dir_for_version(version: Version) -> str:
     version_prerelease_suffix = (
         f"/v{version.major}.{version.minor}.{version.patch}-" f"{version.prerelease}" if version.prerelease else ""
     )
-    return os.path.relpath(
-        f"build_artifacts/v{version.major}/v{version.major}.{version.minor}/"
+    return (
+        f"v{version.major}/v{version.major}.{version.minor}/"
         f"v{version.major}.{version.minor}.{version.patch}"
         f"{version_prerelease_suffix}"
     )
 
 
+def get_dir_for_version(version: Version) -> str:
+    return os.path.relpath(f"build_artifacts/{_get_relative_dir_for_version(version)}")
+
+
 def is_exists_dir_for_version(version: Version, file_name_to_verify_existence="Dockerfile") -> bool:
     dir_path = get_dir_for_version(version)
     # Also validate whether this directory is not generated due to any pre-release builds/
@@ -28,6 +54,108 @@ def is_exists_dir_for_version(version: Version, file_name_to_verify_existence="D
     return os.path.exists(dir_path) and os.path.exists(dir_path + "/" + file_name_to_verify_existence)
 
 
+def _get_subdirs(dir_path: str) -> list[os.DirEntry]:
+    try:
+        with os.scandir(dir_path) as entries:
+            return [e for e in entries if e.is_dir()]
+    except FileNotFoundError:
+        return []
+
+
+def _parse_version_dir_name(dir_name: str):
+    # e.g. 'v1.124.5' or 'v1.124.5-beta'. Major and minor version directories (e.g. 'v1', 'v1.124') are not versions.
+    try:
+        return Version.parse(dir_name.removeprefix("v"))
+    except ValueError:
+        return None
+
+
+class VersionIndex:
+    """Index of the versions in the build_artifacts tree, and of the files in the directory of each version.
+
+    The tree is scanned once when the index is created, so that lookups don't probe the file system. The files of
+    each version are kept as a bitset, and questions like "is there a newer minor version with an env.out file" are
+    answered with a binary search over the sorted versions which have that file.
+    """
+
+    def __init__(self, build_artifacts_dir: str = "build_artifacts"):
+        self.build_artifacts_dir = build_artifacts_dir
+        # File name => bit in the file masks.
+        self._file_bits = {}
+        # (major, minor, patch, prerelease) => bitset of the files in the directory of that version.
+        self._file_masks = {}
+        # (prerelease, file name) => sorted (major, minor, patch) of the versions which have that file.
+        self._sorted_version_keys = {}
+        for major_dir in _get_subdirs(build_artifacts_dir):
+            for minor_dir in _get_subdirs(major_dir.path):
+                for patch_dir in _get_subdirs(minor_dir.path):
+                    version = _parse_version_dir_name(patch_dir.name)
+                    if version is None or version.prerelease:
+                        continue
+                    self._add_version(version, patch_dir.path)
+                    # Pre-release versions live in a subdirectory of the patch version, e.g. v1.124.5/v1.124.5-beta
+                    for prerelease_dir in _get_subdirs(patch_dir.path):
+                        prerelease_version = _parse_version_dir_name(prerelease_dir.name)
+                        if prerelease_version and prerelease_version.finalize_version() == version:
+                            self._add_version(prerelease_version, prerelease_dir.path)
+
+    def _add_version(self, version: Version, dir_path: str):
+        file_mask = 0
+        with os.scandir(dir_path) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    file_mask |= self._file_bits.setdefault(entry.name, 1 << len(self._file_bits))
+        self._file_masks[(version.major, version.minor, version.patch, version.prerelease)] = file_mask
+
+    def _get_sorted_version_keys(self, prerelease: str, file_name: str) -> list[tuple[int, int, int]]:
+        key = (prerelease, file_name)
+        if key not in self._sorted_version_keys:
+            file_bit = self._file_bits.get(file_name, 0)
+            self._sorted_version_keys[key] = sorted(
+                k[:3] for k, file_mask in self._file_masks.items() if k[3] == prerelease and file_mask & file_bit
+            )
+        return self._sorted_version_keys[key]
+
+    def get_dir(self, version: Version) -> str:
+        return os.path.join(self.build_artifacts_dir, _get_relative_dir_for_version(version))
+
+    def has_file(self, version: Version, file_name: str = "Dockerfile") -> bool:
+        file_mask = self._file_masks.get((version.major, version.minor, version.patch, version.prerelease), 0)
+        return bool(file_mask & self._file_bits.get(file_name, 0))
+
+    def get_versions(self, file_name: str = "Dockerfile", prerelease: str = None) -> list[Version]:
+        # Returns the versions (with the given pre-release identifier) which have the given file, in ascending order.
+        return [Version(*k, prerelease=prerelease) for k in self._get_sorted_version_keys(prerelease, file_name)]
+
+    def get_latest_patch_version(self, version: Version, file_name: str = "Dockerfile"):
+        # Returns the latest patch version within the minor version of the given version which has the given file.
+        version_keys = self._get_sorted_version_keys(version.prerelease, file_name)
+        i = bisect.bisect_left(version_keys, (version.major, version.minor + 1, 0))
+        if i == 0 or version_keys[i - 1][:2] != (version.major, version.minor):
+            return None
+        return Version(*version_keys[i - 1], prerelease=version.prerelease)
+
+    def has_newer_patch_version(self, version: Version, file_name: str = "Dockerfile") -> bool:
+        latest_patch_version = self.get_latest_patch_version(version, file_name)
+        return latest_patch_version is not None and latest_patch_version.patch > version.patch
+
+    def has_newer_minor_version(self, version: Version, file_name: str = "Dockerfile") -> bool:
+        version_keys = self._get_sorted_version_keys(version.prerelease, file_name)
+        i = bisect.bisect_left(version_keys, (version.major, version.minor + 1, 0))
+        return i < len(version_keys) and version_keys[i][0] == version.major
+
+    def has_newer_major_version(self, version: Version, file_name: str = "Dockerfile") -> bool:
+        version_keys = self._get_sorted_version_keys(version.prerelease, file_name)
+        return bisect.bisect_left(version_keys, (version.major + 1, 0, 0)) < len(version_keys)
+
+    def get_source_version(self, version: Version):
+        # Returns the version which the given version was created from, as recorded in its source-version.txt.
+        if not self.has_file(version, "source-version.txt"):
+            return None
+        with open(f"{self.get_dir(version)}/source-version.txt", "r") as f:
+            return get_semver(f.readline())
+
+
 def get_semver(version_str) -> Version:
     # Version strings on conda-forge follow PEP standards rather than SemVer, which support
     # version strings such as X.Y.Z.postN, X.Y.Z.preN. These cause errors in semver.Version.parse
@@ -43,19 +171,70 @@ def get_semver(version_str) -> Version:
     return version
 
 
-def read_env_file(file_path) -> RequirementsSpec:
+# Parsed env files are cached process-wide, keyed by (parser, path, size, mtime), and evicted in LRU order.
+_ENV_FILE_CACHE_MAX_ENTRIES = 64
+# Files modified this recently aren't cached: the mtime granularity of most file systems is coarse enough that a file
+# could be rewritten with the same size and mtime right after it was parsed.
+_ENV_FILE_CACHE_MIN_AGE_NS = 2_000_000_000
+_env_file_cache = OrderedDict()
+_env_file_cache_lock = threading.Lock()
+
+
+def read_env_file(file_path) -> "RequirementsSpec":
+    from conda.env.specs.requirements import RequirementsSpec
+
     return RequirementsSpec(filename=file_path)
 
 
-def get_match_specs(file_path) -> dict[str, MatchSpec]:
-    if not os.path.isfile(file_path):
-        return {}
+def _parse_match_specs(file_path) -> dict[str, "MatchSpec"]:
+    from conda.models.match_spec import MatchSpec
 
     requirement_spec = read_env_file(file_path)
     assert len(requirement_spec.environment.dependencies) == 1
     assert "conda" in requirement_spec.environment.dependencies
 
-    return {MatchSpec(i).get("name"): MatchSpec(i) for i in requirement_spec.environment.dependencies["conda"]}
+    match_specs = [MatchSpec(i) for i in requirement_spec.environment.dependencies["conda"]]
+    return {match_spec.get("name"): match_spec for match_spec in match_specs}
+
+
+def _get_parsed_env_file(file_path, parse_func) -> Mapping:
+    try:
+        file_stat = os.stat(file_path)
+    except FileNotFoundError:
+        return MappingProxyType({})
+    if not stat.S_ISREG(file_stat.st_mode):
+        return MappingProxyType({})
+
+    cache_key = (parse_func, os.path.abspath(file_path), file_stat.st_size, file_stat.st_mtime_ns)
+    with _env_file_cache_lock:
+        if cache_key in _env_file_cache:
+            _env_file_cache.move_to_end(cache_key)
+            return _env_file_cache[cache_key]
+
+    parsed_env_file = MappingProxyType(parse_func(file_path))
+    if time.time_ns() - file_stat.st_mtime_ns >= _ENV_FILE_CACHE_MIN_AGE_NS:
+        with _env_file_cache_lock:
+            _env_file_cache[cache_key] = parsed_env_file
+            while len(_env_file_cache) > _ENV_FILE_CACHE_MAX_ENTRIES:
+                _env_file_cache.popitem(last=False)
+    return parsed_env_file
+
+
+def get_match_specs(file_path) -> Mapping[str, "MatchSpec"]:
+    """Returns the conda match specs in the given env.in/env.out file by package name, or an empty mapping if the file
+    doesn't exist.
+
+    The returned mapping is read-only, since it's shared by all callers which parse the same file. Make a copy (e.g.
+    `dict(get_match_specs(...))`) to modify it.
+    """
+    return _get_parsed_env_file(file_path, _parse_match_specs)
+
+
+def get_env_records(file_path) -> Mapping[str, EnvRecord]:
+    """Same as get_match_specs, but parses the file with the env_parser rather than conda, which is much faster for
+    the formats we write (`conda list --explicit` urls and 'channel::name[version=...]' specs).
+    """
+    return _get_parsed_env_file(file_path, parse_env_file)
 
 
 def sizeof_fmt(num):
@@ -67,6 +246,15 @@ def sizeof_fmt(num):
     return f"{num:.2f}TB"
 
 
+def parse_size(size_str: str) -> int:
+    # Converts a size like '500MB', '1.5GB' or '1024' (bytes) to bytes, with the same units as sizeof_fmt.
+    size_str = size_str.strip().upper()
+    for exponent, unit in reversed(list(enumerate(("B", "KB", "MB", "GB", "TB")))):
+        if size_str.endswith(unit):
+            return int(float(size_str[: -len(unit)]) * 1024**exponent)
+    return int(size_str)
+
+
 def create_markdown_table(headers, rows):
     """Loop through a data rows and return a markdown table as a multi-line string.
 
@@ -91,41 +279,105 @@ def create_markdown_table(headers, rows):
 
 
 def dump_conda_package_metadata(args):
-    prefix = os.environ["CONDA_PREFIX"]
-    meta_data_path = pathlib.Path(prefix) / "conda-meta"
-    meta_data_files = meta_data_path.glob("*.json")
-
-    meta_data = dict()
-    for meta_data_file in meta_data_files:
-        name = meta_data_file.name.split("-")[0]
-        with open(meta_data_file, "r", encoding="utf-8") as f:
-            metadata = json.load(f)
-            version = metadata["version"]
-            size = metadata["size"]
-        meta_data[name] = {"version": version, "size": size}
-
-    # Sort the pakcage sizes in decreasing order
-    meta_data = {k: v for k, v in sorted(meta_data.items(), key=lambda item: item[1]["size"], reverse=True)}
+    records = read_conda_meta_records_from_prefix(os.environ["CONDA_PREFIX"])
+    # Sorted by package size in decreasing order
+    meta_data = get_package_metadata(records)
 
     if args.human_readable:
-        meta_data = {k: {"version": v["version"], "size": sizeof_fmt(v["size"])} for k, v in meta_data.items()}
+        meta_data = {
+            k: {
+                "version": v["version"],
+                "size": sizeof_fmt(v["size"]),
+                "installed_size": sizeof_fmt(v["installed_size"]),
+            }
+            for k, v in meta_data.items()
+        }
 
     print(json.dumps(meta_data))
 
 
-def pull_conda_package_metadata(image_config, image_artifact_dir):
-    results = dict()
-    env_out_file_name = image_config["env_out_filename"]
-    match_spec_out = get_match_specs(image_artifact_dir + "/" + env_out_file_name)
+def run_conda_search(match_spec_str: str) -> dict[str, list[dict]]:
+    # `conda search` runs in a subprocess rather than through conda.cli.python_api, which swaps the process-wide stdout
+    # and conda context, and so can't be used by concurrent queries.
+    with span("conda search"):
+        result = subprocess.run(
+            [sys.executable, "-m", "conda", "search", match_spec_str, "--json"], capture_output=True, text=True
+        )
+    if result.returncode != 0:
+        raise Exception(f"conda search {match_spec_str} failed: {result.stdout or result.stderr}")
+    return json.loads(result.stdout)
+
+
+def _submit_conda_search_metadata_query(env_record_out, query_executor):
+    match_spec_str = env_record_out.to_match_spec_str()
+    return query_executor.submit(
+        ("conda search", match_spec_str),
+        lambda: run_conda_search(match_spec_str)[env_record_out.name][0],
+        host=get_channel_host(env_record_out.channel),
+    )
+
+
+def _get_package_metadata_from_index(env_record_out, package_index) -> dict:
+    channel, subdir, name = env_record_out.channel, env_record_out.subdir, env_record_out.name
+    # Explicit urls pin the exact file, which is a single lookup in the repodata of the channel.
+    if env_record_out.fn is not None:
+        record = package_index.get_record_by_file_name(channel, subdir, name, env_record_out.fn)
+        if record is not None:
+            return record
+    else:
+        for record in package_index.get_records(channel, subdir, name):
+            if record["version"] == env_record_out.version and record["build"] == env_record_out.build:
+                return record
+    raise Exception(f"{env_record_out.to_match_spec_str()} isn't in the repodata of {channel}.")
+
 
-    target_packages_match_spec_out = {k: v for k, v in match_spec_out.items()}
+def get_package_metadata_file_path(image_config, image_artifact_dir) -> str:
+    # e.g. cpu.pkg_metadata.json, which is written by `build` next to cpu.env.out.
+    return f'{image_artifact_dir}/{image_config["image_type"]}.pkg_metadata.json'
 
-    for package, match_spec_out in target_packages_match_spec_out.items():
-        if str(match_spec_out).startswith("conda-forge"):
+
+def load_conda_package_metadata(
+    image_config, image_artifact_dir, package_index=None, query_executor=None, use_package_metadata_file=True
+):
+    # The package metadata captured from the image at build time is exact, and needs no network. Versions which were
+    # built before it was captured fall back to looking the packages up in their channels.
+    package_metadata_file_path = get_package_metadata_file_path(image_config, image_artifact_dir)
+    if use_package_metadata_file and os.path.exists(package_metadata_file_path):
+        with open(package_metadata_file_path) as f:
+            return json.load(f)
+    return pull_conda_package_metadata(image_config, image_artifact_dir, package_index, query_executor)
+
+
+def pull_conda_package_metadata(image_config, image_artifact_dir, package_index=None, query_executor=None):
+    # Package metadata is looked up in the package index if there is one, and with one `conda search` per package
+    # otherwise, or if the channel has no repodata. Either way, the queries run concurrently on the query executor.
+    if query_executor is None:
+        with QueryExecutor() as query_executor:
+            return pull_conda_package_metadata(image_config, image_artifact_dir, package_index, query_executor)
+    env_out_file_name = image_config["env_out_filename"]
+    env_records_out = get_env_records(image_artifact_dir + "/" + env_out_file_name)
+
+    futures = {}
+    for package, env_record_out in env_records_out.items():
+        if env_record_out.channel == "conda-forge":
             # Pull package metadata from conda-forge and dump into json file
-            search_result = conda.cli.python_api.run_command("search", str(match_spec_out), "--json")
-            package_metadata = json.loads(search_result[0])[package][0]
-            results[package] = {"version": package_metadata["version"], "size": package_metadata["size"]}
+            match_spec_str = env_record_out.to_match_spec_str()
+            if package_index is not None:
+                futures[package] = query_executor.submit(
+                    ("package index record", match_spec_str, env_record_out.fn),
+                    _get_package_metadata_from_index,
+                    env_record_out,
+                    package_index,
+                )
+            else:
+                futures[package] = _submit_conda_search_metadata_query(env_record_out, query_executor)
+    for package, future in futures.items():
+        if package_index is not None and isinstance(future.exception(), RepodataNotFoundError):
+            futures[package] = _submit_conda_search_metadata_query(env_records_out[package], query_executor)
+    results = dict()
+    for package, future in futures.items():
+        package_metadata = future.result()
+        results[package] = {"version": package_metadata["version"], "size": package_metadata["size"]}
     # Sort the package sizes in decreasing order
     results = {k: v for k, v in sorted(results.items(), key=lambda item: item[1]["size"], reverse=True)}
 
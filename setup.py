@@ -12,12 +12,17 @@ TESTS_REQUIRE = [
     "pytest",
     "pytest-mock",
     "pytest-xdist",
+    "moto",
     "autoflake",
     "pre-commit",
 ]
 
 EXTRAS_REQUIRE = {
     "tests": TESTS_REQUIRE,
+    # Reads the zstd-compressed repodata of conda channels, which is a fraction of the size.
+    "zstd": ["zstandard"],
+    # Reads sharded repodata, which only requires fetching the packages that are looked up.
+    "shards": ["msgpack", "zstandard"],
 }
 
 setup(
@@ -1,6 +1,292 @@
+import gzip
+import hashlib
+import io
+import json
+import re
+import tarfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
 import pytest
 
 
 @pytest.fixture
 def local_image_version(request) -> str:
     return request.config.getoption("--local-image-version")
+
+
+class _LocalRegistryHandler(BaseHTTPRequestHandler):
+    # A minimal stand-in for the registry:2 HTTP API, which only supports manifests.
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body=b"", headers=None):
+        self.send_response(status)
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _is_authorized(self):
+        registry = self.server.registry
+        if not registry.require_token or self.headers.get("Authorization") == "Bearer test-token":
+            return True
+        self._send(
+            401,
+            headers={
+                "WWW-Authenticate": f'Bearer realm="http://{registry.host}/token",service="local-registry",'
+                'scope="repository:my-repository:pull,push"'
+            },
+        )
+        return False
+
+    def _handle_manifest_request(self):
+        registry = self.server.registry
+        registry.requests.append((self.command, self.path))
+        if self.path.startswith("/token"):
+            assert self.headers.get("Authorization", "").startswith("Basic ")
+            return self._send(200, json.dumps({"token": "test-token"}).encode())
+        if not self._is_authorized():
+            return
+        match = re.fullmatch(r"/v2/(.+)/manifests/([^/]+)", self.path)
+        if match is None:
+            return self._send(404)
+        name, reference = match.groups()
+        manifests = registry.manifests.setdefault(name, {})
+        if self.command == "PUT":
+            body = self.rfile.read(int(self.headers["Content-Length"]))
+            registry.put_manifest(name, reference, body, self.headers["Content-Type"])
+            digest = "sha256:" + hashlib.sha256(body).hexdigest()
+            return self._send(201, headers={"Docker-Content-Digest": digest})
+        if reference not in manifests:
+            return self._send(404)
+        body, media_type = manifests[reference]
+        digest = "sha256:" + hashlib.sha256(body).hexdigest()
+        self._send(200, body, {"Content-Type": media_type, "Docker-Content-Digest": digest})
+
+    do_GET = _handle_manifest_request
+    do_HEAD = _handle_manifest_request
+    do_PUT = _handle_manifest_request
+
+
+class LocalRegistry:
+    def __init__(self, require_token=False):
+        self.require_token = require_token
+        self.manifests = {}
+        self.requests = []
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _LocalRegistryHandler)
+        self._server.registry = self
+        self.host = f"127.0.0.1:{self._server.server_port}"
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def put_manifest(self, name, tag, body, media_type="application/vnd.docker.distribution.manifest.v2+json"):
+        digest = "sha256:" + hashlib.sha256(body).hexdigest()
+        self.manifests.setdefault(name, {})[tag] = (body, media_type)
+        self.manifests[name][digest] = (body, media_type)
+
+    def shutdown(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+@pytest.fixture
+def local_registry():
+    registry = LocalRegistry()
+    yield registry
+    registry.shutdown()
+
+
+class SavedImage:
+    # An image in the legacy `docker save` format: <layer id>/layer.tar for every layer, the image config and
+    # manifest.json. Identical layers are symlinked to the first one, like docker does. Image stores which keep the
+    # layers compressed (e.g. containerd) save them gzip or zstd compressed.
+    def __init__(self, conda_prefix="/opt/conda", compression=None):
+        self.conda_prefix = conda_prefix
+        self.compression = compression
+        self.layers = []
+
+    def add_layer(self, files, created_by="RUN true", whiteouts=()):
+        # files: {path: bytes}, with paths relative to the root of the image file system.
+        layer = io.BytesIO()
+        with tarfile.open(fileobj=layer, mode="w") as tar_file:
+            for path, data in sorted(files.items()):
+                member = tarfile.TarInfo(path)
+                member.size = len(data)
+                tar_file.addfile(member, io.BytesIO(data))
+            for path in whiteouts:
+                dir_name, _, base_name = path.rpartition("/")
+                tar_file.addfile(tarfile.TarInfo(f"{dir_name}/.wh.{base_name}"), io.BytesIO(b""))
+        self.layers.append((created_by, layer.getvalue()))
+
+    def add_conda_packages(self, packages, created_by="RUN micromamba install", extra_files=None):
+        # packages: {name: (version, {path relative to the conda prefix: bytes})}
+        prefix = self.conda_prefix.strip("/")
+        files = {f"{prefix}/{path}": data for path, data in (extra_files or {}).items()}
+        for name, (version, package_files) in packages.items():
+            for path, data in package_files.items():
+                files[f"{prefix}/{path}"] = data
+            record = {"build": "0", "files": sorted(package_files), "name": name, "size": 1024, "version": version}
+            files[f"{prefix}/conda-meta/{name}-{version}-0.json"] = json.dumps(record, sort_keys=True).encode()
+        self.add_layer(files, created_by)
+
+    def get_layer_digests(self):
+        return ["sha256:" + hashlib.sha256(layer).hexdigest() for _, layer in self.layers]
+
+    def get_layer_blob(self, layer) -> bytes:
+        if self.compression == "gzip":
+            return gzip.compress(layer, mtime=0)
+        if self.compression == "zstd":
+            import zstandard
+
+            return zstandard.ZstdCompressor().compress(layer)
+        return layer
+
+    def save(self) -> bytes:
+        diff_ids = self.get_layer_digests()
+        config = {
+            "architecture": "amd64",
+            "os": "linux",
+            "rootfs": {"type": "layers", "diff_ids": diff_ids},
+            "history": [{"created_by": "ENV PATH=/opt/conda/bin:$PATH", "empty_layer": True}]
+            + [{"created_by": created_by} for created_by, _ in self.layers],
+        }
+        config_data = json.dumps(config).encode()
+        config_file_name = hashlib.sha256(config_data).hexdigest() + ".json"
+        saved_image = io.BytesIO()
+        with tarfile.open(fileobj=saved_image, mode="w") as tar_file:
+            layer_paths = []
+            layer_paths_by_digest = {}
+            for diff_id, (_, layer) in zip(diff_ids, self.layers):
+                layer_path = f"{hashlib.sha256((diff_id + str(len(layer_paths))).encode()).hexdigest()}/layer.tar"
+                if diff_id in layer_paths_by_digest:
+                    member = tarfile.TarInfo(layer_path)
+                    member.type = tarfile.SYMTYPE
+                    member.linkname = "../" + layer_paths_by_digest[diff_id]
+                    tar_file.addfile(member)
+                else:
+                    blob = self.get_layer_blob(layer)
+                    member = tarfile.TarInfo(layer_path)
+                    member.size = len(blob)
+                    tar_file.addfile(member, io.BytesIO(blob))
+                    layer_paths_by_digest[diff_id] = layer_path
+                layer_paths.append(layer_path)
+            manifest = [{"Config": config_file_name, "RepoTags": None, "Layers": layer_paths}]
+            for name, data in [(config_file_name, config_data), ("manifest.json", json.dumps(manifest).encode())]:
+                member = tarfile.TarInfo(name)
+                member.size = len(data)
+                tar_file.addfile(member, io.BytesIO(data))
+        return saved_image.getvalue()
+
+
+@pytest.fixture
+def saved_image_factory():
+    return SavedImage
+
+
+class LocalChannel:
+    # A conda channel on the local file system, e.g. file:///tmp/channels/conda-forge/linux-64/repodata.json
+    # Sharded channels also have the sharded repodata, e.g. conda-forge/linux-64/repodata_shards.msgpack.zst
+    def __init__(self, channels_dir, sharded=False):
+        self.channels_dir = channels_dir
+        self.alias = channels_dir.as_uri()
+        self.repodata = {}
+        self.sharded = sharded
+
+    def add_package(
+        self, name, version, build_number=0, channel="conda-forge", subdir="linux-64", size=1024, build=None
+    ):
+        build = build or f"h{build_number:07x}_{build_number}"
+        repodata = self.repodata.setdefault((channel, subdir), {"info": {"subdir": subdir}, "packages.conda": {}})
+        file_name = f"{name}-{version}-{build}.conda"
+        repodata["packages.conda"][file_name] = {
+            "name": name,
+            "version": version,
+            "build": build,
+            "build_number": build_number,
+            "subdir": subdir,
+            "size": size,
+            "sha256": hashlib.sha256(file_name.encode()).hexdigest(),
+        }
+        self.write()
+
+    def _write_shards(self, subdir_dir, repodata):
+        import msgpack
+        import zstandard
+
+        shards = {}
+        for file_name, record in repodata["packages.conda"].items():
+            shard = shards.setdefault(record["name"], {"packages": {}, "packages.conda": {}})
+            shard["packages.conda"][file_name] = dict(record, sha256=bytes.fromhex(record["sha256"]))
+        shard_hashes = {}
+        (subdir_dir / "shards").mkdir(exist_ok=True)
+        for name, shard in shards.items():
+            data = zstandard.ZstdCompressor().compress(msgpack.packb(shard))
+            shard_hashes[name] = hashlib.sha256(data).digest()
+            (subdir_dir / "shards" / f"{shard_hashes[name].hex()}.msgpack.zst").write_bytes(data)
+        shards_index = {"info": {"subdir": repodata["info"]["subdir"], "shards_base_url": "./shards/"}}
+        shards_index["shards"] = shard_hashes
+        (subdir_dir / "repodata_shards.msgpack.zst").write_bytes(
+            zstandard.ZstdCompressor().compress(msgpack.packb(shards_index))
+        )
+
+    def write(self):
+        for (channel, subdir), repodata in self.repodata.items():
+            subdir_dir = self.channels_dir / channel / subdir
+            subdir_dir.mkdir(parents=True, exist_ok=True)
+            (subdir_dir / "repodata.json").write_text(json.dumps(repodata))
+            if self.sharded:
+                self._write_shards(subdir_dir, repodata)
+
+
+@pytest.fixture
+def local_channel(tmp_path):
+    return LocalChannel(tmp_path / "channels")
+
+
+class _LocalChannelHandler(BaseHTTPRequestHandler):
+    # Serves the files of a LocalChannel, with ETags and conditional requests.
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        channel = self.server.channel
+        file_path = channel.channels_dir / self.path.lstrip("/")
+        if not file_path.is_file():
+            channel.requests.append((self.path, 404))
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = file_path.read_bytes()
+        etag = '"' + hashlib.sha256(body).hexdigest() + '"'
+        status = 304 if self.headers.get("If-None-Match") == etag else 200
+        channel.requests.append((self.path, status))
+        self.send_response(status)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body) if status == 200 else 0))
+        self.end_headers()
+        if status == 200:
+            self.wfile.write(body)
+
+
+class LocalHttpChannel(LocalChannel):
+    def __init__(self, channels_dir):
+        super().__init__(channels_dir)
+        self.requests = []
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _LocalChannelHandler)
+        self._server.channel = self
+        self.alias = f"http://127.0.0.1:{self._server.server_port}"
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def shutdown(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+@pytest.fixture
+def local_http_channel(tmp_path):
+    channel = LocalHttpChannel(tmp_path / "channels")
+    yield channel
+    channel.shutdown()
@@ -0,0 +1,74 @@
+from __future__ import absolute_import
+
+import json
+import os
+
+import pytest
+
+pytestmark = pytest.mark.unit
+
+from sagemaker_image_builder.build_cache import (
+    get_build_key,
+    get_cached_image_id,
+    record_image_id,
+)
+
+with open("test/test_image_config.json") as jsonfile:
+    _image_generator_configs = json.load(jsonfile)
+
+
+def _write_file(file_path, contents):
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    with open(file_path, "w") as f:
+        f.write(contents)
+
+
+def _create_build_inputs(target_version_dir):
+    _write_file(f"{target_version_dir}/Dockerfile", "FROM mambaorg/micromamba:jammy\n")
+    _write_file(f"{target_version_dir}/dirs/etc/config.json", "{}\n")
+    _write_file(f"{target_version_dir}/gpu.env.in", "conda-forge::numpy\n")
+    _write_file(f"{target_version_dir}/gpu.arg_based_env.in", "conda-forge::pytorch\n")
+
+
+def test_get_build_key_is_stable(tmp_path):
+    target_version_dir = str(tmp_path / "v1.0.0")
+    _create_build_inputs(target_version_dir)
+    build_key = get_build_key(target_version_dir, _image_generator_configs[0])
+    assert build_key == get_build_key(target_version_dir, _image_generator_configs[0])
+    # Files which aren't build inputs don't change the build key.
+    _write_file(f"{target_version_dir}/CHANGELOG-gpu.md", "# Change log")
+    _write_file(f"{target_version_dir}/gpu.env.out", "@EXPLICIT\n")
+    assert build_key == get_build_key(target_version_dir, _image_generator_configs[0])
+
+
+@pytest.mark.parametrize(
+    "file_name",
+    ["Dockerfile", "dirs/etc/config.json", "dirs/etc/new-file", "gpu.env.in", "gpu.arg_based_env.in", "patch_1.sh"],
+)
+def test_get_build_key_changes_with_build_inputs(tmp_path, file_name):
+    target_version_dir = str(tmp_path / "v1.0.0")
+    _create_build_inputs(target_version_dir)
+    build_key = get_build_key(target_version_dir, _image_generator_configs[0])
+    _write_file(f"{target_version_dir}/{file_name}", "changed\n")
+    assert build_key != get_build_key(target_version_dir, _image_generator_configs[0])
+
+
+def test_get_build_key_changes_with_build_args(tmp_path):
+    target_version_dir = str(tmp_path / "v1.0.0")
+    _create_build_inputs(target_version_dir)
+    build_key = get_build_key(target_version_dir, _image_generator_configs[0])
+    config = json.loads(json.dumps(_image_generator_configs[0]))
+    config["build_args"]["CUDA_MAJOR_MINOR_VERSION"] = "12.1"
+    assert build_key != get_build_key(target_version_dir, config)
+
+
+def test_record_and_get_cached_image_id(tmp_path):
+    build_cache_file = str(tmp_path / "cache" / "build-cache.json")
+    assert get_cached_image_id(build_cache_file, "key1") is None
+    record_image_id(build_cache_file, "key1", "sha256:img1")
+    record_image_id(build_cache_file, "key2", "sha256:img2")
+    assert get_cached_image_id(build_cache_file, "key1") == "sha256:img1"
+    assert get_cached_image_id(build_cache_file, "key2") == "sha256:img2"
+    # A corrupt manifest is ignored rather than failing the build.
+    _write_file(build_cache_file, "not json")
+    assert get_cached_image_id(build_cache_file, "key1") is None
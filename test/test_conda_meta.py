@@ -0,0 +1,172 @@
+from __future__ import absolute_import
+
+import io
+import json
+import tarfile
+
+import pytest
+
+pytestmark = pytest.mark.unit
+
+from unittest.mock import MagicMock
+
+from sagemaker_image_builder.conda_meta import (
+    get_explicit_env,
+    get_package_metadata,
+    read_conda_meta_records_from_image,
+    read_conda_meta_records_from_prefix,
+)
+
+
+def _create_conda_meta_record(name, version, build, subdir="linux-64", depends=(), size=1024):
+    return {
+        "name": name,
+        "version": version,
+        "build": build,
+        "subdir": subdir,
+        "depends": list(depends),
+        "size": size,
+        "md5": f"md5-{name}",
+        "url": f"https://conda.anaconda.org/conda-forge/{subdir}/{name}-{version}-{build}.conda",
+    }
+
+
+def _create_conda_meta_records():
+    return [
+        _create_conda_meta_record("python", "3.12.2", "hab00c5b_0", depends=["libzlib >=1.2.13", "pip"]),
+        _create_conda_meta_record("pip", "24.0", "pyhd8ed1ab_0", subdir="noarch", depends=["python >=3.7"]),
+        _create_conda_meta_record("libzlib", "1.2.13", "hd590300_5", depends=["libgcc-ng >=12"]),
+        _create_conda_meta_record("ca-certificates", "2024.2.2", "hbcca054_0"),
+        _create_conda_meta_record("libgcc-ng", "13.2.0", "h807b86a_5"),
+    ]
+
+
+def _create_conda_meta_archive(records):
+    archive = io.BytesIO()
+    with tarfile.open(fileobj=archive, mode="w") as tar_file:
+        for record in records:
+            data = json.dumps(record, indent=2, sort_keys=True).encode()
+            member = tarfile.TarInfo(f"conda-meta/{record['name']}-{record['version']}-{record['build']}.json")
+            member.size = len(data)
+            tar_file.addfile(member, io.BytesIO(data))
+        history = b"==> 2024-03-01 <==\n"
+        member = tarfile.TarInfo("conda-meta/history")
+        member.size = len(history)
+        tar_file.addfile(member, io.BytesIO(history))
+    return archive.getvalue()
+
+
+def test_get_explicit_env():
+    explicit_env = get_explicit_env(_create_conda_meta_records())
+    assert explicit_env == (
+        "# This file may be used to create an environment using:\n"
+        "# $ conda create --name <env> --file <this file>\n"
+        "# platform: linux-64\n"
+        "@EXPLICIT\n"
+        # Every package is listed after its dependencies. The cycle between python and pip is broken alphabetically.
+        "https://conda.anaconda.org/conda-forge/linux-64/ca-certificates-2024.2.2-hbcca054_0.conda#md5-ca-certificates\n"
+        "https://conda.anaconda.org/conda-forge/linux-64/libgcc-ng-13.2.0-h807b86a_5.conda#md5-libgcc-ng\n"
+        "https://conda.anaconda.org/conda-forge/linux-64/libzlib-1.2.13-hd590300_5.conda#md5-libzlib\n"
+        "https://conda.anaconda.org/conda-forge/noarch/pip-24.0-pyhd8ed1ab_0.conda#md5-pip\n"
+        "https://conda.anaconda.org/conda-forge/linux-64/python-3.12.2-hab00c5b_0.conda#md5-python\n"
+    )
+
+
+def test_get_package_metadata():
+    records = _create_conda_meta_records()
+    records[0]["size"] = 4096
+    records[3]["size"] = 2048
+    # Package names are taken from the records, so hyphenated names like ca-certificates are kept whole.
+    assert get_package_metadata(records) == {
+        "python": {"version": "3.12.2", "size": 4096, "installed_size": 0},
+        "ca-certificates": {"version": "2024.2.2", "size": 2048, "installed_size": 0},
+        "pip": {"version": "24.0", "size": 1024, "installed_size": 0},
+        "libzlib": {"version": "1.2.13", "size": 1024, "installed_size": 0},
+        "libgcc-ng": {"version": "13.2.0", "size": 1024, "installed_size": 0},
+    }
+    assert list(get_package_metadata(records))[:2] == ["python", "ca-certificates"]
+
+
+def test_get_package_metadata_installed_size():
+    records = _create_conda_meta_records()[:3]
+    records[0]["paths_data"] = {
+        "paths": [
+            {"_path": "bin/python3.12", "path_type": "hardlink", "size_in_bytes": 3000},
+            {"_path": "bin/python", "path_type": "softlink", "size_in_bytes": 3000},
+            {"_path": "lib/libpython3.12.so", "path_type": "hardlink", "size_in_bytes": 5000},
+            {"_path": "share/licenses/LICENSE", "path_type": "hardlink", "size_in_bytes": 100},
+        ],
+        "paths_version": 1,
+    }
+    records[1]["paths_data"] = {
+        "paths": [
+            {"_path": "bin/pip", "path_type": "hardlink", "size_in_bytes": 200},
+            # A file which python installed as well, and which is only stored once on disk. It's counted for pip, which
+            # comes first by name.
+            {"_path": "share/licenses/LICENSE", "path_type": "hardlink", "size_in_bytes": 100},
+            {"_path": "lib/python3.12/site-packages/pip/__pycache__", "path_type": "directory"},
+        ],
+        "paths_version": 1,
+    }
+    records[2]["paths_data"] = {
+        "paths": [
+            {"_path": "lib/libz.so.1.2.13", "path_type": "hardlink", "sha256": "ab12", "size_in_bytes": 100},
+            # Identical files under different paths are counted once, whichever package lists them.
+            {"_path": "lib/libz.so.1", "path_type": "hardlink", "sha256": "ab12", "size_in_bytes": 100},
+            {
+                "_path": "lib/python3.12/config/libz.so",
+                "path_type": "hardlink",
+                "sha256": "cd34",
+                "size_in_bytes": 3000,
+            },
+            # Files without a sha256 are only de-duplicated by path.
+            {"_path": "include/zlib.h", "path_type": "hardlink", "size_in_bytes": 10},
+            {"_path": "include/zconf.h", "path_type": "hardlink", "size_in_bytes": 10},
+        ],
+        "paths_version": 1,
+    }
+    records[0]["paths_data"]["paths"].append(
+        {"_path": "lib/libpython-copy.so", "path_type": "hardlink", "sha256": "cd34", "size_in_bytes": 3000}
+    )
+    package_metadata = get_package_metadata(records)
+    assert package_metadata["python"]["installed_size"] == 8000
+    assert package_metadata["pip"]["installed_size"] == 300
+    assert package_metadata["libzlib"]["installed_size"] == 3120
+    del records[2]["paths_data"]
+    package_metadata = get_package_metadata(records)
+    # Without libzlib, the copy in python is counted for python. libzlib doesn't have paths_data.
+    assert package_metadata["python"]["installed_size"] == 11000
+    assert package_metadata["libzlib"]["installed_size"] == 0
+
+
+def test_read_conda_meta_records_from_prefix(tmp_path):
+    (tmp_path / "conda-meta").mkdir()
+    for record in _create_conda_meta_records():
+        file_name = f"{record['name']}-{record['version']}-{record['build']}.json"
+        (tmp_path / "conda-meta" / file_name).write_text(json.dumps(record, indent=2, sort_keys=True))
+    (tmp_path / "conda-meta" / "history").write_text("==> 2024-03-01 <==\n")
+    records = read_conda_meta_records_from_prefix(str(tmp_path))
+    # Names are taken from the records, e.g. libgcc-ng and ca-certificates aren't cut at the first hyphen.
+    assert get_package_metadata(records) == {
+        "python": {"version": "3.12.2", "size": 1024, "installed_size": 0},
+        "pip": {"version": "24.0", "size": 1024, "installed_size": 0},
+        "libzlib": {"version": "1.2.13", "size": 1024, "installed_size": 0},
+        "ca-certificates": {"version": "2024.2.2", "size": 1024, "installed_size": 0},
+        "libgcc-ng": {"version": "13.2.0", "size": 1024, "installed_size": 0},
+    }
+    assert sorted(records, key=lambda r: r["name"]) == sorted(_create_conda_meta_records(), key=lambda r: r["name"])
+
+
+def test_read_conda_meta_records_from_image():
+    docker_client = MagicMock()
+    container = docker_client.containers.create.return_value
+    archive = _create_conda_meta_archive(_create_conda_meta_records())
+    # The archive is streamed in chunks.
+    container.get_archive.return_value = (iter([archive[:1000], archive[1000:]]), {})
+    records = read_conda_meta_records_from_image(docker_client, "sha256:img1", "/opt/conda")
+    assert sorted(r["name"] for r in records) == ["ca-certificates", "libgcc-ng", "libzlib", "pip", "python"]
+    docker_client.containers.create.assert_called_once_with(image="sha256:img1")
+    container.get_archive.assert_called_once_with("/opt/conda/conda-meta")
+    # The container is never started, but it's always cleaned up.
+    container.start.assert_not_called()
+    container.remove.assert_called_once_with(force=True)
@@ -0,0 +1,120 @@
+from __future__ import absolute_import
+
+import pytest
+
+pytestmark = pytest.mark.unit
+
+from sagemaker_image_builder.env_parser import EnvRecord, parse_env_file, parse_env_line
+
+_ENV_OUT = """# This file may be used to create an environment using:
+# $ conda create --name <env> --file <this file>
+# platform: linux-64
+@EXPLICIT
+https://conda.anaconda.org/conda-forge/linux-64/_libgcc_mutex-0.1-conda_forge.tar.bz2#d7c89558ba9fa0495403155b64376d81
+https://conda.anaconda.org/conda-forge/noarch/ipykernel-6.21.3-pyh210e3f2_0.conda#8c1f6bf32a6ca81232c4853d4165ca67
+https://conda.anaconda.org/conda-forge/linux-64/libgcc-ng-13.2.0-h807b86a_5.conda#d4ff227c46917d3b4565302a2bbb276b
+https://conda.anaconda.org/conda-forge/linux-64/numpy-1.24.2-py38h10c12cc_0.conda#05592c85b9f6931dc2df1e80c0d56294
+https://conda.anaconda.org/conda-forge/linux-64/python-3.11.8-hab00c5b_0_cpython.conda
+https://conda.anaconda.org/conda-forge/linux-aarch64/openssl-3.2.1-h31becfc_1.conda#a24bdf1ad8a95ec4da2a4fe6cc4a5d31
+https://conda.anaconda.org/conda-forge/noarch/tzdata-2024a-h0c530f3_0.conda#161081fc7cec0bfda0d86d7cb595f8d8
+https://conda.anaconda.org/conda-forge/linux-64/pytorch-2.1.2-cuda118_py311h8d3a1ea_301.conda#3f6ec08f9e7d3e0bd1bc2cc4c4d3c6b8
+"""
+
+_ENV_IN = """# This file is auto-generated.
+conda-forge::ipykernel
+conda-forge::numpy[version='>=1.24.2,<1.25.0']
+conda-forge::jupyterlab[version=">=4.1.5,<5.0.0"]
+conda-forge::sagemaker-python-sdk[version='>=2.212.0,<3.0.0']
+conda-forge::boto3[version='==1.34.51']
+conda-forge::python=3.11
+conda-forge::pip>=23
+"""
+
+
+def test_parse_explicit_url():
+    assert parse_env_line(
+        "https://conda.anaconda.org/conda-forge/linux-64/libgcc-ng-13.2.0-h807b86a_5.conda"
+        "#d4ff227c46917d3b4565302a2bbb276b\n"
+    ) == EnvRecord(
+        "libgcc-ng",
+        channel="conda-forge",
+        subdir="linux-64",
+        version="13.2.0",
+        build="h807b86a_5",
+        md5="d4ff227c46917d3b4565302a2bbb276b",
+        fn="libgcc-ng-13.2.0-h807b86a_5.conda",
+    )
+
+
+def test_parse_channel_spec():
+    record = parse_env_line("conda-forge::numpy[version='>=1.24.2,<1.25.0']")
+    assert record == EnvRecord("numpy", channel="conda-forge", version=">=1.24.2,<1.25.0")
+    assert not record.is_exact_version
+    assert parse_env_line("conda-forge::ipykernel") == EnvRecord("ipykernel", channel="conda-forge")
+    assert parse_env_line("conda-forge::boto3[version='==1.34.51']").version == "1.34.51"
+
+
+def test_parse_blank_and_comment_lines():
+    for line in ["", "  \n", "# platform: linux-64", "@EXPLICIT"]:
+        assert parse_env_line(line) is None
+
+
+def test_unrecognized_lines_fall_back_to_conda(mocker):
+    mock_get_record_from_match_spec = mocker.patch(
+        "sagemaker_image_builder.env_parser._get_record_from_match_spec", return_value=EnvRecord("python")
+    )
+    assert parse_env_line("conda-forge::python=3.11") == EnvRecord("python")
+    # Versions with whitespace are normalized by conda.
+    parse_env_line("conda-forge::uvicorn[version='>=0.27.1, <0.28.0']")
+    # Only conda.anaconda.org urls in the `conda list --explicit` format are parsed natively.
+    parse_env_line("https://repo.anaconda.com/pkgs/main/linux-64/zlib-1.2.13-h5eee18b_0.conda")
+    assert mock_get_record_from_match_spec.call_count == 3
+
+
+def test_env_record_is_immutable():
+    record = EnvRecord("numpy", channel="conda-forge", version="1.24.2")
+    with pytest.raises(AttributeError):
+        record.version = "1.26.4"
+    with pytest.raises(AttributeError):
+        del record.channel
+    assert record == EnvRecord("numpy", channel="conda-forge", version="1.24.2")
+    assert hash(record) == hash(EnvRecord("numpy", channel="conda-forge", version="1.24.2"))
+
+
+def test_to_match_spec_str():
+    record = parse_env_line("https://conda.anaconda.org/conda-forge/linux-64/numpy-1.24.2-py38h10c12cc_0.conda")
+    assert record.to_match_spec_str() == "conda-forge/linux-64::numpy==1.24.2=py38h10c12cc_0"
+    record = parse_env_line("conda-forge::numpy[version='>=1.24.2,<1.25.0']")
+    assert record.to_match_spec_str() == "conda-forge::numpy>=1.24.2,<1.25.0"
+
+
+@pytest.mark.parametrize(
+    "file_name,contents", [("cpu.env.out", _ENV_OUT), ("cpu.env.in", _ENV_IN)], ids=["env.out", "env.in"]
+)
+def test_parse_env_file_matches_conda(tmp_path, file_name, contents):
+    # Differential test: the native parser must agree with conda's MatchSpec on every field of every line.
+    from conda.models.match_spec import MatchSpec
+
+    file_path = tmp_path / file_name
+    file_path.write_text(contents)
+    records = parse_env_file(file_path)
+    lines = [line for line in contents.splitlines() if line and not line.startswith("#") and line != "@EXPLICIT"]
+    match_specs = {}
+    md5s = {}
+    for line in lines:
+        match_spec = MatchSpec(line)
+        match_specs[match_spec.get("name")] = match_spec
+        # MatchSpec drops the '#<md5>' fragment of explicit urls as a comment.
+        md5s[match_spec.get("name")] = line.partition("#")[2] or None
+    assert records.keys() == match_specs.keys()
+    for name, match_spec in match_specs.items():
+        channel = match_spec.get("channel")
+        version = match_spec.get("version")
+        build = match_spec.get("build")
+        fn = match_spec.get("fn")
+        assert records[name].channel == (channel.channel_name if channel is not None else None), name
+        assert records[name].subdir == match_spec.get("subdir"), name
+        assert records[name].version == (str(version).removeprefix("==") if version is not None else None), name
+        assert records[name].build == (str(build) if build is not None else None), name
+        assert records[name].md5 == md5s[name], name
+        assert records[name].fn == (str(fn) if fn is not None else None), name
@@ -0,0 +1,117 @@
+from __future__ import absolute_import
+
+import io
+import zlib
+
+import pytest
+
+pytestmark = pytest.mark.unit
+
+from unittest.mock import MagicMock
+
+from sagemaker_image_builder.image_layers import (
+    UNATTRIBUTED_PACKAGE_NAME,
+    read_image_layers,
+    read_image_layers_from_docker,
+)
+
+
+def _get_gzip_size(data: bytes) -> int:
+    compressor = zlib.compressobj(wbits=31)
+    return len(compressor.compress(data)) + len(compressor.flush())
+
+
+def _create_saved_image(saved_image_factory):
+    saved_image = saved_image_factory()
+    saved_image.add_layer({"etc/os-release": b"NAME=Ubuntu\n", "usr/bin/bash": b"\x7fELF" * 1000}, "ADD rootfs /")
+    saved_image.add_conda_packages(
+        {
+            "python": ("3.12.2", {"bin/python3.12": b"p" * 3000, "lib/libpython3.12.so": b"l" * 5000}),
+            "libgcc-ng": ("13.2.0", {"lib/libgcc_s.so.1": b"g" * 700}),
+        },
+        extra_files={"lib/python3.12/site-packages/installed_by_pip.py": b"x" * 40},
+    )
+    saved_image.add_layer({"etc/motd": b"Welcome\n"}, "RUN echo Welcome > /etc/motd | tee")
+    # An identical layer, which docker save links to the first one.
+    saved_image.add_layer({"etc/os-release": b"NAME=Ubuntu\n", "usr/bin/bash": b"\x7fELF" * 1000}, "ADD rootfs /")
+    return saved_image
+
+
+def test_read_image_layers(saved_image_factory):
+    saved_image = _create_saved_image(saved_image_factory)
+    image_layers = read_image_layers(io.BytesIO(saved_image.save()))
+    layers = image_layers["layers"]
+    assert [layer["digest"] for layer in layers] == saved_image.get_layer_digests()
+    # Empty layers, e.g. ENV, don't have a layer of their own.
+    assert [layer["created_by"] for layer in layers] == [
+        "ADD rootfs /",
+        "RUN micromamba install",
+        "RUN echo Welcome > /etc/motd | tee",
+        "ADD rootfs /",
+    ]
+    assert [layer["size"] for layer in layers] == [len(layer) for _, layer in saved_image.layers]
+    assert [layer["compressed_size"] for layer in layers] == [_get_gzip_size(layer) for _, layer in saved_image.layers]
+    assert layers[0]["package_sizes"] == {}
+    conda_meta_size = layers[1]["package_sizes"][UNATTRIBUTED_PACKAGE_NAME] - 40
+    assert conda_meta_size > 0
+    assert layers[1]["package_sizes"] == {
+        "python": 8000,
+        "libgcc-ng": 700,
+        UNATTRIBUTED_PACKAGE_NAME: 40 + conda_meta_size,
+    }
+    assert image_layers["package_versions"] == {"python": "3.12.2", "libgcc-ng": "13.2.0"}
+
+
+@pytest.mark.parametrize("compression", ["gzip", "zstd"])
+def test_read_image_layers_with_compressed_layers(saved_image_factory, compression):
+    if compression == "zstd":
+        pytest.importorskip("zstandard")
+    saved_image = _create_saved_image(lambda: saved_image_factory(compression=compression))
+    image_layers = read_image_layers(io.BytesIO(saved_image.save()))
+    # Layers are scanned like uncompressed ones, but their compressed size is the size of the blob.
+    uncompressed_image_layers = read_image_layers(io.BytesIO(_create_saved_image(saved_image_factory).save()))
+    for layer in uncompressed_image_layers["layers"]:
+        layer.pop("compressed_size")
+    assert [layer.pop("compressed_size") for layer in image_layers["layers"]] == [
+        len(saved_image.get_layer_blob(layer)) for _, layer in saved_image.layers
+    ]
+    assert image_layers == uncompressed_image_layers
+
+
+def test_read_image_layers_with_unknown_layer_format(saved_image_factory):
+    saved_image = saved_image_factory()
+    saved_image.add_layer({"etc/motd": b"Welcome\n"})
+    saved_image.get_layer_blob = lambda layer: b"\x42\x5a\x68" + layer
+    with pytest.raises(Exception, match="layer .*/layer.tar of the saved image is neither a tar archive"):
+        read_image_layers(io.BytesIO(saved_image.save()))
+
+
+def test_read_image_layers_with_conda_prefix(saved_image_factory):
+    saved_image = saved_image_factory("/opt/conda/envs/default")
+    saved_image.add_conda_packages({"python": ("3.12.2", {"bin/python3.12": b"p" * 3000})})
+    # A later layer deletes a file of python.
+    saved_image.add_layer(
+        {}, "RUN rm /opt/conda/envs/default/bin/python3.12", ["opt/conda/envs/default/bin/python3.12"]
+    )
+    image_layers = read_image_layers(io.BytesIO(saved_image.save()), "/opt/conda/envs/default")
+    assert image_layers["layers"][0]["package_sizes"]["python"] == 3000
+    # Whiteout files take no bytes of any package.
+    assert image_layers["layers"][1]["package_sizes"] == {}
+    assert image_layers["package_versions"] == {"python": "3.12.2"}
+    # Nothing is attributed outside of the given conda prefix.
+    image_layers = read_image_layers(io.BytesIO(saved_image.save()), "/usr/local")
+    assert [layer["package_sizes"] for layer in image_layers["layers"]] == [{}, {}]
+    assert image_layers["package_versions"] == {}
+
+
+def test_read_image_layers_from_docker(saved_image_factory):
+    saved_image = _create_saved_image(saved_image_factory).save()
+    docker_client = MagicMock()
+    # docker-py streams the saved image in chunks.
+    docker_client.images.get.return_value.save.return_value = (
+        saved_image[i : i + 1000] for i in range(0, len(saved_image), 1000)
+    )
+    image_layers = read_image_layers_from_docker(docker_client, "localhost/sagemaker-distribution:1.6.2-cpu")
+    assert image_layers == read_image_layers(io.BytesIO(saved_image))
+    docker_client.images.get.assert_called_once_with("localhost/sagemaker-distribution:1.6.2-cpu")
+    docker_client.images.get.return_value.save.assert_called_once_with(named=False)
@@ -0,0 +1,56 @@
+from __future__ import absolute_import
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+pytestmark = pytest.mark.unit
+
+# Modules which take a while to import (or, in the case of docker, to connect to the daemon). They must only be
+# imported by the subcommands which need them.
+_HEAVY_MODULES = {"boto3", "botocore", "conda", "docker"}
+# Generous enough to not be flaky on a busy CI host, while still failing if e.g. conda is imported again.
+_IMPORT_TIME_BUDGET_MICROSECONDS = 500_000
+
+
+def _get_cumulative_import_times(module_name: str) -> dict[str, int]:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module_name}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    # Lines look like 'import time:       271 |      14402 |   sagemaker_image_builder.main'
+    import_times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, imported_module_name = line.removeprefix("import time:").split("|")
+        import_times[imported_module_name.strip()] = int(cumulative_us)
+    return import_times
+
+
+def test_main_does_not_import_heavy_modules():
+    import_times = _get_cumulative_import_times("sagemaker_image_builder.main")
+    heavy_modules = sorted(m for m in import_times if m.split(".")[0] in _HEAVY_MODULES)
+    assert heavy_modules == []
+
+
+def test_main_import_time_budget():
+    import_times = _get_cumulative_import_times("sagemaker_image_builder.main")
+    assert import_times["sagemaker_image_builder.main"] < _IMPORT_TIME_BUDGET_MICROSECONDS
+
+
+def test_help_does_not_require_docker(tmp_path):
+    # Point the docker client to a daemon which doesn't exist. --help must still work.
+    env = dict(os.environ, DOCKER_HOST=f"unix://{tmp_path}/docker.sock")
+    result = subprocess.run(
+        [sys.executable, "-m", "sagemaker_image_builder.main", "--help"],
+        capture_output=True,
+        text=True,
+        env=env,
+    )
+    assert result.returncode == 0, result.stderr
+    assert "build" in result.stdout
@@ -8,29 +8,47 @@ pytestmark = pytest.mark.unit
 
 import json
 import os
+import subprocess
+import sys
+import time
 from unittest.mock import MagicMock, Mock, patch
 
+from docker.errors import ImageNotFound
+
 from sagemaker_image_builder.changelog_generator import _derive_changeset
 from sagemaker_image_builder.main import (
+    _BUILD_LOG_TAIL_LINES,
+    _build_local_image,
+    _build_local_images,
+    _export_env_out,
     _get_config_for_image,
+    _get_docker_build_command,
     _get_version_tags,
     _push_images_upstream,
+    _run_docker_build,
     build_images,
     create_and_get_semver_dir,
     create_major_version_artifacts,
     create_minor_version_artifacts,
     create_patch_version_artifacts,
 )
+from sagemaker_image_builder.registry import _ecr_clients, _ecr_credentials_cache
 from sagemaker_image_builder.release_notes_generator import (
     _get_image_type_package_metadata,
     _get_package_to_image_type_mapping,
 )
-from sagemaker_image_builder.utils import get_semver
+from sagemaker_image_builder.utils import VersionIndex, get_dir_for_version, get_semver
 
 with open("test/test_image_config.json") as jsonfile:
     _image_generator_configs = json.load(jsonfile)
 
 
+@pytest.fixture(autouse=True)
+def clear_ecr_credentials_cache():
+    _ecr_clients.clear()
+    _ecr_credentials_cache.clear()
+
+
 class CreateVersionArgs:
     def __init__(
         self,
@@ -48,12 +66,32 @@ class CreateVersionArgs:
 
 
 class BuildImageArgs:
-    def __init__(self, target_patch_version, image_config_file, target_ecr_repo=None, force=False):
+    def __init__(
+        self,
+        target_patch_version,
+        image_config_file,
+        target_ecr_repo=None,
+        force=False,
+        max_parallel_builds=None,
+        build_log_dir="build_logs",
+        build_cache_file="build-cache.json",
+        env_out_source="container",
+        region=None,
+        ecr_credentials_cache_file=None,
+        registry_aware_push=False,
+    ):
         self.target_patch_version = target_patch_version
         self.target_ecr_repo = target_ecr_repo
         self.skip_tests = True
         self.force = force
         self.image_config_file = image_config_file
+        self.max_parallel_builds = max_parallel_builds
+        self.build_log_dir = build_log_dir
+        self.build_cache_file = build_cache_file
+        self.env_out_source = env_out_source
+        self.region = region
+        self.ecr_credentials_cache_file = ecr_credentials_cache_file
+        self.registry_aware_push = registry_aware_push
 
 
 def _create_docker_cpu_env_in_file(file_path, required_package="conda-forge::ipykernel"):
@@ -492,7 +530,12 @@ def test_build_images(mocker, tmp_path):
     mocker.patch("sagemaker_image_builder.main._docker_client", new=mock_docker_from_env)
     version = "1.124.5"
     image_config_file = "test/test_image_config.json"
-    args = BuildImageArgs(version, image_config_file)
+    args = BuildImageArgs(
+        version,
+        image_config_file,
+        build_log_dir=str(tmp_path / "build_logs"),
+        build_cache_file=str(tmp_path / "build-cache.json"),
+    )
 
     def mock_get_dir_for_version(base_version):
         version_string = f"v{base_version.major}.{base_version.minor}.{base_version.patch}"
@@ -518,6 +561,10 @@ def test_build_images(mocker, tmp_path):
         "container_logs1".encode("utf-8"),
         "container_logs2".encode("utf-8"),
     ]
+    mocker.patch(
+        "sagemaker_image_builder.main.read_conda_meta_records_from_image",
+        return_value=[{"name": "ipykernel", "version": "6.21.3", "size": 111}],
+    )
     # Invoke build images
     build_images(args)
     # Assert env.out exists
@@ -531,70 +578,266 @@ def test_build_images(mocker, tmp_path):
         actual_output.add(f.read())
     expected_output = {"container_logs1", "container_logs2"}
     assert actual_output == expected_output
+    # Package metadata is captured next to env.out
+    with open(input_version_dir + "/cpu.pkg_metadata.json") as f:
+        assert json.load(f) == {"ipykernel": {"version": "6.21.3", "size": 111, "installed_size": 0}}
+    assert os.path.exists(input_version_dir + "/gpu.pkg_metadata.json")
+
+
+def test_build_local_images_returns_results_in_config_order(mocker, tmp_path):
+    mocker.patch("sagemaker_image_builder.main.get_dir_for_version", return_value=str(tmp_path))
+    mocker.patch("sagemaker_image_builder.main._get_version_tags", return_value=["1.124.5"])
+    built_images = {}
+
+    def mock_build_local_image(target_version, target_version_dir, image_generator_config, *args):
+        # Make the first image config finish last.
+        if image_generator_config["image_type"] == "gpu":
+            time.sleep(0.2)
+        image = Mock()
+        image.id = "img-" + image_generator_config["image_type"]
+        built_images[image_generator_config["image_type"]] = image
+        return image, image_generator_config
+
+    mocker.patch("sagemaker_image_builder.main._build_local_image", side_effect=mock_build_local_image)
+    image_ids, image_versions = _build_local_images(
+        get_semver("1.124.5"), ["my-repository"], _image_generator_configs, False, max_parallel_builds=2
+    )
+    assert image_ids == ["img-gpu", "img-cpu"]
+    assert image_versions == [
+        {"repository": "my-repository", "tag": "1.124.5-gpu", "image_id": "img-gpu"},
+        {"repository": "my-repository", "tag": "1.124.5-cpu", "image_id": "img-cpu"},
+    ]
+    built_images["gpu"].tag.assert_any_call("localhost/sagemaker-distribution", "1.124.5-gpu")
+    built_images["cpu"].tag.assert_any_call("localhost/sagemaker-distribution", "1.124.5-cpu")
 
 
-@patch("os.path.exists")
-def test_get_version_tags(mock_path_exists):
+def test_build_local_image_reuses_image_when_build_inputs_are_unchanged(mocker, tmp_path):
+    mock_docker_from_env = MagicMock(name="_docker_client")
+    mocker.patch("sagemaker_image_builder.main._docker_client", new=mock_docker_from_env)
+    mocker.patch("sagemaker_image_builder.main.generate_change_log")
+    mock_run_docker_build = mocker.patch("sagemaker_image_builder.main._run_docker_build", return_value="img1")
+    target_version_dir = str(tmp_path / "v1.124.5")
+    os.makedirs(target_version_dir)
+    _create_prev_docker_file(target_version_dir + "/Dockerfile")
+    _create_docker_cpu_env_in_file(target_version_dir + "/cpu.env.in")
+    mock_image = Mock()
+    mock_image.id = "sha256:img1"
+    mock_docker_from_env.images.get.return_value = mock_image
+    mock_docker_from_env.containers.run.return_value = open(target_version_dir + "/cpu.env.in", "rb").read()
+    mock_read_conda_meta_records = mocker.patch(
+        "sagemaker_image_builder.main.read_conda_meta_records_from_image",
+        return_value=[{"name": "ipykernel", "version": "6.21.3", "size": 111}],
+    )
+    build_cache_file = str(tmp_path / "build-cache.json")
+    build_args = (get_semver("1.124.5"), target_version_dir, _image_generator_configs[1], False, str(tmp_path))
+    # The first build runs docker build and exports env.out.
+    image, config = _build_local_image(*build_args, build_cache_file)
+    assert image == mock_image
+    assert mock_run_docker_build.call_count == 1
+    assert mock_docker_from_env.containers.run.call_count == 1
+    # The second build uses env.out as its input, which was built into the existing image.
+    image, config = _build_local_image(*build_args, build_cache_file)
+    assert image == mock_image
+    assert config["build_args"]["ENV_IN_FILENAME"] == "cpu.env.out"
+    assert mock_run_docker_build.call_count == 1
+    assert mock_docker_from_env.containers.run.call_count == 1
+    assert mock_read_conda_meta_records.call_count == 1
+    assert os.path.exists(target_version_dir + "/cpu.pkg_metadata.json")
+    # Changing any build input results in a new build.
+    _create_template_docker_file(target_version_dir + "/Dockerfile")
+    _build_local_image(*build_args, build_cache_file)
+    assert mock_run_docker_build.call_count == 2
+    # The image is rebuilt if it no longer exists locally.
+    mock_docker_from_env.images.get.side_effect = [ImageNotFound("img1"), mock_image]
+    _build_local_image(*build_args, build_cache_file)
+    assert mock_run_docker_build.call_count == 3
+
+
+def test_export_env_out_from_image_file_system(mocker):
+    mock_docker_from_env = MagicMock(name="_docker_client")
+    mocker.patch("sagemaker_image_builder.main._docker_client", new=mock_docker_from_env)
+    mock_read_conda_meta_records = mocker.patch(
+        "sagemaker_image_builder.main.read_conda_meta_records_from_image",
+        return_value=[
+            {
+                "name": "ipykernel",
+                "version": "6.21.3",
+                "subdir": "noarch",
+                "url": "https://conda.anaconda.org/conda-forge/noarch/ipykernel-6.21.3-pyh210e3f2_0.conda",
+                "md5": "8c1f6bf32a6ca81232c4853d4165ca67",
+            }
+        ],
+    )
+    mock_image = Mock()
+    mock_image.id = "sha256:img1"
+    config = dict(_image_generator_configs[1], conda_prefix="/opt/conda/envs/default")
+    env_out = _export_env_out(mock_image, config, "image").decode()
+    assert env_out.endswith(
+        "@EXPLICIT\nhttps://conda.anaconda.org/conda-forge/noarch/ipykernel-6.21.3-pyh210e3f2_0.conda"
+        "#8c1f6bf32a6ca81232c4853d4165ca67\n"
+    )
+    mock_read_conda_meta_records.assert_called_once_with(mock_docker_from_env, "sha256:img1", "/opt/conda/envs/default")
+    mock_docker_from_env.containers.run.assert_not_called()
+
+
+def _get_fake_docker_build_command(output_lines, exit_code=0):
+    script = "".join(f"print({line!r})\n" for line in output_lines) + f"raise SystemExit({exit_code})\n"
+    return [sys.executable, "-c", script]
+
+
+def test_run_docker_build(tmp_path):
+    output_lines = [
+        "#1 [internal] load build definition from Dockerfile",
+        "#12 exporting to image",
+        "#12 writing image sha256:0123456789abcdef done",
+        "#12 DONE 0.1s",
+    ]
+    build_log_file_path = str(tmp_path / "build_logs" / "1.124.5-cpu.log")
+    image_id = _run_docker_build(_get_fake_docker_build_command(output_lines), build_log_file_path, "[cpu]")
+    assert image_id == "0123456789abcdef"
+    with open(build_log_file_path) as f:
+        assert f.read().splitlines() == output_lines
+
+
+def test_run_docker_build_keeps_only_the_tail_of_the_output_on_failure(tmp_path):
+    output_lines = [f"#1 line {i}" for i in range(_BUILD_LOG_TAIL_LINES + 50)]
+    build_log_file_path = str(tmp_path / "1.124.5-cpu.log")
+    with pytest.raises(subprocess.CalledProcessError) as e:
+        _run_docker_build(_get_fake_docker_build_command(output_lines, exit_code=1), build_log_file_path, "[cpu]")
+    assert e.value.returncode == 1
+    assert e.value.output.splitlines() == output_lines[-_BUILD_LOG_TAIL_LINES:]
+    # The log file still contains the complete output.
+    with open(build_log_file_path) as f:
+        assert f.read().splitlines() == output_lines
+
+
+def test_run_docker_build_reads_the_image_id_file(tmp_path):
+    image_id_file_path = str(tmp_path / "1.124.5-cpu.iid")
+    output_lines = ["#12 exporting to docker image format", "#12 sending tarball 1.2s done"]
+    command = _get_fake_docker_build_command(output_lines)
+    # The fake build writes the image id file the same way `docker buildx build --iidfile` does.
+    command[2] = f"open({image_id_file_path!r}, 'w').write('sha256:0123456789abcdef')\n" + command[2]
+    image_id = _run_docker_build(command, str(tmp_path / "1.124.5-cpu.log"), "[cpu]", image_id_file_path)
+    assert image_id == "0123456789abcdef"
+
+
+def test_get_docker_build_command():
+    config = _image_generator_configs[1]
+    assert _get_docker_build_command("build_artifacts/v1/v1.124/v1.124.5", config, "cpu.iid") == [
+        "docker",
+        "build",
+        "--rm",
+        "--pull",
+        "--build-arg",
+        "TAG_FOR_BASE_MICROMAMBA_IMAGE=jammy",
+        "--build-arg",
+        "ENV_IN_FILENAME=cpu.env.in",
+        "./build_artifacts/v1/v1.124/v1.124.5",
+    ]
+    config = dict(
+        config,
+        cache_from=["type=registry,ref=registry.example.com/sm:cache-cpu", "type=local,src=/tmp/buildkit-cache"],
+        cache_to="type=local,dest=/tmp/buildkit-cache,mode=max",
+    )
+    assert _get_docker_build_command("build_artifacts/v1/v1.124/v1.124.5", config, "cpu.iid") == [
+        "docker",
+        "buildx",
+        "build",
+        "--load",
+        "--pull",
+        "--iidfile",
+        "cpu.iid",
+        "--cache-from",
+        "type=registry,ref=registry.example.com/sm:cache-cpu",
+        "--cache-from",
+        "type=local,src=/tmp/buildkit-cache",
+        "--cache-to",
+        "type=local,dest=/tmp/buildkit-cache,mode=max",
+        "--build-arg",
+        "TAG_FOR_BASE_MICROMAMBA_IMAGE=jammy",
+        "--build-arg",
+        "ENV_IN_FILENAME=cpu.env.in",
+        "./build_artifacts/v1/v1.124/v1.124.5",
+    ]
+
+
+def _get_version_tags_in_tree(tmp_path, version, file_name, versions_to_files):
+    # Creates a build_artifacts tree which contains the given versions and files, and returns the tags for the given
+    # version within that tree.
+    build_artifacts_dir = tmp_path / f"build_artifacts_{len(list(tmp_path.iterdir()))}"
+    for version_str, file_names in versions_to_files.items():
+        relative_dir = os.path.relpath(get_dir_for_version(get_semver(version_str)), "build_artifacts")
+        version_dir = build_artifacts_dir / relative_dir
+        os.makedirs(version_dir)
+        for f in file_names:
+            (version_dir / f).write_text("")
+    return _get_version_tags(version, file_name, VersionIndex(str(build_artifacts_dir)))
+
+
+def test_get_version_tags(tmp_path):
     version = get_semver("1.124.5")
     file_name = "cpu.env.out"
+    files = ["Dockerfile", file_name]
+
+    def _get_tags(versions_to_files):
+        return _get_version_tags_in_tree(tmp_path, version, file_name, dict({"1.124.5": files}, **versions_to_files))
+
     # case 1: The given version is the latest for patch, minor and major
-    mock_path_exists.side_effect = [False, False, False]
-    assert _get_version_tags(version, file_name) == ["1.124.5", "1.124", "1", "latest"]
+    assert _get_tags({}) == ["1.124.5", "1.124", "1", "latest"]
     # case 2: The given version is the latest for patch, minor but not major
     # case 2.1 The major version is a prerelease version
-    mock_path_exists.side_effect = [False, False, True, False]
-    assert _get_version_tags(version, file_name) == ["1.124.5", "1.124", "1", "latest"]
+    assert _get_tags({"2.0.0-beta": files}) == ["1.124.5", "1.124", "1", "latest"]
     # case 2.2 The major version is not a prerelease version
-    mock_path_exists.side_effect = [False, False, True, True]
-    assert _get_version_tags(version, file_name) == ["1.124.5", "1.124", "1"]
+    assert _get_tags({"2.0.0": files}) == ["1.124.5", "1.124", "1"]
     # case 3: The given version is the latest for patch and major but not for minor
-    # case 3.1 The minor version is a prerelease version (we need to mock path.exists for major
-    # version twice - one for the actual directory, one for the docker file)
-    mock_path_exists.side_effect = [False, True, False, True, True]
-    assert _get_version_tags(version, file_name) == ["1.124.5", "1.124", "1"]
+    # case 3.1 The minor version is a prerelease version
+    assert _get_tags({"1.125.0-beta": files, "2.0.0": files}) == ["1.124.5", "1.124", "1"]
     # case 3.2 The minor version is not a prerelease version
-    mock_path_exists.side_effect = [False, True, True]
-    assert _get_version_tags(version, file_name) == ["1.124.5", "1.124"]
+    assert _get_tags({"1.125.0": files}) == ["1.124.5", "1.124"]
     # case 4: The given version is not the latest for patch, minor, major
-    # case 4.1 The patch version is a prerelease version (we need to mock path.exists for minor
-    # and major twice - one for the actual directory, one for the docker file)
-    mock_path_exists.side_effect = [True, False, True, True, True, True]
-    assert _get_version_tags(version, file_name) == ["1.124.5", "1.124"]
+    # case 4.1 The patch version is a prerelease version
+    assert _get_tags({"1.124.6-beta": files, "1.125.0": files}) == ["1.124.5", "1.124"]
     # case 4.2 The patch version is not a prerelease version
-    mock_path_exists.side_effect = [True, True]
-    assert _get_version_tags(version, file_name) == ["1.124.5"]
-
-
-@patch("os.path.exists")
-def test_get_version_tags_with_prerelease_identifier(mock_path_exists):
+    assert _get_tags({"1.124.6": files}) == ["1.124.5"]
+    # case 5: Versions which haven't been built yet (i.e. which don't have an env.out file) are ignored
+    assert _get_tags({"1.124.6": ["Dockerfile"], "2.0.0": ["Dockerfile"]}) == ["1.124.5", "1.124", "1", "latest"]
+    # case 6: Any newer version counts, not only the next one
+    assert _get_tags({"1.124.7": files}) == ["1.124.5"]
+    assert _get_tags({"1.126.1": files}) == ["1.124.5", "1.124"]
+    assert _get_tags({"3.1.0": files}) == ["1.124.5", "1.124", "1"]
+    # Older versions don't matter
+    assert _get_tags({"1.124.4": files, "1.123.9": files, "0.9.0": files}) == ["1.124.5", "1.124", "1", "latest"]
+
+
+def test_get_version_tags_with_prerelease_identifier(tmp_path):
     version = get_semver("1.124.5-beta")
     file_name = "cpu.env.out"
+    files = ["Dockerfile", file_name]
+
+    def _get_tags(versions_to_files):
+        return _get_version_tags_in_tree(
+            tmp_path, version, file_name, dict({"1.124.5-beta": files}, **versions_to_files)
+        )
+
     # case 1: The given version is the latest for patch, minor and major
-    mock_path_exists.side_effect = [False, False, False]
-    assert _get_version_tags(version, file_name) == ["1.124.5-beta", "1.124-beta", "1-beta", "latest-beta"]
+    assert _get_tags({}) == ["1.124.5-beta", "1.124-beta", "1-beta", "latest-beta"]
     # case 2: The given version is the latest for patch, minor but not major
     # case 2.1 The major version is a different prerelease version
-    mock_path_exists.side_effect = [False, False, True, False]
-    assert _get_version_tags(version, file_name) == ["1.124.5-beta", "1.124-beta", "1-beta", "latest-beta"]
-    # case 2.2 The major version is not a prerelease version
-    mock_path_exists.side_effect = [False, False, True, True]
-    assert _get_version_tags(version, file_name) == ["1.124.5-beta", "1.124-beta", "1-beta"]
+    assert _get_tags({"2.0.0-alpha": files}) == ["1.124.5-beta", "1.124-beta", "1-beta", "latest-beta"]
+    # case 2.2 The major version has the same prerelease identifier
+    assert _get_tags({"2.0.0-beta": files}) == ["1.124.5-beta", "1.124-beta", "1-beta"]
     # case 3: The given version is the latest for patch and major but not for minor
-    # case 3.1 The minor version is a prerelease version (we need to mock path.exists for major
-    # version twice - one for the actual directory, one for the docker file)
-    mock_path_exists.side_effect = [False, True, False, True, True]
-    assert _get_version_tags(version, file_name) == ["1.124.5-beta", "1.124-beta", "1-beta"]
-    # case 3.2 The minor version is not a prerelease version
-    mock_path_exists.side_effect = [False, True, True]
-    assert _get_version_tags(version, file_name) == ["1.124.5-beta", "1.124-beta"]
+    # case 3.1 The minor version is a different prerelease version
+    assert _get_tags({"1.125.0-alpha": files, "2.0.0-beta": files}) == ["1.124.5-beta", "1.124-beta", "1-beta"]
+    # case 3.2 The minor version has the same prerelease identifier
+    assert _get_tags({"1.125.0-beta": files}) == ["1.124.5-beta", "1.124-beta"]
     # case 4: The given version is not the latest for patch, minor, major
-    # case 4.1 The patch version is a prerelease version (we need to mock path.exists for minor
-    # and major twice - one for the actual directory, one for the docker file)
-    mock_path_exists.side_effect = [True, False, True, True, True, True]
-    assert _get_version_tags(version, file_name) == ["1.124.5-beta", "1.124-beta"]
-    # case 4.2 The patch version is not a prerelease version
-    mock_path_exists.side_effect = [True, True]
-    assert _get_version_tags(version, file_name) == ["1.124.5-beta"]
+    # case 4.1 The patch version is a different prerelease version
+    assert _get_tags({"1.124.6-alpha": files, "1.125.0-beta": files}) == ["1.124.5-beta", "1.124-beta"]
+    # case 4.2 The patch version has the same prerelease identifier
+    assert _get_tags({"1.124.6-beta": files}) == ["1.124.5-beta"]
+    # case 5: Released versions don't affect the tags of pre-release versions
+    assert _get_tags({"1.124.6": files, "2.0.0": files}) == ["1.124.5-beta", "1.124-beta", "1-beta", "latest-beta"]
 
 
 def _test_push_images_upstream(mocker, repository):
@@ -625,6 +868,115 @@ def test_push_images_upstream_for_public_ecr_repository(mocker):
     _test_push_images_upstream(mocker, repository)
 
 
+def _mock_ecr_credentials(mocker):
+    def mock_boto3_client(client_name, region_name):
+        boto3_client = MagicMock()
+        authorization_data = {"authorizationToken": base64.b64encode("username:password".encode("ascii"))}
+        if client_name == "ecr":
+            # Private ECR client returns a list of authorizationData.
+            authorization_data = [authorization_data]
+        boto3_client.get_authorization_token.return_value = {"authorizationData": authorization_data}
+        return boto3_client
+
+    return mocker.patch("boto3.client", side_effect=mock_boto3_client)
+
+
+def test_push_images_upstream_aggregates_layer_progress(mocker, capsys):
+    _mock_ecr_credentials(mocker)
+    mock_docker_from_env = MagicMock(name="_docker_client")
+    mocker.patch("sagemaker_image_builder.main._docker_client", new=mock_docker_from_env)
+
+    def mock_push(repository, tag, **kwargs):
+        assert kwargs["stream"] and kwargs["decode"]
+        if tag != "1.0.0-cpu":
+            # The layers were already pushed along with the first tag.
+            return iter([{"status": "Layer already exists", "id": "layer1"}])
+        return iter(
+            [
+                {"status": "Preparing", "id": "layer1"},
+                {"status": "Pushing", "id": "layer1", "progressDetail": {"current": 512, "total": 2048}},
+                {"status": "Pushing", "id": "layer1", "progressDetail": {"current": 2048, "total": 2048}},
+                {"status": "Pushed", "id": "layer1"},
+                {"status": f"{tag}: digest: sha256:abc size: 123"},
+            ]
+        )
+
+    mock_docker_from_env.images.push.side_effect = mock_push
+    repositories = [
+        "aws_account_id.dkr.ecr.us-west-2.amazonaws.com/my-repository",
+        "public.ecr.aws/registry_alias/my-repository",
+    ]
+    _push_images_upstream(
+        [{"repository": r, "tag": t} for r in repositories for t in ["1.0.0-cpu", "1.0-cpu"]], "us-west-2"
+    )
+    assert mock_docker_from_env.images.push.call_count == 4
+    captured = capsys.readouterr()
+    for repository in repositories:
+        assert f"{repository}|1|0|2.00KB" in captured.out
+
+
+def test_push_images_upstream_retries_failed_pushes(mocker):
+    _mock_ecr_credentials(mocker)
+    mock_sleep = mocker.patch("time.sleep")
+    mock_docker_from_env = MagicMock(name="_docker_client")
+    mocker.patch("sagemaker_image_builder.main._docker_client", new=mock_docker_from_env)
+    repository = "aws_account_id.dkr.ecr.us-west-2.amazonaws.com/my-repository"
+    mock_docker_from_env.images.push.side_effect = [
+        iter([{"error": "net/http: TLS handshake timeout"}]),
+        Exception("Connection reset by peer"),
+        iter([{"status": "Pushed", "id": "layer1"}]),
+    ]
+    _push_images_upstream([{"repository": repository, "tag": "0.1"}], "us-west-2")
+    assert mock_docker_from_env.images.push.call_count == 3
+    assert [c.args[0] for c in mock_sleep.call_args_list] == [5, 10]
+    # Give up after the maximum number of attempts.
+    mock_docker_from_env.images.push.side_effect = Exception("Connection reset by peer")
+    with pytest.raises(Exception, match="Failed to push"):
+        _push_images_upstream([{"repository": repository, "tag": "0.1"}], "us-west-2")
+
+
+def test_push_images_upstream_with_registry_aware_push(mocker, local_registry):
+    _mock_ecr_credentials(mocker)
+    mock_docker_from_env = MagicMock(name="_docker_client")
+    mocker.patch("sagemaker_image_builder.main._docker_client", new=mock_docker_from_env)
+    # The cpu and the gpu image go to the same repository.
+    images = {}
+    manifests = {}
+    for image_type in ["cpu", "gpu"]:
+        images[image_type] = Mock()
+        images[image_type].id = f"sha256:img-{image_type}"
+        manifests[image_type] = json.dumps(
+            {"schemaVersion": 2, "config": {"digest": images[image_type].id}, "layers": []}
+        ).encode()
+    mock_docker_from_env.images.get.side_effect = lambda name: images[name.rsplit("-", 1)[1]]
+
+    def mock_push(repository, tag, **kwargs):
+        local_registry.put_manifest("my-repository", tag, manifests[tag.rsplit("-", 1)[1]])
+        return iter([{"status": "Pushed", "id": "layer1"}])
+
+    mock_docker_from_env.images.push.side_effect = mock_push
+    repository = f"{local_registry.host}/my-repository"
+    image_versions = [
+        {"repository": repository, "tag": f"{t}-{image_type}", "image_id": images[image_type].id}
+        for image_type in ["gpu", "cpu"]
+        for t in ["1.0.0", "1.0", "1", "latest"]
+    ]
+    _push_images_upstream(image_versions, "us-west-2", registry_aware_push=True)
+    # Every image is pushed once, all its other tags are applied through the registry API.
+    assert sorted(c.kwargs["tag"] for c in mock_docker_from_env.images.push.call_args_list) == [
+        "1.0.0-cpu",
+        "1.0.0-gpu",
+    ]
+    for image_type in ["cpu", "gpu"]:
+        for t in ["1.0", "1", "latest"]:
+            assert local_registry.manifests["my-repository"][f"{t}-{image_type}"][0] == manifests[image_type]
+    # Pushing the same images again doesn't push or upload anything.
+    local_registry.requests.clear()
+    _push_images_upstream(image_versions, "us-west-2", registry_aware_push=True)
+    assert mock_docker_from_env.images.push.call_count == 2
+    assert not [r for r in local_registry.requests if r[0] == "PUT"]
+
+
 @patch("os.path.exists")
 def test_get_build_config_for_image(mock_path_exists, tmp_path):
     input_version_dir = str(tmp_path) + "/v2.0.0"
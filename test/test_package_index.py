@@ -0,0 +1,212 @@
+from __future__ import absolute_import
+
+import hashlib
+
+import pytest
+
+pytestmark = pytest.mark.unit
+
+from sagemaker_image_builder.package_index import (
+    PackageIndex,
+    PackageVersions,
+    RepodataNotFoundError,
+    get_channel_url,
+)
+
+
+@pytest.fixture
+def package_index(local_channel):
+    for version, build_number in [("1.26.0", 0), ("1.24.2", 1), ("1.24.2", 0), ("2.1.0", 0), ("1.9.0", 0)]:
+        local_channel.add_package("numpy", version, build_number)
+    local_channel.add_package("ipykernel", "6.21.3", subdir="noarch")
+    return PackageIndex(channel_alias=local_channel.alias)
+
+
+def test_get_channel_url():
+    assert get_channel_url("conda-forge") == "https://conda.anaconda.org/conda-forge"
+    assert get_channel_url("conda-forge", "file:///tmp/channels/") == "file:///tmp/channels/conda-forge"
+    assert get_channel_url("file:///tmp/channel/") == "file:///tmp/channel"
+
+
+def test_get_records(package_index):
+    records = package_index.get_records("conda-forge", "linux-64", "numpy")
+    assert [(r["version"], r["build_number"]) for r in records] == [
+        ("1.9.0", 0),
+        ("1.24.2", 0),
+        ("1.24.2", 1),
+        ("1.26.0", 0),
+        ("2.1.0", 0),
+    ]
+    assert records[0]["fn"] == "numpy-1.9.0-h0000000_0.conda"
+    assert package_index.get_records("conda-forge", "linux-64", "ipykernel") == []
+    assert len(package_index.get_records("conda-forge", "noarch", "ipykernel")) == 1
+
+
+def test_get_record_by_file_name(package_index):
+    record = package_index.get_record_by_file_name("conda-forge", "linux-64", "numpy", "numpy-1.24.2-h0000001_1.conda")
+    assert (record["version"], record["build_number"]) == ("1.24.2", 1)
+    assert package_index.get_record_by_file_name("conda-forge", "linux-64", "numpy", "numpy-1.24.2-h0.conda") is None
+
+
+def test_get_versions(package_index):
+    assert package_index.get_versions("conda-forge", "linux-64", "numpy") == ["1.9.0", "1.24.2", "1.26.0", "2.1.0"]
+    assert package_index.get_versions("conda-forge", "linux-64", "numpy", min_version="1.24.2") == [
+        "1.24.2",
+        "1.26.0",
+        "2.1.0",
+    ]
+    assert package_index.get_versions("conda-forge", "linux-64", "scipy") == []
+
+
+def test_package_versions():
+    package_versions = PackageVersions(["1.10.2", "1.1.5", "2.0.0rc1", "1.1.0", "1.10.2", "1.9.0", "2.0.0", "1!0.1"])
+    assert package_versions.versions == ["1.1.0", "1.1.5", "1.9.0", "1.10.2", "2.0.0rc1", "2.0.0", "1!0.1"]
+    assert package_versions.get_versions("1.9.0") == ["1.9.0", "1.10.2", "2.0.0rc1", "2.0.0", "1!0.1"]
+    assert package_versions.get_latest_version() == "1!0.1"
+    assert package_versions.get_latest_version("1.1.0", 1) == "1.10.2"
+    # 1.10 isn't part of the 1.1 release line.
+    assert package_versions.get_latest_version("1.1.0", 1, 1) == "1.1.5"
+    assert package_versions.get_latest_version("1.9.0", 1, 9) == "1.9.0"
+    assert package_versions.get_latest_version("1.9.1", 1, 9) is None
+    assert package_versions.get_latest_version("2.0.0", 2, 0) == "2.0.0"
+    assert package_versions.get_latest_version(None, 3) is None
+
+
+def test_repodata_is_loaded_once_per_subdir(package_index, mocker):
+    load_repodata = mocker.spy(package_index, "_load_repodata")
+    for _ in range(3):
+        package_index.get_versions("conda-forge", "linux-64", "numpy")
+        package_index.get_versions("conda-forge", "linux-64", "scipy")
+        package_index.get_versions("conda-forge", "noarch", "ipykernel")
+    assert [c.args for c in load_repodata.call_args_list] == [("conda-forge", "linux-64"), ("conda-forge", "noarch")]
+
+
+def test_missing_repodata(package_index, mocker):
+    load_repodata = mocker.spy(package_index, "_load_repodata")
+    # The subdir is only looked up once.
+    for _ in range(2):
+        with pytest.raises(RepodataNotFoundError, match="There is no repodata"):
+            package_index.get_versions("conda-forge", "osx-arm64", "numpy")
+    assert load_repodata.call_count == 1
+
+
+def _get_repodata_json_requests(http_channel):
+    # Without zstandard, repodata.json.zst is never requested.
+    return [r for r in http_channel.requests if r[0].endswith("/repodata.json")]
+
+
+@pytest.fixture
+def http_channel(local_http_channel):
+    local_http_channel.add_package("numpy", "1.24.2")
+    return local_http_channel
+
+
+def test_repodata_cache_within_ttl(http_channel, tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    assert PackageIndex(http_channel.alias, cache_dir).get_versions("conda-forge", "linux-64", "numpy") == ["1.24.2"]
+    assert _get_repodata_json_requests(http_channel) == [("/conda-forge/linux-64/repodata.json", 200)]
+    request_count = len(http_channel.requests)
+    # The cached repodata is used as is, even though the channel changed.
+    http_channel.add_package("numpy", "1.26.0")
+    assert PackageIndex(http_channel.alias, cache_dir).get_versions("conda-forge", "linux-64", "numpy") == ["1.24.2"]
+    assert len(http_channel.requests) == request_count
+
+
+def test_repodata_cache_conditional_refresh(http_channel, tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    for _ in range(2):
+        package_index = PackageIndex(http_channel.alias, cache_dir, cache_ttl_seconds=0)
+        assert package_index.get_versions("conda-forge", "linux-64", "numpy") == ["1.24.2"]
+    http_channel.add_package("numpy", "1.26.0")
+    package_index = PackageIndex(http_channel.alias, cache_dir, cache_ttl_seconds=0)
+    assert package_index.get_versions("conda-forge", "linux-64", "numpy") == ["1.24.2", "1.26.0"]
+    assert [status for _, status in _get_repodata_json_requests(http_channel)] == [200, 304, 200]
+
+
+def test_repodata_cache_offline(http_channel, tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    with pytest.raises(Exception, match="can't be used offline"):
+        PackageIndex(http_channel.alias, cache_dir, offline=True).get_versions("conda-forge", "linux-64", "numpy")
+    PackageIndex(http_channel.alias, cache_dir).get_versions("conda-forge", "linux-64", "numpy")
+    request_count = len(http_channel.requests)
+    http_channel.add_package("numpy", "1.26.0")
+    package_index = PackageIndex(http_channel.alias, cache_dir, cache_ttl_seconds=0, offline=True)
+    assert package_index.get_versions("conda-forge", "linux-64", "numpy") == ["1.24.2"]
+    assert len(http_channel.requests) == request_count
+    with pytest.raises(Exception, match="cache dir is required"):
+        PackageIndex(http_channel.alias, offline=True)
+
+
+def test_package_names(package_index, mocker):
+    package_index = PackageIndex(package_index.channel_alias, package_names=["numpy"])
+    load_repodata = mocker.spy(package_index, "_load_repodata")
+    assert package_index.get_versions("conda-forge", "linux-64", "numpy") == ["1.9.0", "1.24.2", "1.26.0", "2.1.0"]
+    assert set(package_index._records[("conda-forge", "linux-64")]) == {"numpy"}
+    # Other packages are still found, at the cost of loading the repodata again.
+    assert package_index.get_versions("conda-forge", "noarch", "ipykernel") == ["6.21.3"]
+    assert package_index.get_versions("conda-forge", "linux-64", "numpy") == ["1.9.0", "1.24.2", "1.26.0", "2.1.0"]
+    assert load_repodata.call_count == 3
+
+
+def test_zstd_repodata(local_channel):
+    zstandard = pytest.importorskip("zstandard")
+    local_channel.add_package("numpy", "1.24.2")
+    repodata_file_path = local_channel.channels_dir / "conda-forge" / "linux-64" / "repodata.json"
+    (repodata_file_path.parent / "repodata.json.zst").write_bytes(
+        zstandard.ZstdCompressor().compress(repodata_file_path.read_bytes())
+    )
+    repodata_file_path.unlink()
+    package_index = PackageIndex(channel_alias=local_channel.alias)
+    assert package_index.get_versions("conda-forge", "linux-64", "numpy") == ["1.24.2"]
+
+
+@pytest.fixture
+def sharded_http_channel(local_http_channel):
+    pytest.importorskip("msgpack")
+    pytest.importorskip("zstandard")
+    local_http_channel.sharded = True
+    for version in ["1.24.2", "1.26.0"]:
+        local_http_channel.add_package("numpy", version)
+    local_http_channel.add_package("scipy", "1.10.1")
+    return local_http_channel
+
+
+def test_sharded_repodata(sharded_http_channel, tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    package_index = PackageIndex(sharded_http_channel.alias, cache_dir, package_names=["numpy", "pandas"])
+    records = package_index.get_records("conda-forge", "linux-64", "numpy")
+    assert [r["version"] for r in records] == ["1.24.2", "1.26.0"]
+    # Hashes are hex strings, as in repodata.json.
+    assert records[0]["sha256"] == hashlib.sha256(records[0]["fn"].encode()).hexdigest()
+    assert package_index.get_records("conda-forge", "linux-64", "pandas") == []
+    # Only the shard of numpy was fetched, and repodata.json was never needed.
+    requested_paths = [path for path, _ in sharded_http_channel.requests]
+    assert requested_paths[0] == "/conda-forge/linux-64/repodata_shards.msgpack.zst"
+    assert len(requested_paths) == 2 and requested_paths[1].startswith("/conda-forge/linux-64/shards/")
+
+    # Cached shards are reused, even once the shards index has to be refreshed.
+    package_index = PackageIndex(sharded_http_channel.alias, cache_dir, cache_ttl_seconds=0, package_names=["numpy"])
+    assert [r["version"] for r in package_index.get_records("conda-forge", "linux-64", "numpy")] == ["1.24.2", "1.26.0"]
+    assert sharded_http_channel.requests[2:] == [("/conda-forge/linux-64/repodata_shards.msgpack.zst", 304)]
+    package_index = PackageIndex(sharded_http_channel.alias, cache_dir, offline=True, package_names=["numpy"])
+    assert len(package_index.get_records("conda-forge", "linux-64", "numpy")) == 2
+    assert len(sharded_http_channel.requests) == 3
+
+
+def test_sharded_repodata_updated_shard(sharded_http_channel, tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    PackageIndex(sharded_http_channel.alias, cache_dir, package_names=["numpy"]).get_records(
+        "conda-forge", "linux-64", "numpy"
+    )
+    sharded_http_channel.add_package("numpy", "2.1.0")
+    package_index = PackageIndex(sharded_http_channel.alias, cache_dir, cache_ttl_seconds=0, package_names=["numpy"])
+    assert package_index.get_versions("conda-forge", "linux-64", "numpy") == ["1.24.2", "1.26.0", "2.1.0"]
+
+
+def test_sharded_repodata_not_offered(local_http_channel, tmp_path):
+    pytest.importorskip("msgpack")
+    local_http_channel.add_package("numpy", "1.24.2")
+    package_index = PackageIndex(local_http_channel.alias, str(tmp_path / "cache"), package_names=["numpy"])
+    assert package_index.get_versions("conda-forge", "linux-64", "numpy") == ["1.24.2"]
+    assert ("/conda-forge/linux-64/repodata_shards.msgpack.zst", 404) in local_http_channel.requests
+    assert ("/conda-forge/linux-64/repodata.json", 200) in local_http_channel.requests
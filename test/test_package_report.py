@@ -1,18 +1,30 @@
 from __future__ import absolute_import
 
 import json
+import shutil
 
 import pytest
 
 pytestmark = pytest.mark.unit
 
-from unittest.mock import patch
+from unittest.mock import MagicMock, patch
 
+from sagemaker_image_builder.env_parser import EnvRecord
+from sagemaker_image_builder.package_index import PackageIndex
 from sagemaker_image_builder.package_report import (
     _generate_python_package_size_report_per_image,
     _get_installed_package_versions_and_conda_versions,
+    _get_package_versions_in_upstream,
+    generate_download_delta_report,
+    generate_image_layer_report,
+    generate_package_size_report,
+)
+from sagemaker_image_builder.query_executor import QueryExecutor
+from sagemaker_image_builder.utils import (
+    get_match_specs,
+    get_semver,
+    pull_conda_package_metadata,
 )
-from sagemaker_image_builder.utils import get_match_specs, get_semver
 
 with open("test/test_image_config.json") as jsonfile:
     _image_generator_configs = json.load(jsonfile)
@@ -72,13 +84,11 @@ def test_get_match_specs(tmp_path):
     assert len(match_spec_out) == 0
 
 
-@patch("conda.cli.python_api.run_command")
-def test_get_installed_package_versions_and_conda_versions(mock_run_command, tmp_path):
-    mock_run_command.return_value = (
+@patch("sagemaker_image_builder.package_report.run_conda_search")
+def test_get_installed_package_versions_and_conda_versions(mock_run_conda_search, tmp_path):
+    mock_run_conda_search.return_value = json.loads(
         '{"ipykernel":[{"version": "6.21.3"}], "numpy":[{"version": '
-        '"1.24.3"},{"version":"1.26.0"},{"version":"2.1.0"}]}',
-        "",
-        0,
+        '"1.24.3"},{"version":"1.26.0"},{"version":"2.1.0"}]}'
     )
     env_in_file_path = tmp_path / "cpu.env.in"
     _create_env_in_docker_file(env_in_file_path)
@@ -86,39 +96,282 @@ def test_get_installed_package_versions_and_conda_versions(mock_run_command, tmp
     _create_env_out_docker_file(env_out_file_path)
     # Validate results for patch version release
     # _image_generator_configs[1] is for CPU
-    match_spec_out, latest_package_versions_in_conda_forge = _get_installed_package_versions_and_conda_versions(
+    env_records_out, latest_package_versions_in_conda_forge = _get_installed_package_versions_and_conda_versions(
         _image_generator_configs[1], str(tmp_path), get_semver("0.4.2")
     )
-    ipykernel_match_spec = match_spec_out["ipykernel"]
-    assert str(ipykernel_match_spec.get("version")).removeprefix("==") == "6.21.3"
-    numpy_match_spec = match_spec_out["numpy"]
-    assert str(numpy_match_spec.get("version")).removeprefix("==") == "1.24.2"
+    assert env_records_out["ipykernel"].version == "6.21.3"
+    assert env_records_out["numpy"].version == "1.24.2"
     assert latest_package_versions_in_conda_forge["ipykernel"] == "6.21.3"
     assert latest_package_versions_in_conda_forge["numpy"] == "1.24.3"
     # Validate results for minor version release
-    match_spec_out, latest_package_versions_in_conda_forge = _get_installed_package_versions_and_conda_versions(
+    env_records_out, latest_package_versions_in_conda_forge = _get_installed_package_versions_and_conda_versions(
         _image_generator_configs[1], str(tmp_path), get_semver("0.5.0")
     )
-    ipykernel_match_spec = match_spec_out["ipykernel"]
-    assert str(ipykernel_match_spec.get("version")).removeprefix("==") == "6.21.3"
-    numpy_match_spec = match_spec_out["numpy"]
-    assert str(numpy_match_spec.get("version")).removeprefix("==") == "1.24.2"
+    assert env_records_out["ipykernel"].version == "6.21.3"
+    assert env_records_out["numpy"].version == "1.24.2"
     assert latest_package_versions_in_conda_forge["ipykernel"] == "6.21.3"
     # Only for numpy there is a new minor version available.
     assert latest_package_versions_in_conda_forge["numpy"] == "1.26.0"
     # Validate results for major version release
-    match_spec_out, latest_package_versions_in_conda_forge = _get_installed_package_versions_and_conda_versions(
+    env_records_out, latest_package_versions_in_conda_forge = _get_installed_package_versions_and_conda_versions(
         _image_generator_configs[1], str(tmp_path), get_semver("1.0.0")
     )
-    ipykernel_match_spec = match_spec_out["ipykernel"]
-    assert str(ipykernel_match_spec.get("version")).removeprefix("==") == "6.21.3"
-    numpy_match_spec = match_spec_out["numpy"]
-    assert str(numpy_match_spec.get("version")).removeprefix("==") == "1.24.2"
+    assert env_records_out["ipykernel"].version == "6.21.3"
+    assert env_records_out["numpy"].version == "1.24.2"
     assert latest_package_versions_in_conda_forge["ipykernel"] == "6.21.3"
     # Only for numpy there is a new major version available.
     assert latest_package_versions_in_conda_forge["numpy"] == "2.1.0"
 
 
+@patch("sagemaker_image_builder.package_report.run_conda_search")
+def test_conda_searches_are_shared_between_images(mock_run_conda_search, tmp_path):
+    mock_run_conda_search.return_value = {"ipykernel": [{"version": "6.21.3"}], "numpy": [{"version": "1.24.3"}]}
+    _create_env_in_docker_file(tmp_path / "cpu.env.in")
+    _create_env_out_docker_file(tmp_path / "cpu.env.out")
+    with QueryExecutor(max_queries_per_second_per_host=None) as query_executor:
+        for _ in range(2):
+            # _image_generator_configs[1] is for CPU
+            _, latest_package_versions_in_conda_forge = _get_installed_package_versions_and_conda_versions(
+                _image_generator_configs[1], str(tmp_path), get_semver("0.4.2"), query_executor=query_executor
+            )
+            assert latest_package_versions_in_conda_forge == {"ipykernel": "6.21.3", "numpy": "1.24.3"}
+    assert sorted(c.args[0] for c in mock_run_conda_search.call_args_list) == [
+        "conda-forge::ipykernel>=6.21.3[subdir=noarch]",
+        "conda-forge::numpy>=1.24.2[subdir=linux-64]",
+    ]
+
+
+@patch("sagemaker_image_builder.package_report.run_conda_search")
+def test_get_installed_package_versions_and_conda_versions_from_package_index(
+    mock_run_conda_search, local_channel, tmp_path
+):
+    local_channel.add_package("ipykernel", "6.21.3", subdir="noarch")
+    for version in ["1.24.1", "1.24.2", "1.24.3", "1.26.0", "2.1.0"]:
+        local_channel.add_package("numpy", version)
+    package_index = PackageIndex(channel_alias=local_channel.alias)
+    _create_env_in_docker_file(tmp_path / "cpu.env.in")
+    _create_env_out_docker_file(tmp_path / "cpu.env.out")
+    # _image_generator_configs[1] is for CPU
+    for target_version, expected_numpy_version in [("0.4.2", "1.24.3"), ("0.5.0", "1.26.0"), ("1.0.0", "2.1.0")]:
+        _, latest_package_versions_in_conda_forge = _get_installed_package_versions_and_conda_versions(
+            _image_generator_configs[1], str(tmp_path), get_semver(target_version), package_index
+        )
+        assert latest_package_versions_in_conda_forge == {"ipykernel": "6.21.3", "numpy": expected_numpy_version}
+    mock_run_conda_search.assert_not_called()
+
+
+@patch("sagemaker_image_builder.package_report.run_conda_search")
+def test_get_installed_package_versions_and_conda_versions_without_repodata(
+    mock_run_conda_search, local_channel, tmp_path
+):
+    # The channel has no noarch repodata, so ipykernel is looked up with `conda search` instead.
+    local_channel.add_package("numpy", "1.24.3")
+    mock_run_conda_search.return_value = {"ipykernel": [{"version": "6.21.3"}, {"version": "6.21.4"}]}
+    package_index = PackageIndex(channel_alias=local_channel.alias)
+    _create_env_in_docker_file(tmp_path / "cpu.env.in")
+    _create_env_out_docker_file(tmp_path / "cpu.env.out")
+    # _image_generator_configs[1] is for CPU
+    _, latest_package_versions_in_conda_forge = _get_installed_package_versions_and_conda_versions(
+        _image_generator_configs[1], str(tmp_path), get_semver("0.4.2"), package_index
+    )
+    assert latest_package_versions_in_conda_forge == {"ipykernel": "6.21.4", "numpy": "1.24.3"}
+    mock_run_conda_search.assert_called_once_with("conda-forge::ipykernel>=6.21.3[subdir=noarch]")
+
+
+def test_get_package_versions_in_upstream_release_lines(local_channel, tmp_path):
+    for version in ["1.1.0", "1.1.5", "1.10.2", "1.9.0", "2.0.0"]:
+        local_channel.add_package("numpy", version)
+    package_index = PackageIndex(channel_alias=local_channel.alias)
+    records_out = {"numpy": EnvRecord("numpy", channel="conda-forge", subdir="linux-64", version="1.1.0")}
+    for target_version, expected_numpy_version in [("0.4.2", "1.1.5"), ("0.5.0", "1.10.2"), ("1.0.0", "2.0.0")]:
+        assert _get_package_versions_in_upstream(records_out, get_semver(target_version), package_index) == {
+            "numpy": expected_numpy_version
+        }
+
+
+def test_pull_conda_package_metadata_from_package_index(local_channel, tmp_path):
+    local_channel.add_package("ipykernel", "6.21.3", subdir="noarch", build="pyh210e3f2_0", size=111)
+    local_channel.add_package("ipykernel", "6.21.3", subdir="noarch", build="pyh210e3f2_1", size=112)
+    local_channel.add_package("numpy", "1.24.2", build="py38h10c12cc_0", size=7000)
+    local_channel.add_package("numpy", "1.24.3", build="py38h10c12cc_0", size=7001)
+    _create_env_out_docker_file(tmp_path / "cpu.env.out")
+    package_index = PackageIndex(channel_alias=local_channel.alias)
+    # _image_generator_configs[1] is for CPU
+    assert pull_conda_package_metadata(_image_generator_configs[1], str(tmp_path), package_index) == {
+        "numpy": {"version": "1.24.2", "size": 7000},
+        "ipykernel": {"version": "6.21.3", "size": 111},
+    }
+
+
+@patch("sagemaker_image_builder.utils.run_conda_search")
+def test_pull_conda_package_metadata_without_repodata(mock_run_conda_search, local_channel, tmp_path):
+    # The channel has no noarch repodata, so ipykernel is looked up with `conda search` instead.
+    local_channel.add_package("numpy", "1.24.2", build="py38h10c12cc_0", size=7000)
+    mock_run_conda_search.return_value = {"ipykernel": [{"version": "6.21.3", "size": 111}]}
+    _create_env_out_docker_file(tmp_path / "cpu.env.out")
+    package_index = PackageIndex(channel_alias=local_channel.alias)
+    # _image_generator_configs[1] is for CPU
+    assert pull_conda_package_metadata(_image_generator_configs[1], str(tmp_path), package_index) == {
+        "numpy": {"version": "1.24.2", "size": 7000},
+        "ipykernel": {"version": "6.21.3", "size": 111},
+    }
+    mock_run_conda_search.assert_called_once_with("conda-forge/noarch::ipykernel==6.21.3=pyh210e3f2_0")
+
+
+class SizeReportArgs:
+    def __init__(
+        self,
+        image_config_file,
+        target_patch_version,
+        channel_alias,
+        repodata_cache_dir,
+        offline=False,
+        metric="archive",
+    ):
+        self.image_config_file = image_config_file
+        self.target_patch_version = target_patch_version
+        self.channel_alias = channel_alias
+        self.repodata_cache_dir = repodata_cache_dir
+        self.repodata_cache_ttl = 3600
+        self.offline = offline
+        self.max_concurrent_queries = 4
+        self.max_queries_per_second = 10
+        self.metric = metric
+        self.validate = False
+
+
+def test_generate_package_size_report_from_package_index(capsys, local_channel, tmp_path, monkeypatch):
+    local_channel.add_package("ipykernel", "6.21.3", subdir="noarch", build="pyh210e3f2_0", size=2 * 1024**2)
+    local_channel.add_package("numpy", "1.24.1", build="py38h10c12cc_0", size=6 * 1024**2)
+    local_channel.add_package("numpy", "1.24.2", build="py38h10c12cc_0", size=7 * 1024**2)
+    for version, numpy_version in [("1.0.0", "1.24.1"), ("1.0.1", "1.24.2")]:
+        version_dir = tmp_path / "build_artifacts" / "v1" / "v1.0" / f"v{version}"
+        version_dir.mkdir(parents=True)
+        (version_dir / "Dockerfile").write_text("")
+        _create_env_out_docker_file(version_dir / "cpu.env.out")
+        env_out = (version_dir / "cpu.env.out").read_text()
+        (version_dir / "cpu.env.out").write_text(env_out.replace("numpy-1.24.2", f"numpy-{numpy_version}"))
+    (tmp_path / "build_artifacts" / "v1" / "v1.0" / "v1.0.1" / "source-version.txt").write_text("1.0.0")
+    image_config_file = tmp_path / "image_config.json"
+    # _image_generator_configs[1] is for CPU
+    image_config_file.write_text(json.dumps([_image_generator_configs[1]]))
+    monkeypatch.chdir(tmp_path)
+    cache_dir = str(tmp_path / "cache")
+
+    generate_package_size_report(SizeReportArgs(image_config_file, "1.0.1", local_channel.alias, cache_dir))
+    captured = capsys.readouterr()
+    assert "9.00MB|8.00MB|1.00MB|12.5" in captured.out
+    assert "numpy|1.24.2|1.24.1|1.00MB|16.67" in captured.out
+    # The second run is served from the cache alone.
+    shutil.rmtree(local_channel.channels_dir)
+    generate_package_size_report(SizeReportArgs(image_config_file, "1.0.1", local_channel.alias, cache_dir, True))
+    assert capsys.readouterr().out == captured.out
+
+
+def test_generate_package_size_report_from_package_metadata_files(capsys, local_channel, tmp_path, monkeypatch):
+    # Only the base version was built before the package metadata was captured at build time.
+    local_channel.add_package("ipykernel", "6.21.3", subdir="noarch", build="pyh210e3f2_0", size=2 * 1024**2)
+    local_channel.add_package("numpy", "1.24.1", build="py38h10c12cc_0", size=6 * 1024**2)
+    local_channel.add_package("numpy", "1.24.2", build="py38h10c12cc_0", size=7 * 1024**2)
+    for version, numpy_version in [("1.0.0", "1.24.1"), ("1.0.1", "1.24.2")]:
+        version_dir = tmp_path / "build_artifacts" / "v1" / "v1.0" / f"v{version}"
+        version_dir.mkdir(parents=True)
+        (version_dir / "Dockerfile").write_text("")
+        _create_env_out_docker_file(version_dir / "cpu.env.out")
+        env_out = (version_dir / "cpu.env.out").read_text()
+        (version_dir / "cpu.env.out").write_text(env_out.replace("numpy-1.24.2", f"numpy-{numpy_version}"))
+    target_version_dir = tmp_path / "build_artifacts" / "v1" / "v1.0" / "v1.0.1"
+    (target_version_dir / "source-version.txt").write_text("1.0.0")
+    (target_version_dir / "cpu.pkg_metadata.json").write_text(
+        json.dumps(
+            {
+                "numpy": {"version": "1.24.2", "size": 7 * 1024**2},
+                "ipykernel": {"version": "6.21.3", "size": 2 * 1024**2},
+                "libzlib": {"version": "1.2.13", "size": 1024**2},
+            }
+        )
+    )
+    image_config_file = tmp_path / "image_config.json"
+    # _image_generator_configs[1] is for CPU
+    image_config_file.write_text(json.dumps([_image_generator_configs[1]]))
+    monkeypatch.chdir(tmp_path)
+    cache_dir = str(tmp_path / "cache")
+
+    generate_package_size_report(SizeReportArgs(image_config_file, "1.0.1", local_channel.alias, cache_dir))
+    captured = capsys.readouterr()
+    # Both versions are looked up in the channels, so that they're compared on the same packages. libzlib, which only
+    # the package metadata file of the target version lists, isn't reported as a new package.
+    assert "9.00MB|8.00MB|1.00MB|12.5" in captured.out
+    assert "numpy|1.24.2|1.24.1|1.00MB|16.67" in captured.out
+    assert "libzlib" not in captured.out
+    # With the package metadata of both versions, the report needs neither the channel nor the repodata cache.
+    base_version_dir = tmp_path / "build_artifacts" / "v1" / "v1.0" / "v1.0.0"
+    (base_version_dir / "cpu.pkg_metadata.json").write_text(
+        json.dumps(
+            {
+                "numpy": {"version": "1.24.1", "size": 6 * 1024**2},
+                "ipykernel": {"version": "6.21.3", "size": 2 * 1024**2},
+            }
+        )
+    )
+    shutil.rmtree(local_channel.channels_dir)
+    shutil.rmtree(cache_dir)
+    generate_package_size_report(SizeReportArgs(image_config_file, "1.0.1", local_channel.alias, cache_dir, True))
+    captured = capsys.readouterr()
+    assert "10.00MB|8.00MB|2.00MB|25.0" in captured.out
+    assert "numpy|1.24.2|1.24.1|1.00MB|16.67" in captured.out
+    assert "libzlib|1.2.13|-|1.00MB|-" in captured.out
+
+
+def test_generate_package_size_report_with_installed_sizes(capsys, tmp_path, monkeypatch):
+    numpy_installed_sizes = {"1.24.1": 30 * 1024**2, "1.24.2": 32 * 1024**2}
+    for version, numpy_version in [("1.0.0", "1.24.1"), ("1.0.1", "1.24.2")]:
+        version_dir = tmp_path / "build_artifacts" / "v1" / "v1.0" / f"v{version}"
+        version_dir.mkdir(parents=True)
+        (version_dir / "Dockerfile").write_text("")
+        _create_env_out_docker_file(version_dir / "cpu.env.out")
+        pkg_metadata = {
+            "numpy": {
+                "version": numpy_version,
+                "size": 7 * 1024**2,
+                "installed_size": numpy_installed_sizes[numpy_version],
+            },
+            "ipykernel": {"version": "6.21.3", "size": 2 * 1024**2, "installed_size": 8 * 1024**2},
+        }
+        (version_dir / "cpu.pkg_metadata.json").write_text(json.dumps(pkg_metadata))
+    target_version_dir = tmp_path / "build_artifacts" / "v1" / "v1.0" / "v1.0.1"
+    (target_version_dir / "source-version.txt").write_text("1.0.0")
+    image_config_file = tmp_path / "image_config.json"
+    # _image_generator_configs[1] is for CPU
+    image_config_file.write_text(json.dumps([_image_generator_configs[1]]))
+    monkeypatch.chdir(tmp_path)
+    cache_dir = str(tmp_path / "cache")
+
+    generate_package_size_report(
+        SizeReportArgs(image_config_file, "1.0.1", "file:///nonexistent", cache_dir, metric="installed")
+    )
+    captured = capsys.readouterr()
+    assert "40.00MB|38.00MB|2.00MB|5.26" in captured.out
+    assert "numpy|1.24.2|1.24.1|2.00MB|6.67" in captured.out
+    assert "numpy|1.24.2|32.00MB" in captured.out
+    # A base version which was built before the package metadata was captured only gives partial results.
+    (tmp_path / "build_artifacts" / "v1" / "v1.0" / "v1.0.0" / "cpu.pkg_metadata.json").unlink()
+    generate_package_size_report(
+        SizeReportArgs(image_config_file, "1.0.1", "file:///nonexistent", cache_dir, metric="installed")
+    )
+    captured = capsys.readouterr()
+    assert "installed size of the packages in" in captured.out and "v1.0.0 is unknown" in captured.out
+    assert "only partial results will be shown" in captured.out
+    assert "40.00MB|-|-|-" in captured.out
+    assert "Python Package Size Delta" not in captured.out
+    # Package metadata which was looked up in the channels only has the sizes of the package archives.
+    (target_version_dir / "cpu.pkg_metadata.json").unlink()
+    with pytest.raises(Exception, match="installed size of the packages in .*v1.0.1 is unknown"):
+        generate_package_size_report(
+            SizeReportArgs(image_config_file, "1.0.1", "file:///nonexistent", cache_dir, metric="installed")
+        )
+
+
 def test_generate_package_size_report(capsys, tmp_path):
     base_pkg_metadata = _create_base_image_package_metadata()
     target_pkg_metadata = _create_target_image_package_metadata()
@@ -170,3 +423,130 @@ def test_generate_package_size_report_when_base_version_is_not_present(capsys, t
     assert "python|3.12.2|30.82MB" in captured.out
     assert "libclang|18.1.2|18.38MB" in captured.out
     assert "tqdm|4.66.2|87.47KB" in captured.out
+
+
+def _create_docker_client_with_saved_images(saved_images):
+    from docker.errors import ImageNotFound
+
+    def get_image(name):
+        if name not in saved_images:
+            raise ImageNotFound(name)
+        image = MagicMock()
+        image.save.return_value = iter([saved_images[name].save()])
+        return image
+
+    docker_client = MagicMock()
+    docker_client.images.get.side_effect = get_image
+    return docker_client
+
+
+def test_generate_image_layer_report(capsys, mocker, saved_image_factory, tmp_path, monkeypatch):
+    for version in ["1.6.1", "1.6.2"]:
+        version_dir = tmp_path / "build_artifacts" / "v1" / "v1.6" / f"v{version}"
+        version_dir.mkdir(parents=True)
+        (version_dir / "Dockerfile").write_text("")
+    (tmp_path / "build_artifacts" / "v1" / "v1.6" / "v1.6.2" / "source-version.txt").write_text("1.6.1")
+    image_config_file = tmp_path / "image_config.json"
+    # _image_generator_configs[1] is for CPU
+    image_config_file.write_text(json.dumps([_image_generator_configs[1]]))
+    monkeypatch.chdir(tmp_path)
+    saved_images = {}
+    for version, numpy_version, numpy_size in [("1.6.1", "1.24.1", 6 * 1024**2), ("1.6.2", "1.24.2", 7 * 1024**2)]:
+        saved_image = saved_image_factory()
+        saved_image.add_layer({"etc/os-release": b"NAME=Ubuntu\n"}, "ADD rootfs /")
+        saved_image.add_conda_packages(
+            {
+                "numpy": (numpy_version, {"lib/libnumpy.so": bytes(numpy_size)}),
+                "ipykernel": ("6.21.3", {"lib/ipykernel.py": bytes(1024**2)}),
+            }
+        )
+        saved_images[f"localhost/sagemaker-distribution:{version}-cpu"] = saved_image
+    docker_client = _create_docker_client_with_saved_images(saved_images)
+    mocker.patch("docker.from_env", return_value=docker_client)
+    args = MagicMock(image_config_file=image_config_file, target_patch_version="1.6.2")
+
+    generate_image_layer_report(args)
+    captured = capsys.readouterr()
+    assert "# Image Layer Size Report (CPU)" in captured.out
+    assert "Target Image Version: 1.6.2 | Base Image Version: 1.6.1" in captured.out
+    assert "|ADD rootfs /|" in captured.out
+    assert "numpy|1.24.2|7.00MB" in captured.out
+    assert "numpy|1.24.2|1.24.1|1.00MB|16.67" in captured.out
+    assert "ipykernel|6.21.3|6.21.3" not in captured.out
+    # The base image doesn't have to exist locally.
+    del saved_images["localhost/sagemaker-distribution:1.6.1-cpu"]
+    generate_image_layer_report(args)
+    captured = capsys.readouterr()
+    assert "WARNING: The base image isn't available locally" in captured.out
+    assert "numpy|1.24.2|7.00MB" in captured.out
+    # The target image does.
+    del saved_images["localhost/sagemaker-distribution:1.6.2-cpu"]
+    with pytest.raises(Exception, match="1.6.2-cpu doesn't exist"):
+        generate_image_layer_report(args)
+
+
+def _put_image_manifest(local_registry, tag, layer_sizes):
+    # layer_sizes: {layer digest: compressed size}
+    manifest = {
+        "schemaVersion": 2,
+        "mediaType": "application/vnd.docker.distribution.manifest.v2+json",
+        "config": {
+            "mediaType": "application/vnd.docker.container.image.v1+json",
+            "digest": f"sha256:config-{tag}",
+            "size": 1024,
+        },
+        "layers": [
+            {"mediaType": "application/vnd.docker.image.rootfs.diff.tar.gzip", "digest": digest, "size": size}
+            for digest, size in layer_sizes.items()
+        ],
+    }
+    local_registry.put_manifest("my-repository", tag, json.dumps(manifest).encode())
+
+
+class DownloadDeltaReportArgs:
+    def __init__(self, image_config_file, target_patch_version, repository, max_delta=None):
+        self.image_config_file = image_config_file
+        self.target_patch_version = target_patch_version
+        self.repository = repository
+        self.region = None
+        self.ecr_credentials_cache_file = None
+        self.max_delta = max_delta
+
+
+def test_generate_download_delta_report(capsys, local_registry, tmp_path, monkeypatch):
+    for version in ["1.3.2", "1.3.3"]:
+        version_dir = tmp_path / "build_artifacts" / "v1" / "v1.3" / f"v{version}"
+        version_dir.mkdir(parents=True)
+        (version_dir / "Dockerfile").write_text("")
+    (tmp_path / "build_artifacts" / "v1" / "v1.3" / "v1.3.3" / "source-version.txt").write_text("1.3.2")
+    image_config_file = tmp_path / "image_config.json"
+    # _image_generator_configs[1] is for CPU
+    image_config_file.write_text(json.dumps([_image_generator_configs[1]]))
+    monkeypatch.chdir(tmp_path)
+    _put_image_manifest(
+        local_registry, "1.3.2-cpu", {"sha256:ubuntu": 30 * 1024**2, "sha256:conda-1": 2 * 1024**3, "sha256:etc": 1024}
+    )
+    # Only the conda environment changed.
+    _put_image_manifest(
+        local_registry,
+        "1.3.3-cpu",
+        {"sha256:ubuntu": 30 * 1024**2, "sha256:conda-2": 2 * 1024**3 + 1024**2, "sha256:etc": 1024},
+    )
+    repository = f"{local_registry.host}/my-repository"
+
+    generate_download_delta_report(DownloadDeltaReportArgs(image_config_file, "1.3.3", repository))
+    captured = capsys.readouterr()
+    assert "Target Image Version: 1.3.3 | Base Image Version: 1.3.2" in captured.out
+    # 1 new layer and the image config
+    assert "1/3|2.00GB|2.03GB|98.56" in captured.out
+    assert "sha256:conda-2|2.00GB" in captured.out
+    assert "sha256:ubuntu" not in captured.out
+
+    generate_download_delta_report(DownloadDeltaReportArgs(image_config_file, "1.3.3", repository, 3 * 1024**3))
+    assert "Download Delta Validation Passed!" in capsys.readouterr().out
+    with pytest.raises(Exception, match="Download Delta Validation Failed!.*requires pulling 2.00GB"):
+        generate_download_delta_report(DownloadDeltaReportArgs(image_config_file, "1.3.3", repository, 1024**3))
+    # Without the base image, the whole target image has to be pulled.
+    del local_registry.manifests["my-repository"]["1.3.2-cpu"]
+    generate_download_delta_report(DownloadDeltaReportArgs(image_config_file, "1.3.3", repository))
+    assert "3/3|2.03GB|2.03GB|100.0" in capsys.readouterr().out
@@ -0,0 +1,66 @@
+from __future__ import absolute_import
+
+import threading
+import time
+
+import pytest
+
+pytestmark = pytest.mark.unit
+
+from sagemaker_image_builder.query_executor import QueryExecutor
+
+
+def test_submit_deduplicates_queries(mocker):
+    query = mocker.Mock(side_effect=lambda package, version: f"{package}=={version}")
+    with QueryExecutor() as query_executor:
+        futures = [query_executor.submit(("numpy", "1.26.0"), query, "numpy", "1.26.0") for _ in range(5)]
+        other_future = query_executor.submit(("numpy", "2.1.0"), query, "numpy", "2.1.0")
+        assert [f.result() for f in futures] == ["numpy==1.26.0"] * 5
+        assert other_future.result() == "numpy==2.1.0"
+    assert query.call_count == 2
+
+
+def test_submit_runs_queries_concurrently():
+    lock = threading.Lock()
+    running = []
+    max_running = []
+
+    def query(i):
+        with lock:
+            running.append(i)
+            max_running.append(len(running))
+        time.sleep(0.05)
+        with lock:
+            running.remove(i)
+        return i
+
+    with QueryExecutor(max_workers=4) as query_executor:
+        futures = [query_executor.submit(i, query, i) for i in range(12)]
+        assert [f.result() for f in futures] == list(range(12))
+    assert max(max_running) == 4
+
+
+def test_submit_rate_limits_queries_per_host():
+    start_times = {"a": [], "b": []}
+
+    def query(host):
+        start_times[host].append(time.monotonic())
+
+    start = time.monotonic()
+    with QueryExecutor(max_workers=8, max_queries_per_second_per_host=10) as query_executor:
+        for i in range(3):
+            query_executor.submit(("a", i), query, "a", host="a.example.com")
+            query_executor.submit(("b", i), query, "b", host="b.example.com")
+    # The queries against a host start 100ms apart, while the hosts don't wait for each other.
+    for host_start_times in start_times.values():
+        assert max(host_start_times) - start >= 0.2
+    assert time.monotonic() - start < 0.4
+
+
+def test_submit_propagates_errors():
+    def query():
+        raise Exception("conda search failed")
+
+    with QueryExecutor() as query_executor:
+        with pytest.raises(Exception, match="conda search failed"):
+            query_executor.submit("query", query).result()
@@ -0,0 +1,148 @@
+from __future__ import absolute_import
+
+import base64
+import datetime
+import hashlib
+import json
+import os
+import stat
+
+import pytest
+
+pytestmark = pytest.mark.unit
+
+from unittest.mock import MagicMock
+
+from moto import mock_aws
+
+from sagemaker_image_builder.registry import (
+    _ecr_clients,
+    _ecr_credentials_cache,
+    get_ecr_credentials,
+    get_image_manifest,
+    get_manifest,
+    get_manifest_config_digest,
+    put_manifest,
+)
+
+_PRIVATE_REPOSITORY = "aws_account_id.dkr.ecr.us-west-2.amazonaws.com/my-repository"
+_PUBLIC_REPOSITORY = "public.ecr.aws/registry_alias/my-repository"
+
+
+@pytest.fixture(autouse=True)
+def clear_ecr_credentials_cache():
+    _ecr_clients.clear()
+    _ecr_credentials_cache.clear()
+
+
+def _mock_boto3_client(mocker, expires_in=datetime.timedelta(hours=12)):
+    boto3_client = MagicMock()
+    boto3_mocker = mocker.patch("boto3.client", return_value=boto3_client)
+    authorization_data = {
+        "authorizationToken": base64.b64encode("AWS:password".encode("ascii")),
+        "expiresAt": datetime.datetime.now(datetime.timezone.utc) + expires_in,
+    }
+    boto3_client.get_authorization_token.return_value = {"authorizationData": [authorization_data]}
+    return boto3_mocker, boto3_client
+
+
+def test_get_ecr_credentials_is_cached_per_client_and_region(mocker):
+    boto3_mocker, boto3_client = _mock_boto3_client(mocker)
+    assert get_ecr_credentials("us-west-2", _PRIVATE_REPOSITORY) == ("AWS", "password")
+    assert get_ecr_credentials("us-west-2", _PRIVATE_REPOSITORY + "-2") == ("AWS", "password")
+    assert boto3_mocker.call_count == 1
+    assert boto3_client.get_authorization_token.call_count == 1
+    # A different region needs its own client and token.
+    get_ecr_credentials("us-east-1", _PRIVATE_REPOSITORY)
+    assert boto3_mocker.call_count == 2
+    assert boto3_client.get_authorization_token.call_count == 2
+
+
+def test_get_ecr_credentials_refreshes_expiring_tokens(mocker):
+    boto3_mocker, boto3_client = _mock_boto3_client(mocker, expires_in=datetime.timedelta(minutes=1))
+    get_ecr_credentials("us-west-2", _PRIVATE_REPOSITORY)
+    get_ecr_credentials("us-west-2", _PRIVATE_REPOSITORY)
+    # The client is reused, but the token is about to expire, so a new one is fetched.
+    assert boto3_mocker.call_count == 1
+    assert boto3_client.get_authorization_token.call_count == 2
+
+
+def test_get_ecr_credentials_persists_tokens_to_disk(mocker, tmp_path):
+    boto3_mocker, boto3_client = _mock_boto3_client(mocker)
+    credentials_cache_file = str(tmp_path / "ecr-credentials.json")
+    get_ecr_credentials("us-west-2", _PRIVATE_REPOSITORY, credentials_cache_file)
+    assert stat.S_IMODE(os.stat(credentials_cache_file).st_mode) == 0o600
+    # A subsequent run reuses the token from the file.
+    _ecr_credentials_cache.clear()
+    assert get_ecr_credentials("us-west-2", _PRIVATE_REPOSITORY, credentials_cache_file) == ("AWS", "password")
+    assert boto3_client.get_authorization_token.call_count == 1
+
+
+@mock_aws
+def test_get_ecr_credentials_with_moto():
+    # moto returns tokens which have already expired, so every call has to fetch a new token.
+    assert get_ecr_credentials("us-west-2", _PRIVATE_REPOSITORY) == ("AWS", "123456789012-auth-token")
+    assert get_ecr_credentials("us-west-2", _PRIVATE_REPOSITORY) == ("AWS", "123456789012-auth-token")
+    assert len(_ecr_clients) == 1
+
+
+def _create_image_manifest(config_digest="sha256:img1"):
+    return json.dumps(
+        {
+            "schemaVersion": 2,
+            "mediaType": "application/vnd.docker.distribution.manifest.v2+json",
+            "config": {"mediaType": "application/vnd.docker.container.image.v1+json", "digest": config_digest},
+            "layers": [],
+        }
+    ).encode()
+
+
+def test_get_and_put_manifest(local_registry):
+    repository = f"{local_registry.host}/my-repository"
+    assert get_manifest(repository, "1.0.0-cpu") is None
+    manifest = _create_image_manifest()
+    local_registry.put_manifest("my-repository", "1.0.0-cpu", manifest)
+    media_type, digest, body = get_manifest(repository, "1.0.0-cpu")
+    assert media_type == "application/vnd.docker.distribution.manifest.v2+json"
+    assert digest == "sha256:" + hashlib.sha256(manifest).hexdigest()
+    assert get_manifest_config_digest(body) == "sha256:img1"
+    # Tag the same image as '1.0-cpu' without pushing it again.
+    assert put_manifest(repository, "1.0-cpu", media_type, body) == digest
+    assert get_manifest(repository, "1.0-cpu")[1] == digest
+
+
+def test_get_image_manifest(local_registry):
+    repository = f"{local_registry.host}/my-repository"
+    assert get_image_manifest(repository, "1.0.0-cpu") is None
+    amd64_manifest = _create_image_manifest("sha256:img-amd64")
+    arm64_manifest = _create_image_manifest("sha256:img-arm64")
+    image_index = {"schemaVersion": 2, "mediaType": "application/vnd.oci.image.index.v1+json", "manifests": []}
+    for manifest, architecture in [(arm64_manifest, "arm64"), (amd64_manifest, "amd64")]:
+        local_registry.put_manifest("my-repository", architecture, manifest)
+        image_index["manifests"].append(
+            {
+                "mediaType": "application/vnd.docker.distribution.manifest.v2+json",
+                "digest": "sha256:" + hashlib.sha256(manifest).hexdigest(),
+                "size": len(manifest),
+                "platform": {"os": "linux", "architecture": architecture},
+            }
+        )
+    local_registry.put_manifest(
+        "my-repository", "1.0.0-cpu", json.dumps(image_index).encode(), "application/vnd.oci.image.index.v1+json"
+    )
+    # The manifest of the image for the given platform is looked up in the image index.
+    assert get_image_manifest(repository, "1.0.0-cpu") == json.loads(amd64_manifest)
+    assert get_image_manifest(repository, "1.0.0-cpu", platform="linux/arm64") == json.loads(arm64_manifest)
+    assert get_image_manifest(repository, "amd64") == json.loads(amd64_manifest)
+    with pytest.raises(Exception, match="doesn't have an image for linux/s390x"):
+        get_image_manifest(repository, "1.0.0-cpu", platform="linux/s390x")
+
+
+def test_get_manifest_with_token_authentication(local_registry):
+    local_registry.require_token = True
+    local_registry.put_manifest("my-repository", "1.0.0-cpu", _create_image_manifest())
+    repository = f"{local_registry.host}/my-repository"
+    assert get_manifest(repository, "1.0.0-cpu", "AWS", "password") is not None
+    assert ("GET", "/token?service=local-registry&scope=repository%3Amy-repository%3Apull%2Cpush") in (
+        local_registry.requests
+    )
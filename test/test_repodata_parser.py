@@ -0,0 +1,59 @@
+from __future__ import absolute_import
+
+import io
+import json
+
+import pytest
+
+pytestmark = pytest.mark.unit
+
+from sagemaker_image_builder.repodata_parser import iter_repodata_records
+
+_REPODATA = {
+    "info": {"subdir": "linux-64"},
+    "packages": {
+        "numpy-1.24.2-py38h10c12cc_0.tar.bz2": {"name": "numpy", "version": "1.24.2", "size": 7012345, "depends": []},
+        "scipy-1.10.1-py38h10c12cc_0.tar.bz2": {"name": "scipy", "version": "1.10.1", "size": 12, "md5": None},
+    },
+    "packages.conda": {
+        "numpy-1.26.0-py311h64a7726_0.conda": {
+            "name": "numpy",
+            "version": "1.26.0",
+            "size": 8,
+            "depends": ["libblas >=3.9.0,<4.0a0", "python_abi 3.11.* *_cp311"],
+            "timestamp": 1695291130911,
+        },
+    },
+    "removed": ["numpy-1.0-0.tar.bz2"],
+    "repodata_version": 1,
+}
+
+
+def _get_all_records(repodata):
+    return [(k, v) for key in ("packages", "packages.conda") for k, v in repodata.get(key, {}).items()]
+
+
+@pytest.mark.parametrize("indent", [None, 2])
+@pytest.mark.parametrize("chunk_size", [1, 7, 1 << 20])
+def test_iter_repodata_records(indent, chunk_size):
+    stream = io.StringIO(json.dumps(_REPODATA, indent=indent))
+    assert list(iter_repodata_records(stream, chunk_size=chunk_size)) == _get_all_records(_REPODATA)
+
+
+def test_iter_repodata_records_with_package_names():
+    stream = io.StringIO(json.dumps(_REPODATA))
+    assert [fn for fn, _ in iter_repodata_records(stream, {"numpy"}, chunk_size=5)] == [
+        "numpy-1.24.2-py38h10c12cc_0.tar.bz2",
+        "numpy-1.26.0-py311h64a7726_0.conda",
+    ]
+
+
+@pytest.mark.parametrize("repodata", [{}, {"packages": {}, "packages.conda": {}}, {"info": {"subdir": "noarch"}}])
+def test_iter_repodata_records_without_packages(repodata):
+    assert list(iter_repodata_records(io.StringIO(json.dumps(repodata)), chunk_size=3)) == []
+
+
+@pytest.mark.parametrize("document", ['{"packages": {"a": {"name": "a"}', '{"packages": {"a": {"name": "a"}}]', "[]"])
+def test_iter_repodata_records_invalid(document):
+    with pytest.raises(ValueError):
+        list(iter_repodata_records(io.StringIO(document), chunk_size=4))
@@ -0,0 +1,113 @@
+from __future__ import absolute_import
+
+import json
+import threading
+
+import pytest
+
+pytestmark = pytest.mark.unit
+
+from sagemaker_image_builder.tracing import (
+    get_spans,
+    print_trace_summary,
+    reset_trace,
+    span,
+    traced,
+    write_chrome_trace,
+)
+
+
+@pytest.fixture(autouse=True)
+def clear_trace():
+    reset_trace()
+    yield
+    reset_trace()
+
+
+def test_span_nesting_and_tracks():
+    with span("build images"):
+        with span("build image", track="cpu"):
+            with span("docker build"):
+                pass
+        with span("push images"):
+            pass
+    spans = {s["name"]: s for s in get_spans()}
+    assert spans["build images"]["track"] == "main"
+    assert spans["build image"]["track"] == "cpu"
+    # Nested spans inherit the track of the enclosing span.
+    assert spans["docker build"]["track"] == "cpu"
+    # The track is restored when a span ends.
+    assert spans["push images"]["track"] == "main"
+    assert spans["build images"]["start_ns"] <= spans["docker build"]["start_ns"]
+    assert spans["docker build"]["end_ns"] <= spans["build images"]["end_ns"]
+
+
+def test_span_is_recorded_on_error():
+    with pytest.raises(ValueError):
+        with span("docker build", track="gpu"):
+            raise ValueError("build failed")
+    assert [s["name"] for s in get_spans()] == ["docker build"]
+
+
+def test_spans_of_worker_threads():
+    def _build(image_type):
+        with span("build image", track=image_type):
+            with span("docker build"):
+                pass
+
+    threads = [threading.Thread(target=_build, args=(t,)) for t in ["cpu", "gpu"]]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sorted((s["name"], s["track"]) for s in get_spans()) == [
+        ("build image", "cpu"),
+        ("build image", "gpu"),
+        ("docker build", "cpu"),
+        ("docker build", "gpu"),
+    ]
+
+
+def test_traced():
+    @traced("generate changelog")
+    def _generate(value):
+        return value * 2
+
+    assert _generate(21) == 42
+    assert _generate.__name__ == "_generate"
+    assert [s["name"] for s in get_spans()] == ["generate changelog"]
+
+
+def test_write_chrome_trace(tmp_path):
+    with span("build images", image_count=2):
+        with span("docker build", track="cpu"):
+            pass
+    trace_file = tmp_path / "trace.json"
+    write_chrome_trace(str(trace_file))
+    trace_events = json.loads(trace_file.read_text())["traceEvents"]
+    thread_names = {e["tid"]: e["args"]["name"] for e in trace_events if e["ph"] == "M"}
+    assert sorted(thread_names.values()) == ["cpu", "main"]
+    complete_events = {e["name"]: e for e in trace_events if e["ph"] == "X"}
+    assert thread_names[complete_events["build images"]["tid"]] == "main"
+    assert thread_names[complete_events["docker build"]["tid"]] == "cpu"
+    assert complete_events["build images"]["args"] == {"image_count": "2"}
+    assert complete_events["build images"]["dur"] >= complete_events["docker build"]["dur"]
+    assert complete_events["build images"]["ts"] >= 0
+
+
+def test_print_trace_summary(capsys):
+    for _ in range(2):
+        with span("docker build", track="cpu"):
+            pass
+    with span("push images"):
+        pass
+    print_trace_summary()
+    out = capsys.readouterr().out
+    assert "Top-10 Slowest Phases" in out
+    assert "dockerbuild|cpu|2|" in out.replace(" ", "")
+    assert "pushimages|main|1|" in out.replace(" ", "")
+
+
+def test_print_trace_summary_without_spans(capsys):
+    print_trace_summary()
+    assert capsys.readouterr().out == ""
@@ -0,0 +1,175 @@
+from __future__ import absolute_import
+
+import os
+import time
+
+import pytest
+
+pytestmark = pytest.mark.unit
+
+from sagemaker_image_builder.utils import (
+    VersionIndex,
+    _env_file_cache,
+    get_dir_for_version,
+    get_match_specs,
+    get_semver,
+    parse_size,
+    sizeof_fmt,
+)
+
+
+def _create_build_artifacts(build_artifacts_dir, versions_to_files):
+    for version_str, file_names in versions_to_files.items():
+        relative_dir = os.path.relpath(get_dir_for_version(get_semver(version_str)), "build_artifacts")
+        version_dir = build_artifacts_dir / relative_dir
+        os.makedirs(version_dir, exist_ok=True)
+        for file_name in file_names:
+            (version_dir / file_name).write_text("")
+
+
+@pytest.fixture
+def version_index(tmp_path):
+    build_artifacts_dir = tmp_path / "build_artifacts"
+    _create_build_artifacts(
+        build_artifacts_dir,
+        {
+            "0.9.0": ["Dockerfile", "cpu.env.out"],
+            "1.0.0": ["Dockerfile", "cpu.env.out", "gpu.env.out"],
+            "1.0.1": ["Dockerfile", "cpu.env.out"],
+            "1.0.2": ["Dockerfile"],
+            "1.2.0": ["Dockerfile", "cpu.env.out"],
+            "1.10.0": ["Dockerfile", "cpu.env.out"],
+            "1.10.1-beta": ["Dockerfile", "cpu.env.out"],
+            "2.0.0-beta": ["Dockerfile", "cpu.env.out", "source-version.txt"],
+        },
+    )
+    (build_artifacts_dir / "v2/v2.0/v2.0.0/v2.0.0-beta/source-version.txt").write_text("1.10.0")
+    # Files and directories which aren't versions are ignored.
+    (build_artifacts_dir / "README.md").write_text("")
+    os.makedirs(build_artifacts_dir / "v1" / "v1.0" / "not-a-version")
+    return VersionIndex(str(build_artifacts_dir))
+
+
+def test_version_index_get_versions(version_index):
+    assert version_index.get_versions("cpu.env.out") == [
+        get_semver("0.9.0"),
+        get_semver("1.0.0"),
+        get_semver("1.0.1"),
+        get_semver("1.2.0"),
+        get_semver("1.10.0"),
+    ]
+    assert version_index.get_versions("gpu.env.out") == [get_semver("1.0.0")]
+    assert version_index.get_versions("cpu.env.out", prerelease="beta") == [
+        get_semver("1.10.1-beta"),
+        get_semver("2.0.0-beta"),
+    ]
+    assert version_index.get_versions("unknown.env.out") == []
+
+
+def test_version_index_has_file(version_index):
+    assert version_index.has_file(get_semver("1.0.2"))
+    assert not version_index.has_file(get_semver("1.0.2"), "cpu.env.out")
+    assert version_index.has_file(get_semver("2.0.0-beta"), "cpu.env.out")
+    # The directory of 2.0.0 only exists because of its pre-release version.
+    assert not version_index.has_file(get_semver("2.0.0"))
+    assert not version_index.has_file(get_semver("3.0.0"))
+
+
+def test_version_index_latest_and_newer_versions(version_index):
+    assert version_index.get_latest_patch_version(get_semver("1.0.0"), "cpu.env.out") == get_semver("1.0.1")
+    assert version_index.get_latest_patch_version(get_semver("1.0.0")) == get_semver("1.0.2")
+    assert version_index.get_latest_patch_version(get_semver("1.1.0"), "cpu.env.out") is None
+    assert version_index.has_newer_patch_version(get_semver("1.0.0"), "cpu.env.out")
+    assert not version_index.has_newer_patch_version(get_semver("1.0.1"), "cpu.env.out")
+    # 1.10 is a newer minor version of 1, not a patch version of 1.1
+    assert not version_index.has_newer_patch_version(get_semver("1.1.0"), "cpu.env.out")
+    assert version_index.has_newer_minor_version(get_semver("1.2.0"), "cpu.env.out")
+    assert not version_index.has_newer_minor_version(get_semver("1.10.0"), "cpu.env.out")
+    assert not version_index.has_newer_major_version(get_semver("1.10.0"), "cpu.env.out")
+    assert version_index.has_newer_major_version(get_semver("0.9.0"), "cpu.env.out")
+    assert version_index.has_newer_major_version(get_semver("1.10.1-beta"), "cpu.env.out")
+    assert not version_index.has_newer_minor_version(get_semver("1.10.1-beta"), "cpu.env.out")
+
+
+def test_version_index_get_source_version(version_index):
+    assert version_index.get_source_version(get_semver("2.0.0-beta")) == get_semver("1.10.0")
+    assert version_index.get_source_version(get_semver("1.10.0")) is None
+    assert version_index.get_dir(get_semver("2.0.0-beta")).endswith("build_artifacts/v2/v2.0/v2.0.0/v2.0.0-beta")
+
+
+def test_version_index_without_build_artifacts(tmp_path):
+    version_index = VersionIndex(str(tmp_path / "build_artifacts"))
+    assert version_index.get_versions() == []
+    assert not version_index.has_newer_major_version(get_semver("1.0.0"))
+
+
+@pytest.fixture
+def mock_parse_match_specs(mocker):
+    _env_file_cache.clear()
+    yield mocker.patch(
+        "sagemaker_image_builder.utils._parse_match_specs",
+        side_effect=lambda file_path: {"ipykernel": open(file_path).read()},
+    )
+    _env_file_cache.clear()
+
+
+def _write_env_file(file_path, contents, age_seconds=60):
+    file_path.write_text(contents)
+    # Files modified in the last couple of seconds aren't cached.
+    mtime = time.time() - age_seconds
+    os.utime(file_path, (mtime, mtime))
+
+
+def test_get_match_specs_is_cached(tmp_path, mock_parse_match_specs):
+    env_out_file_path = tmp_path / "cpu.env.out"
+    _write_env_file(env_out_file_path, "conda-forge::ipykernel")
+    match_specs = get_match_specs(env_out_file_path)
+    assert get_match_specs(str(env_out_file_path)) is match_specs
+    assert mock_parse_match_specs.call_count == 1
+    # Callers can't modify the shared entry.
+    with pytest.raises(TypeError):
+        match_specs["numpy"] = "conda-forge::numpy"
+    # Modifying the file invalidates the entry.
+    _write_env_file(env_out_file_path, "conda-forge::ipykernel>=6", age_seconds=30)
+    assert get_match_specs(env_out_file_path) == {"ipykernel": "conda-forge::ipykernel>=6"}
+    assert mock_parse_match_specs.call_count == 2
+    # Missing files are never parsed.
+    assert get_match_specs(tmp_path / "gpu.env.out") == {}
+    assert mock_parse_match_specs.call_count == 2
+
+
+def test_get_match_specs_does_not_cache_recently_modified_files(tmp_path, mock_parse_match_specs):
+    env_out_file_path = tmp_path / "cpu.env.out"
+    env_out_file_path.write_text("conda-forge::ipykernel")
+    get_match_specs(env_out_file_path)
+    get_match_specs(env_out_file_path)
+    assert mock_parse_match_specs.call_count == 2
+
+
+def test_get_match_specs_evicts_least_recently_used_entries(tmp_path, mocker, mock_parse_match_specs):
+    mocker.patch("sagemaker_image_builder.utils._ENV_FILE_CACHE_MAX_ENTRIES", 2)
+    file_paths = [tmp_path / f"{i}.env.out" for i in range(3)]
+    for file_path in file_paths:
+        _write_env_file(file_path, f"conda-forge::{file_path.name}")
+    get_match_specs(file_paths[0])
+    get_match_specs(file_paths[1])
+    # Use the first file again, so that the second one is the least recently used once the third one is added.
+    get_match_specs(file_paths[0])
+    get_match_specs(file_paths[2])
+    assert mock_parse_match_specs.call_count == 3
+    get_match_specs(file_paths[0])
+    assert mock_parse_match_specs.call_count == 3
+    get_match_specs(file_paths[1])
+    assert mock_parse_match_specs.call_count == 4
+
+
+@pytest.mark.parametrize(
+    "size_str,expected_size",
+    [("1024", 1024), ("512B", 512), ("10KB", 10 * 1024), ("500MB", 500 * 1024**2), (" 1.5gb ", int(1.5 * 1024**3))],
+)
+def test_parse_size(size_str, expected_size):
+    assert parse_size(size_str) == expected_size
+
+
+def test_parse_size_of_sizeof_fmt():
+    assert parse_size(sizeof_fmt(300 * 1024**2)) == 300 * 1024**2